@@ -1,99 +1,368 @@
 # app.py
-import json
+import time
+_import_started = time.perf_counter()
+
+import asyncio
+import os
+import threading
 import uuid
 from pathlib import Path
-from datetime import timedelta
-from typing import Any, Dict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, has_request_context, stream_with_context
 from flask_cors import CORS
 
-# Firebase
-import firebase_admin
-from firebase_admin import credentials, firestore, storage
+# Config + lazily created, per-process clients (Firebase, Firestore, Storage, Gemini)
+from services import registry
 
-# Gemini
-import google.generativeai as genai
+# Gemini over REST, including the async calls used by asgi.py
+from services import gemini_service
 
 # ElevenLabs (HTTP; works with only API key + voice id)
-import requests
+from services import elevenlabs_service, audio_cache_service
+
+# Pooled outbound HTTP with retries (stats reported by /health)
+from services import http_service
+
+# PDF text extraction (spooled, process-pool engine)
+from services import pdf_service
+
+# Map-reduce summarization for long documents
+from services import summarize_service
+
+# Response cache (in-process LRU + SQLite)
+from services.cache_service import gemini_cache, make_key, bypass_requested
+
+# SSE streaming of summaries
+from services.stream_service import wants_stream, split_summary, stream_summary, sse_event
+
+# Background jobs (bounded worker pools, memory/SQLite job store)
+from services import jobs_service
+
+# Chunked (resumable) uploads and direct-to-bucket signed PUTs
+from services import upload_service
+
+# Cached signed URLs + object existence index
+from services import url_service
+
+# Stage timings, /metrics, Server-Timing and the on-demand profiler
+from services import metrics_service
+
+# Write-behind Firestore buffer (coalesced, batched, spilled to disk)
+from services import write_buffer_service
+
+# Dependency-graph runner for /report
+from services import pipeline_service
+
+# Doctor chat: local topic gate + server-side sessions with history compaction
+from services import chat_service, topic_service
+
+# Per-provider concurrency/rate budgets and single-flight coalescing
+from services import admission_service
 
-# PDF text extraction
-from pypdf import PdfReader
+# Sentence-level translation memory for /translate
+from services import translation_memory_service
+
+# Fused summary + key points + recommendations (+ translation) in one structured call
+from services import report_service
+
+# Opt-in background precompute of the requests that usually follow a summary
+from services import speculation_service
+
+# Per-page fingerprints/text of uploaded PDFs, for incremental re-analysis
+from services import document_index_service
+
+# Header/footer, layout and budget trimming of extracted PDF text before it is prompted
+from services import condense_service
 
 
 # ---------- Setup & helpers ----------
 
 HERE = Path(__file__).resolve().parent
-SECRETS_PATH = HERE / "services" / "secrets.json"
-
-def load_secrets() -> Dict[str, Any]:
-    if not SECRETS_PATH.exists():
-        raise FileNotFoundError(f"Missing secrets.json at {SECRETS_PATH}")
-    with SECRETS_PATH.open() as f:
-        return json.load(f)
-
-secrets = load_secrets()
-
-# Firebase init
-cred_path = (HERE / secrets["FIREBASE_ADMIN_PATH"]).resolve()
-if not cred_path.exists():
-    raise FileNotFoundError(
-        f"Service account JSON not found at {cred_path}. "
-        f"Update 'FIREBASE_ADMIN_PATH' in secrets.json."
-    )
 
-if not firebase_admin._apps:
-    cred = credentials.Certificate(str(cred_path))
-    firebase_admin.initialize_app(
-        cred,
-        {
-            "projectId": secrets["FIREBASE_PROJECT_ID"],
-            "storageBucket": secrets["FIREBASE_STORAGE_BUCKET"],
-        },
-    )
+# Nothing here reads secrets or opens connections at import time: clients are
+# built on first use in the serving process (safe for pre-fork servers).
+
+# Generation settings are part of the cache key; change them here, not per call.
+GEMINI_SETTINGS: Dict[str, Any] = {}
 
-db = firestore.client()
-bucket = storage.bucket()  # default bucket from config
+DEFAULT_VOICE_ID = "EXAVITQu4vr4xnSDxMaL"
 
-# Gemini init
-genai.configure(api_key=secrets["GEMINI_API_KEY"])
-GEMINI_MODEL_ID = secrets.get("GEMINI_MODEL", "gemini-2.5-flash")
-gemini_model = genai.GenerativeModel(GEMINI_MODEL_ID)
+FILE_URLS_MAX = 500
+SAVE_NOTES_MAX = 500
 
-# ElevenLabs
-ELEVEN_API_KEY = secrets["ELEVENLABS_API_KEY"]
-DEFAULT_VOICE_ID = secrets.get("ELEVENLABS_DEFAULT_VOICE_ID", "EXAVITQu4vr4xnSDxMaL")
+
+def default_voice_id() -> str:
+    return registry.secrets().get("ELEVENLABS_DEFAULT_VOICE_ID", DEFAULT_VOICE_ID)
 
 
 def upload_bytes_to_storage(bytes_data: bytes, path: str, content_type: str) -> str:
     """Upload bytes to Firebase Storage and return a signed URL (1h)."""
-    blob = bucket.blob(path)
-    blob.upload_from_string(bytes_data, content_type=content_type)
-    url = blob.generate_signed_url(
-        expiration=timedelta(hours=1),
-        version="v4",
-    )
-    return url
+    blob = registry.bucket().blob(path)
+    with metrics_service.timed("storage_upload"):
+        blob.upload_from_string(bytes_data, content_type=content_type)
+    metrics_service.STORAGE_BYTES.inc(len(bytes_data), kind="bytes")
+    url_service.mark_exists(registry.bucket(), path)
+    return signed_read_url(path)
+
+
+def upload_stream_to_storage(stream, path: str, content_type: str, size: Optional[int] = None) -> str:
+    """Upload a stream in bounded chunks (never fully in memory) and return a signed URL (1h)."""
+    with metrics_service.timed("storage_upload"):
+        sent = upload_service.stream_to_blob(registry.bucket().blob(path), stream, content_type, size)
+    metrics_service.STORAGE_BYTES.inc(sent, kind="stream")
+    url_service.mark_exists(registry.bucket(), path)
+    return signed_read_url(path)
+
+
+def upload_file_to_storage(local_path: str, path: str, content_type: str) -> str:
+    """Upload a local file (streamed from disk) and return a signed URL (1h)."""
+    with metrics_service.timed("storage_upload"):
+        registry.bucket().blob(path).upload_from_filename(local_path, content_type=content_type)
+    metrics_service.STORAGE_BYTES.inc(os.path.getsize(local_path), kind="file")
+    url_service.mark_exists(registry.bucket(), path)
+    return signed_read_url(path)
+
+
+def signed_read_url(path: str) -> str:
+    """Signed GET URL (1h) for an existing object; reused from the in-process cache while fresh."""
+    return url_service.signed_url(registry.bucket(), path)
+
+
+def cache_allowed() -> bool:
+    return not (has_request_context() and bypass_requested(request.headers))
+
+
+def generate_text(prompt: str, use_cache: Optional[bool] = None) -> str:
+    """
+    Run a Gemini prompt and return its text.
+    Identical (model, prompt, settings) are served from the cache unless the
+    client sent `X-ClariMed-No-Cache: 1` or `Cache-Control: no-cache`.
+    Pass use_cache explicitly when calling from a worker thread.
+    Identical prompts already in flight share one Gemini call; raises
+    admission_service.Overloaded when the Gemini budget is exhausted.
+    """
+    if use_cache is None:
+        use_cache = cache_allowed()
+    key = make_key(registry.gemini_model_id(), prompt, GEMINI_SETTINGS)
+    if use_cache:
+        cached = gemini_cache.get(key)
+        if cached is not None:
+            return cached
+
+    def call() -> str:
+        estimate = admission_service.estimate_tokens(prompt)
+        with admission_service.gemini.slot(estimate), metrics_service.timed("gemini"):
+            resp = registry.gemini_model().generate_content(prompt, generation_config=GEMINI_SETTINGS or None)
+            text = resp.text or ""
+        record_gemini_usage(prompt, text, resp, estimate)
+        if text:
+            gemini_cache.set(key, text)
+        return text
+
+    return admission_service.gemini_flight.do(key, call)
+
+
+async def generate_text_async(prompt: str, use_cache: bool) -> str:
+    """generate_text() over async REST (asgi.py); same cache key, so both entry points share entries."""
+    model = registry.gemini_model_id()
+    key = make_key(model, prompt, GEMINI_SETTINGS)
+    if use_cache:
+        cached = await asyncio.to_thread(gemini_cache.get, key)
+        if cached is not None:
+            return cached
+
+    with metrics_service.timed("gemini"):
+        text = await gemini_service.generate_text_async(prompt, model, GEMINI_SETTINGS or None)
+    if text:
+        await asyncio.to_thread(gemini_cache.set, key, text)
+    return text
+
+
+def summarize(source: str, prompt: str, use_cache: bool, target: Optional[str] = None) -> Tuple[str, List[str]]:
+    """(summary, key_points) from the fused report call, or from `prompt` with FUSED_REPORTS=0."""
+    if report_service.ENABLED:
+        report = report_service.generate(source, registry.gemini_model_id(), target, use_cache)
+        return report["summary"], report["key_points"]
+    return split_summary(generate_text(prompt, use_cache))
+
+
+async def summarize_async(source: str, prompt: str, use_cache: bool, target: Optional[str] = None) -> Tuple[str, List[str]]:
+    if report_service.ENABLED:
+        report = await report_service.generate_async(source, registry.gemini_model_id(), target, use_cache)
+        return report["summary"], report["key_points"]
+    return split_summary(await generate_text_async(prompt, use_cache))
+
+
+def generate_text_stream(prompt: str, use_cache: Optional[bool] = None) -> Iterator[str]:
+    """
+    Streaming variant of generate_text(): yields text chunks as Gemini produces them.
+    A cache hit is yielded as a single chunk; a completed stream is written to the cache.
+    """
+    if use_cache is None:
+        use_cache = cache_allowed()
+    key = make_key(registry.gemini_model_id(), prompt, GEMINI_SETTINGS)
+    if use_cache:
+        cached = gemini_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    estimate = admission_service.estimate_tokens(prompt)
+    # The slot is held until the stream ends (or the client goes away and the generator is closed).
+    with admission_service.gemini.slot(estimate):
+        started = time.perf_counter()
+        resp = registry.gemini_model().generate_content(prompt, generation_config=GEMINI_SETTINGS or None, stream=True)
+        for chunk in resp:
+            try:
+                piece = chunk.text or ""
+            except ValueError:
+                piece = ""  # chunk without text parts (e.g. safety metadata only)
+            if piece:
+                parts.append(piece)
+                yield piece
+        metrics_service.observe_stage("gemini_stream", time.perf_counter() - started)
+    text = "".join(parts)
+    record_gemini_usage(prompt, text, resp, estimate)
+    if text:
+        gemini_cache.set(key, text)
+
+
+def record_gemini_usage(prompt: str, text: str, resp: Any, estimate: int = 0):
+    metrics_service.GEMINI_CHARS.inc(len(prompt), direction="prompt")
+    metrics_service.GEMINI_CHARS.inc(len(text), direction="response")
+    usage = getattr(resp, "usage_metadata", None)
+    if usage is not None:
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+        response_tokens = getattr(usage, "candidates_token_count", 0) or 0
+        metrics_service.GEMINI_TOKENS.inc(prompt_tokens, direction="prompt")
+        metrics_service.GEMINI_TOKENS.inc(response_tokens, direction="response")
+    else:
+        prompt_tokens, response_tokens = estimate, admission_service.estimate_tokens(text)
+    admission_service.gemini.charge((prompt_tokens or estimate) + response_tokens - estimate)
+
+
+def sse_response(events: Iterator[str]) -> Response:
+    resp = Response(stream_with_context(events), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"  # disable proxy buffering (nginx)
+    return resp
 
 
 def error(message: str, code: int = 400):
     return jsonify({"ok": False, "error": message}), code
 
 
+def upstream_error(prefix: str, e: Exception):
+    """500 for a failed provider call; 503 + Retry-After when admission control turned it away."""
+    if isinstance(e, admission_service.Overloaded):
+        resp = error(f"{prefix}: {e}", 503)
+        resp[0].headers["Retry-After"] = str(e.retry_after)
+        return resp
+    return error(f"{prefix}: {e}", 500)
+
+
+class ApiError(Exception):
+    """Client-facing failure raised by the run_* helpers (request handlers and jobs)."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def _no_progress(stage: str, **data):
+    pass
+
+
 # ---------- Flask app ----------
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["Server-Timing", "X-ClariMed-Profile"])
+
+_started_lock = threading.Lock()
+_started_pid: Optional[int] = None
+
+
+def start_process():
+    """
+    Per-process startup, run on a worker's first request (never in a pre-fork master,
+    which must not build the Firestore client or start threads):
+    fail jobs a dead process accepted, and replay Firestore writes it never committed.
+    """
+    global _started_pid
+    if _started_pid == os.getpid():
+        return
+    with _started_lock:
+        if _started_pid == os.getpid():
+            return
+        jobs_service.reap()
+        write_buffer_service.start()
+        _started_pid = os.getpid()
+
+
+@app.before_request
+def _start_process():
+    start_process()
+
+
+@app.before_request
+def _begin_metrics():
+    g.metrics_started = time.perf_counter()
+    g.metrics_token = metrics_service.begin_request(request.headers.get("X-ClariMed-Timing") == "1")
+    g.profiler = metrics_service.start_profile() if metrics_service.profile_requested(request.headers) else None
+
+
+@app.after_request
+def _finish_metrics(resp: Response):
+    # For streamed (SSE) responses this is time-to-headers; stages keep reporting to /metrics.
+    elapsed = time.perf_counter() - g.get("metrics_started", time.perf_counter())
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics_service.REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=resp.status_code)
+    timings = metrics_service.request_timings()
+    if timings is not None:
+        resp.headers["Server-Timing"] = metrics_service.server_timing_header(timings, elapsed)
+    if g.get("profiler") is not None:
+        resp.headers["X-ClariMed-Profile"] = metrics_service.finish_profile(g.profiler)
+        g.profiler = None
+    return resp
+
+
+@app.teardown_request
+def _end_metrics(exc):
+    if g.get("profiler") is not None:
+        metrics_service.finish_profile(g.profiler)
+    token = g.get("metrics_token")
+    if token is not None:
+        try:
+            metrics_service.end_request(token)
+        except ValueError:
+            pass  # token created in another context (streamed response)
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of this process's metrics."""
+    return Response(metrics_service.render(), mimetype="text/plain; version=0.0.4")
 
 
 @app.get("/health")
 def health():
+    secrets = registry.secrets()
     return jsonify({
         "ok": True,
         "project": secrets["FIREBASE_PROJECT_ID"],
         "bucket": secrets["FIREBASE_STORAGE_BUCKET"],
-        "gemini_model": GEMINI_MODEL_ID
+        "gemini_model": registry.gemini_model_id(),
+        "startup": registry.timings(),
+        "cache": gemini_cache.stats(),
+        "http": http_service.stats(),
+        "signed_urls": url_service.stats(),
+        "firestore_writes": write_buffer_service.stats(),
+        "admission": admission_service.stats(),
+        "translation_memory": translation_memory_service.stats(),
+        "speculation": speculation_service.stats(),
+        "documents": document_index_service.stats(),
     })
 
 
@@ -102,15 +371,33 @@ def health():
 @app.post("/process-text")
 def process_text():
     """
-    Body (JSON): { "text": "..." }
+    Body (JSON): { "text": "...", "target_language": "optional" }
     Returns: { ok, summary, key_points }
+    With ?stream=1 or Accept: text/event-stream, returns SSE events instead
+    (see services/stream_service.py); the final `done` event has the same shape.
+    The same Gemini call also prepares recommendations (and, with target_language,
+    the translation) for this summary, so the follow-up calls need no Gemini call.
     """
     data = request.get_json(silent=True) or {}
     text = data.get("text")
     if not text:
         return error("Missing 'text'")
 
-    prompt = (
+    prompt = simplify_prompt(text)
+    if wants_stream(request):
+        return sse_response(stream_summary(generate_text_stream(prompt)))
+
+    target = data.get("target_language")
+    try:
+        result = run_process_text(text, target=target)
+    except Exception as e:
+        return upstream_error("Gemini error", e)
+    speculate_followups(result["summary"], target, data.get("voice_id"), cache_allowed())
+    return jsonify({"ok": True, **result})
+
+
+def simplify_prompt(text: str) -> str:
+    return (
         "You are a careful, friendly medical assistant.\n"
         "Read the following medical information and explain it clearly and calmly in plain language suitable for a 6th–8th grade reader.\n"
         "Avoid phrases like 'Here is a summary' or 'This report says' — instead, write as if you are directly explaining the situation to the patient.\n"
@@ -134,16 +421,19 @@ def process_text():
         "TEXT TO SIMPLIFY:\n"
         f"{text}"
     )
-    try:
-        resp = gemini_model.generate_content(prompt)
-        result = resp.text or ""
-        # very simple split heuristic
-        parts = result.split("\n- ")
-        summary = parts[0].strip()
-        key_points = [p.strip("- ").strip() for p in parts[1:]] if len(parts) > 1 else []
-        return jsonify({"ok": True, "summary": summary, "key_points": key_points})
-    except Exception as e:
-        return error(f"Gemini error: {e}", 500)
+
+
+def run_process_text(text: str, use_cache: Optional[bool] = None, target: Optional[str] = None) -> Dict[str, Any]:
+    """Returns { summary, key_points }."""
+    if use_cache is None:
+        use_cache = cache_allowed()
+    summary, key_points = summarize(text, simplify_prompt(text), use_cache, target)
+    return {"summary": summary, "key_points": key_points}
+
+
+async def run_process_text_async(text: str, use_cache: bool, target: Optional[str] = None) -> Dict[str, Any]:
+    summary, key_points = await summarize_async(text, simplify_prompt(text), use_cache, target)
+    return {"summary": summary, "key_points": key_points}
 
 
 @app.post("/recommendations")
@@ -157,7 +447,15 @@ def recommendations():
     if not summary:
         return error("Missing 'summary'")
 
-    prompt = (
+    try:
+        speculative = speculation_service.claim("recommendations", (summary,)) if cache_allowed() else None
+        return jsonify({"ok": True, **(speculative or run_recommendations(summary))})
+    except Exception as e:
+        return upstream_error("Gemini error", e)
+
+
+def recommendations_prompt(summary: str) -> str:
+    return (
         "You are a knowledgeable yet cautious medical advisor.\n"
         "Based on the provided medical summary, generate clear, trustworthy recommendations for the patient.\n"
         "Focus on general wellness, potential next steps, lifestyle guidance, and information about conditions mentioned.\n"
@@ -172,13 +470,28 @@ def recommendations():
         f"SUMMARY:\n{summary}"
     )
 
-    try:
-        resp = gemini_model.generate_content(prompt)
-        text = resp.text or ""
-        recs = [r.strip("- ").strip() for r in text.split("\n") if r.strip()]
-        return jsonify({"ok": True, "recommendations": recs})
-    except Exception as e:
-        return error(f"Gemini error: {e}", 500)
+
+def parse_recommendations(text: str) -> list:
+    return [r.strip("- ").strip() for r in text.split("\n") if r.strip()]
+
+
+def run_recommendations(summary: str, use_cache: Optional[bool] = None) -> Dict[str, Any]:
+    """Returns { recommendations }; served from the fused result that produced this summary, if any."""
+    if use_cache is None:
+        use_cache = cache_allowed()
+    fused = report_service.recommendations_for(summary) if use_cache else None
+    if fused is not None:
+        return {"recommendations": fused}
+    text = generate_text(recommendations_prompt(summary), use_cache)
+    return {"recommendations": parse_recommendations(text)}
+
+
+async def run_recommendations_async(summary: str, use_cache: bool) -> Dict[str, Any]:
+    fused = await asyncio.to_thread(report_service.recommendations_for, summary) if use_cache else None
+    if fused is not None:
+        return {"recommendations": fused}
+    text = await generate_text_async(recommendations_prompt(summary), use_cache)
+    return {"recommendations": parse_recommendations(text)}
 
 
 @app.post("/translate")
@@ -193,15 +506,135 @@ def translate():
     if not text or not target:
         return error("Missing 'text' or 'target_language'")
 
-    prompt = (
-        f"Translate the following text to {target}. "
-        f"Return only the translated text.\n\n{text}"
+    try:
+        speculative = speculation_service.claim("translation", (text, target)) if cache_allowed() else None
+        return jsonify({"ok": True, **(speculative or run_translate(text, target))})
+    except Exception as e:
+        return upstream_error("Gemini error", e)
+
+
+def run_translate(text: str, target: str, use_cache: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    Returns { translation }.
+    Sentences found in the translation memory are reused; the rest go to Gemini in one batch.
+    """
+    if use_cache is None:
+        use_cache = cache_allowed()
+    fused = report_service.translation_for(text, target) if use_cache else None
+    if fused is not None:
+        return {"translation": fused}
+    translation = translation_memory_service.translate_text(
+        text, target, registry.gemini_model_id(), lambda p: generate_text(p, use_cache), use_cache,
+    )
+    return {"translation": translation.strip()}
+
+
+async def run_translate_async(text: str, target: str, use_cache: bool) -> Dict[str, Any]:
+    fused = await asyncio.to_thread(report_service.translation_for, text, target) if use_cache else None
+    if fused is not None:
+        return {"translation": fused}
+    (translation,) = await translation_memory_service.translate_texts_async(
+        [text], target, registry.gemini_model_id(), lambda p: generate_text_async(p, use_cache), use_cache,
     )
+    return {"translation": translation.strip()}
+
+
+def speculate_followups(summary: str, target: Optional[str], voice_id: Optional[str], use_cache: bool):
+    """
+    Start what the client usually asks for after a summary (speculation_service; opt-in):
+    recommendations, the translation, and audio of the summary or its translation.
+    Results already in a fused report are not recomputed.
+    """
+    if not speculation_service.KINDS:
+        return
+    voice_id = voice_id or default_voice_id()
+    translate = bool(target) and target.lower() != "english"
+    if report_service.recommendations_for(summary) is None:
+        speculation_service.schedule(
+            "recommendations", (summary,), lambda: run_recommendations(summary, use_cache)
+        )
+    if not translate:
+        speculation_service.schedule("tts", (summary, voice_id), lambda: run_tts(summary, voice_id))
+        return
+    translated = report_service.translation_for(summary, target)
+    if translated is not None:
+        speculation_service.schedule("tts", (translated, voice_id), lambda: run_tts(translated, voice_id))
+        return
+
+    def translation_then_tts():
+        result = run_translate(summary, target, use_cache)
+        text = result["translation"]
+        speculation_service.schedule("tts", (text, voice_id), lambda: run_tts(text, voice_id))
+        return result
+
+    speculation_service.schedule("translation", (summary, target), translation_then_tts)
+
+
+# --------- Doctor chat ---------
+
+@app.post("/chat")
+def chat():
+    """
+    Body (JSON): { "question": "...", "session_id": "optional", "summary": "optional", "history": [optional] }
+    Returns: { ok, answer, session_id, on_topic }
+
+    The first message (no session_id) creates a session holding the report summary
+    (and any prior history); later messages only need session_id + question.
+    Off-topic questions are answered locally without calling Gemini.
+    With ?stream=1 or Accept: text/event-stream, returns SSE: `answer` { delta }
+    events, then `done` with the JSON body above (or `error`).
+    """
+    data = request.get_json(silent=True) or {}
+    question = (data.get("question") or "").strip()
+    if not question:
+        return error("Missing 'question'")
+
+    session = chat_service.load(data.get("session_id") or "")
+    if session is None:
+        session = chat_service.new_session(data.get("summary") or "", data.get("history"))
+        chat_service.save(session)
+    elif data.get("summary") and data["summary"] != session.get("summary"):
+        session = chat_service.set_summary(session, data["summary"])  # new report in the same chat window
+
+    has_context = bool(session.get("summary") or session.get("turns"))
+    on_topic, _ = topic_service.is_medical(question, has_context)
+    body = {"ok": True, "session_id": session["id"], "on_topic": on_topic}
+
+    if not on_topic:
+        body["answer"] = chat_service.OFF_TOPIC_REPLY
+        if wants_stream(request):
+            return sse_response(iter([
+                sse_event("answer", {"delta": body["answer"]}),
+                sse_event("done", body),
+            ]))
+        return jsonify(body)
+
+    prompt = chat_service.build_prompt(session, question)
+
+    def remember(answer: str):
+        chat_service.record_turn(session, question, answer, lambda p: generate_text(p, use_cache=True))
+
+    if wants_stream(request):
+        def events():
+            parts = []
+            try:
+                for piece in generate_text_stream(prompt, use_cache=False):
+                    parts.append(piece)
+                    yield sse_event("answer", {"delta": piece})
+                answer = "".join(parts).strip()
+                yield sse_event("done", {**body, "answer": answer})
+            except Exception as e:
+                yield sse_event("error", {"ok": False, "error": f"Gemini error: {e}"})
+                return
+            remember(answer)
+        return sse_response(events())
+
     try:
-        resp = gemini_model.generate_content(prompt)
-        return jsonify({"ok": True, "translation": (resp.text or "").strip()})
+        answer = generate_text(prompt, use_cache=False).strip()
     except Exception as e:
-        return error(f"Gemini error: {e}", 500)
+        return upstream_error("Gemini error", e)
+    remember(answer)
+    return jsonify({**body, "answer": answer})
 
 
 # --------- ElevenLabs TTS ---------
@@ -210,39 +643,40 @@ def translate():
 def tts():
     """
     Body (JSON): { "text": "...", "voice_id": "optional" }
-    Returns: { ok, audio_url, path }
+    Returns: { ok, audio_url, path, cached }
+    Audio is content-addressed (text, voice, model, settings): a repeat request
+    skips synthesis and upload and only mints a fresh signed URL.
     """
     data = request.get_json(silent=True) or {}
     text = data.get("text")
-    voice_id = data.get("voice_id", DEFAULT_VOICE_ID)
+    voice_id = data.get("voice_id") or default_voice_id()
 
     if not text:
         return error("Missing 'text'")
 
     try:
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
-        headers = {
-            "xi-api-key": ELEVEN_API_KEY,
-            "accept": "audio/mpeg",
-            "content-type": "application/json",
-        }
-        payload = {
-            "text": text,
-            "model_id": "eleven_multilingual_v2",  # ensure multilingual reliability
-            "voice_settings": {"stability": 0.3, "similarity_boost": 0.7},
-        }
-        r = requests.post(url, headers=headers, json=payload, timeout=60)
-        if r.status_code >= 400:
-            # log the real reason to console
-            print("ElevenLabs error:", r.status_code, r.text)
-            return error(f"ElevenLabs error {r.status_code}: {r.text}", 502)
-
-        mp3_bytes = r.content
-        storage_path = f"tts/{uuid.uuid4().hex}.mp3"
-        signed_url = upload_bytes_to_storage(mp3_bytes, storage_path, "audio/mpeg")
-        return jsonify({"ok": True, "audio_url": signed_url, "path": storage_path})
+        speculative = speculation_service.claim("tts", (text, voice_id)) if cache_allowed() else None
+        return jsonify({"ok": True, **(speculative or run_tts(text, voice_id))})
+    except elevenlabs_service.ElevenLabsError as e:
+        return error(str(e), 502)
     except Exception as e:
-        return error(f"TTS error: {e}", 500)
+        return upstream_error("TTS error", e)
+
+
+def run_tts(text: str, voice_id: str, progress=_no_progress) -> Dict[str, Any]:
+    """Synthesize (or reuse) audio for text; returns { audio_url, path, cached }."""
+    progress("synthesize")
+    # Units are synthesized concurrently (only those not stored yet) and stitched into one MP3
+    storage_path, info = audio_cache_service.get_or_synthesize(registry.bucket(), text, voice_id)
+    progress("sign")
+    return {"audio_url": signed_read_url(storage_path), "path": storage_path, "cached": info["cached"]}
+
+
+async def run_tts_async(text: str, voice_id: str) -> Dict[str, Any]:
+    bucket = await asyncio.to_thread(registry.bucket)
+    storage_path, info = await audio_cache_service.get_or_synthesize_async(bucket, text, voice_id)
+    url = await asyncio.to_thread(signed_read_url, storage_path)
+    return {"audio_url": url, "path": storage_path, "cached": info["cached"]}
 
 
 # --------- Storage helpers ---------
@@ -253,6 +687,8 @@ def upload_file():
     Multipart form:
       key: file  (select a file in Postman or the frontend)
     Returns: { ok, path, url }
+    The file is streamed to the bucket in UPLOAD_CHUNK_MB pieces; large bodies
+    are spooled to disk by the form parser, never held in memory.
     """
     if "file" not in request.files:
         return error("Missing file in multipart form with key 'file'")
@@ -264,15 +700,95 @@ def upload_file():
     ext = Path(file.filename).suffix or ""
     path = f"uploads/{uuid.uuid4().hex}{ext}"
     try:
-        content = file.read()
-        # guess content type basic:
         content_type = file.mimetype or "application/octet-stream"
-        url = upload_bytes_to_storage(content, path, content_type)
+        url = upload_stream_to_storage(file.stream, path, content_type)
+        return jsonify({"ok": True, "path": path, "url": url})
+    except upload_service.UploadTooLarge as e:
+        return error(str(e), 413)
+    except Exception as e:
+        return error(f"Upload error: {e}", 500)
+
+
+@app.put("/upload")
+def upload_raw():
+    """
+    Raw body upload: PUT /upload?filename=scan.pdf with the file as the request body
+    and its Content-Type. The body is piped from the socket to the bucket chunk by
+    chunk, so memory stays at one chunk regardless of file size.
+    Returns: { ok, path, url }
+    """
+    filename = request.args.get("filename") or ""
+    ext = Path(filename).suffix or ""
+    path = f"uploads/{uuid.uuid4().hex}{ext}"
+    content_type = request.mimetype or "application/octet-stream"
+    try:
+        url = upload_stream_to_storage(request.stream, path, content_type, request.content_length)
         return jsonify({"ok": True, "path": path, "url": url})
+    except upload_service.UploadTooLarge as e:
+        return error(str(e), 413)
     except Exception as e:
         return error(f"Upload error: {e}", 500)
 
 
+@app.post("/upload-url")
+def upload_url():
+    """
+    Body (JSON): { "filename": "scan.pdf", "content_type": "application/pdf", "size": optional }
+    Returns: { ok, path, upload_url, content_type, expires_in }
+    The client PUTs the file to upload_url (with the same Content-Type header), then
+    calls /upload-complete; the bytes never pass through this server.
+    """
+    from services import gcs_service  # google-cloud-storage import is deferred to first use
+
+    data = request.get_json(silent=True) or {}
+    filename = data.get("filename") or ""
+    content_type = data.get("content_type") or "application/octet-stream"
+    try:
+        upload_service.check_size(data.get("size"))
+    except upload_service.UploadTooLarge as e:
+        return error(str(e), 413)
+
+    path = f"uploads/{uuid.uuid4().hex}{Path(filename).suffix or ''}"
+    try:
+        url = gcs_service.signed_upload_url(
+            path, content_type, upload_service.URL_EXPIRES_MIN, bucket=registry.bucket()
+        )
+    except Exception as e:
+        return error(f"Signed URL error: {e}", 500)
+    return jsonify({
+        "ok": True,
+        "path": path,
+        "upload_url": url,
+        "content_type": content_type,
+        "expires_in": upload_service.URL_EXPIRES_MIN * 60,
+    })
+
+
+@app.post("/upload-complete")
+def upload_complete():
+    """
+    Body (JSON): { "path": "uploads/..." }
+    Returns: { ok, path, url, size, content_type } once the object exists (404 before).
+    """
+    data = request.get_json(silent=True) or {}
+    path = data.get("path") or ""
+    if not path.startswith("uploads/") or ".." in path:
+        return error("Invalid 'path'")
+
+    try:
+        meta = upload_service.describe(registry.bucket().blob(path))
+    except Exception as e:
+        return error(f"Storage error: {e}", 500)
+    if meta is None:
+        return error("Upload not found; PUT the file to upload_url first", 404)
+    if upload_service.MAX_BYTES and (meta["size"] or 0) > upload_service.MAX_BYTES:
+        registry.bucket().blob(path).delete()
+        url_service.forget(registry.bucket(), path)
+        return error(f"Upload exceeds {upload_service.MAX_BYTES // (1024 * 1024)} MB", 413)
+    url_service.mark_exists(registry.bucket(), path)
+    return jsonify({"ok": True, "path": path, "url": signed_read_url(path), **meta})
+
+
 @app.get("/file-url")
 def file_url():
     """
@@ -284,15 +800,35 @@ def file_url():
         return error("Missing 'path' query param")
 
     try:
-        blob = bucket.blob(path)
-        if not blob.exists():
+        if not url_service.exists(registry.bucket(), path):
             return error("File not found", 404)
-        url = blob.generate_signed_url(expiration=timedelta(hours=1), version="v4")
-        return jsonify({"ok": True, "url": url})
+        return jsonify({"ok": True, "url": signed_read_url(path)})
     except Exception as e:
         return error(f"Signed URL error: {e}", 500)
 
 
+@app.post("/file-urls")
+def file_urls():
+    """
+    Body (JSON): { "paths": ["uploads/a.pdf", "tts/b.mp3", ...] }
+    Returns: { ok, urls: { path: url | null }, missing: [paths] }
+    One call for listing views: existence checks for unknown paths run concurrently,
+    known paths and fresh URLs come from the caches.
+    """
+    data = request.get_json(silent=True) or {}
+    paths = data.get("paths")
+    if not isinstance(paths, list) or not all(isinstance(p, str) and p for p in paths):
+        return error("'paths' must be a list of object paths")
+    if len(paths) > FILE_URLS_MAX:
+        return error(f"At most {FILE_URLS_MAX} paths per request")
+
+    try:
+        urls = url_service.sign_many(registry.bucket(), paths)
+    except Exception as e:
+        return error(f"Signed URL error: {e}", 500)
+    return jsonify({"ok": True, "urls": urls, "missing": [p for p, u in urls.items() if u is None]})
+
+
 # --------- Example Firestore route (optional) ---------
 
 @app.post("/save-note")
@@ -300,17 +836,63 @@ def save_note():
     """
     Body (JSON): { "collection": "notes", "data": { ... } }
     Returns: { ok, id }
+    The id is allocated up front; the write itself is committed in the background
+    (batched with other writes, see services/write_buffer_service.py).
     """
     data = request.get_json(silent=True) or {}
     collection = data.get("collection", "notes")
     doc_data = data.get("data", {})
     if not isinstance(doc_data, dict):
         return error("'data' must be an object")
+    try:
+        write_buffer_service.check_collection(collection)
+    except ValueError as e:
+        return error(str(e))
 
     try:
-        doc_ref = db.collection(collection).document()
-        doc_ref.set(doc_data)
-        return jsonify({"ok": True, "id": doc_ref.id})
+        doc_id = write_buffer_service.new_id(collection)
+        write_buffer_service.enqueue(f"{collection}/{doc_id}", doc_data)
+        return jsonify({"ok": True, "id": doc_id})
+    except Exception as e:
+        return error(f"Firestore error: {e}", 500)
+
+
+@app.post("/save-notes")
+def save_notes():
+    """
+    Body (JSON): { "collection": "notes", "notes": [ { ... }, ... ] }
+    Each note may also be { "id": "...", "data": { ... }, "merge": true } to update an existing document.
+    Returns: { ok, ids }   (same order as notes)
+    """
+    data = request.get_json(silent=True) or {}
+    collection = data.get("collection", "notes")
+    notes = data.get("notes")
+    if not isinstance(notes, list) or not all(isinstance(n, dict) for n in notes):
+        return error("'notes' must be a list of objects")
+    if len(notes) > SAVE_NOTES_MAX:
+        return error(f"At most {SAVE_NOTES_MAX} notes per request")
+    try:
+        write_buffer_service.check_collection(collection)
+        for note in notes:
+            if "data" in note and isinstance(note["data"], dict) and note.get("id"):
+                if not isinstance(note["id"], str) or "/" in note["id"]:
+                    raise ValueError(f"Invalid note id: {note['id']!r}")
+                write_buffer_service.check_path(f"{collection}/{note['id']}")
+    except ValueError as e:
+        return error(str(e))
+
+    try:
+        ids, writes = [], []
+        for note in notes:
+            if "data" in note and isinstance(note["data"], dict):
+                doc_id = note.get("id") or write_buffer_service.new_id(collection)
+                writes.append((f"{collection}/{doc_id}", note["data"], bool(note.get("merge"))))
+            else:
+                doc_id = write_buffer_service.new_id(collection)
+                writes.append((f"{collection}/{doc_id}", note, False))
+            ids.append(doc_id)
+        write_buffer_service.enqueue_many(writes)
+        return jsonify({"ok": True, "ids": ids})
     except Exception as e:
         return error(f"Firestore error: {e}", 500)
 
@@ -322,55 +904,380 @@ def analyze_pdf():
     """
     Multipart form:
       key: file  (PDF only for now)
-    Returns: { ok, summary, key_points, extracted_text }
+      key: document_id      (optional) the document_id an earlier analysis of this report returned;
+                            the upload is compared with that version and the delta returned as
+                            `changes`. Unknown ids are ignored and a new document_id is issued
+      key: explain_changes  (optional, "1") add `changes.what_changed` bullets (one Gemini call)
+    Returns: { ok, summary, key_points, extracted_text, page_errors, document_id, condensed?, changes? }
+    Supports the same opt-in SSE mode as /process-text; text is extracted
+    before the stream starts and `done` also carries extracted_text.
     """
-    if "file" not in request.files:
-        return error("Missing file in multipart form with key 'file'")
+    pdf_path = None
+    try:
+        pdf_path = spool_pdf_upload(request.files)
+        if wants_stream(request):
+            prompt, full_text, page_errors = pdf_summary_prompt(pdf_path, cache_allowed())
+            return sse_response(stream_summary(
+                generate_text_stream(prompt),
+                extra={"extracted_text": full_text, "page_errors": page_errors},
+            ))
+        target = request.form.get("target_language")
+        result = run_analyze_pdf(
+            pdf_path, cache_allowed(), target=target,
+            document_id=request.form.get("document_id"),
+            explain_changes=(request.form.get("explain_changes") or "").lower() in ("1", "true", "yes"),
+        )
+        speculate_followups(result["summary"], target, request.form.get("voice_id"), cache_allowed())
+        return jsonify({"ok": True, **result})
+    except (ApiError, pdf_service.PdfLimitError) as e:
+        return error(str(e), e.status)
+    except Exception as e:
+        return upstream_error("Analyze PDF error", e)
+    finally:
+        pdf_service.discard(pdf_path)
 
-    file = request.files["file"]
-    if not file.filename.lower().endswith(".pdf"):
-        return error("Please upload a PDF file for now.", 415)
 
-    try:
-        reader = PdfReader(file.stream)
-        extracted = []
-        for page in reader.pages:
-            try:
-                txt = page.extract_text() or ""
-            except Exception:
-                txt = ""
-            if txt.strip():
-                extracted.append(txt.strip())
-
-        full_text = "\n\n".join(extracted).strip()
-        if not full_text:
-            return error("Could not extract text from this PDF.", 422)
-
-        # Reuse the same summarization logic
-        prompt = (
-            "You are a helpful medical assistant. "
-            "Summarize the following text in 3–5 sentences and return 3 bullet key points.\n\n"
-            f"TEXT:\n{full_text}"
+def spool_pdf_upload(files) -> str:
+    """Spool the multipart `file` field to disk (pdf_service.spool); ApiError unless it is a PDF."""
+    file = files.get("file")
+    if file is None:
+        raise ApiError("Missing file in multipart form with key 'file'")
+    if not (file.filename or "").lower().endswith(".pdf"):
+        raise ApiError("Please upload a PDF file for now.", 415)
+    return pdf_service.spool(file.stream)
+
+
+def ocr_pdf_pages(pdf_bytes: bytes, page_count: int):
+    from services import ocr_service  # google-cloud-vision is slow to import; load only for scanned pages
+
+    return ocr_service.ocr_pdf_bytes(pdf_bytes, page_count)
+
+
+def extract_pdf_text(pdf_path: str, doc: Optional[document_index_service.Document] = None, use_cache: bool = True):
+    """Text of a spooled PDF; returns (pages, full_text, page_errors). With `doc`, known pages are reused."""
+    # Text-layer pages stay local; only scanned pages go to Vision OCR
+    if doc is None:
+        pages, page_errors = pdf_service.extract_pages(pdf_path, ocr=ocr_pdf_pages)
+    else:
+        pages, page_errors = doc.extract(ocr_pdf_pages, use_cache)
+    full_text = "\n\n".join(pages).strip()
+    if not full_text:
+        raise ApiError("Could not extract text from this PDF.", 422)
+    return pages, full_text, page_errors
+
+
+def pdf_final_prompt(source: str) -> str:
+    return (
+        "You are a helpful medical assistant. "
+        "Summarize the following text in 3–5 sentences and return 3 bullet key points.\n\n"
+        f"TEXT:\n{source}"
+    )
+
+
+def condense_pages(pages: List[str]):
+    """Page texts as they go into prompts; returns (pages, savings) (savings None when disabled)."""
+    if not condense_service.ENABLED:
+        return pages, None
+    with metrics_service.timed("condense"):
+        return condense_service.condense(pages)
+
+
+def pdf_pages(pdf_path: str, use_cache: bool, progress=_no_progress, document_id: Optional[str] = None):
+    """Extract and condense a spooled PDF; returns (pages, full_text, page_errors, doc, savings)."""
+    progress("extract")
+    doc = document_index_service.Document(pdf_path, document_id)
+    pages, full_text, page_errors = extract_pdf_text(pdf_path, doc, use_cache)
+    pages, savings = condense_pages(pages)
+    progress("summarize", pages=len(pages), page_errors=len(page_errors), reused_pages=doc.reused)
+    return pages, full_text, page_errors, doc, savings
+
+
+def pdf_source(pdf_path: str, use_cache: bool, progress=_no_progress, document_id: Optional[str] = None):
+    """Extract a spooled PDF and reduce it to summary input; returns (source, full_text, page_errors, doc, savings)."""
+    pages, full_text, page_errors, doc, savings = pdf_pages(pdf_path, use_cache, progress, document_id)
+    # Long documents: summarize chunks concurrently, then summarize the notes.
+    # Chunks break at content-defined pages, so an edited upload only re-summarizes the chunks it touched.
+    source = summarize_service.reduce_input(pages, lambda p: generate_text(p, use_cache), breaks=doc.breaks())
+    return source, full_text, page_errors, doc, savings
+
+
+def pdf_summary_prompt(pdf_path: str, use_cache: bool, progress=_no_progress):
+    """Extract a spooled PDF and build the summary prompt; returns (prompt, full_text, page_errors)."""
+    source, full_text, page_errors, _, _ = pdf_source(pdf_path, use_cache, progress)
+    return pdf_final_prompt(source), full_text, page_errors
+
+
+def pdf_changes(
+    doc: document_index_service.Document, summary: str, key_points: List[str], use_cache: bool, explain: bool = False,
+) -> Optional[Dict[str, Any]]:
+    """Delta against the last analyzed version of doc.document_id (None if there is none); remembers this one."""
+    changes = doc.changes()
+    if changes is not None and explain:
+        changes["what_changed"] = document_index_service.explain_changes(
+            doc, changes, lambda p: generate_text(p, use_cache)
         )
-        resp = gemini_model.generate_content(prompt)
-        result = resp.text or ""
-        parts = result.split("\n- ")
-        summary = parts[0].strip()
-        key_points = [p.strip("- ").strip() for p in parts[1:]] if len(parts) > 1 else []
-
-        return jsonify({
-            "ok": True,
-            "summary": summary,
-            "key_points": key_points,
-            "extracted_text": full_text
-        })
+    doc.save(summary, key_points)
+    return changes
+
+
+def run_analyze_pdf(
+    pdf_path: str,
+    use_cache: bool = True,
+    progress=_no_progress,
+    target: Optional[str] = None,
+    document_id: Optional[str] = None,
+    explain_changes: bool = False,
+) -> Dict[str, Any]:
+    """
+    Returns { summary, key_points, extracted_text, page_errors, document_id, condensed?, changes? }
+    (condensed: characters/tokens trimmed before prompting; changes: only when `document_id` is
+    one an earlier analysis returned, which the response's document_id then repeats).
+    """
+    source, full_text, page_errors, doc, savings = pdf_source(pdf_path, use_cache, progress, document_id)
+    progress("finalize")
+    summary, key_points = summarize(source, pdf_final_prompt(source), use_cache, target)
+    return pdf_result(doc, summary, key_points, full_text, page_errors, savings, use_cache, explain_changes)
+
+
+async def run_analyze_pdf_async(
+    pdf_path: str,
+    use_cache: bool = True,
+    target: Optional[str] = None,
+    document_id: Optional[str] = None,
+    explain_changes: bool = False,
+) -> Dict[str, Any]:
+    pages, full_text, page_errors, doc, savings = await asyncio.to_thread(
+        pdf_pages, pdf_path, use_cache, _no_progress, document_id
+    )
+    source = await summarize_service.reduce_input_async(
+        pages, lambda p: generate_text_async(p, use_cache), breaks=doc.breaks()
+    )
+    summary, key_points = await summarize_async(source, pdf_final_prompt(source), use_cache, target)
+    return await asyncio.to_thread(
+        pdf_result, doc, summary, key_points, full_text, page_errors, savings, use_cache, explain_changes
+    )
+
+
+def pdf_result(
+    doc: document_index_service.Document,
+    summary: str,
+    key_points: List[str],
+    full_text: str,
+    page_errors: List[Any],
+    savings: Optional[Dict[str, Any]],
+    use_cache: bool,
+    explain_changes: bool,
+) -> Dict[str, Any]:
+    result = {
+        "summary": summary,
+        "key_points": key_points,
+        "extracted_text": full_text,
+        "page_errors": page_errors,
+        "document_id": doc.document_id,
+    }
+    if savings is not None:
+        result["condensed"] = savings
+    changes = pdf_changes(doc, summary, key_points, use_cache, explain_changes)
+    if changes is not None:
+        result["changes"] = changes
+    return result
+
+
+# --------- Background jobs ---------
+
+def run_ocr(gcs_uri: str, progress=_no_progress) -> Dict[str, Any]:
+    from services import ocr_service  # google-cloud-vision is slow to import; load on first OCR job
+
+    progress("ocr")
+    return {"text": ocr_service.run_ocr_gcs(gcs_uri)}
+
+
+def _job_accepted(job_id: str):
+    return jsonify({
+        "ok": True,
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events",
+    }), 202
+
+
+@app.post("/jobs/<kind>")
+def create_job(kind: str):
+    """
+    POST /jobs/analyze-pdf   multipart form, key: file (PDF)
+    POST /jobs/tts           JSON { text, voice_id? }
+    POST /jobs/ocr           JSON { gcs_uri }
+    Returns 202: { ok, job_id, status_url, events_url }
+    """
+    try:
+        if kind == "analyze-pdf":
+            file = request.files.get("file")
+            if not file or not file.filename.lower().endswith(".pdf"):
+                return error("Missing PDF in multipart form with key 'file'", 415)
+            pdf_path = pdf_service.spool(file.stream)
+            use_cache = cache_allowed()
+            document_id = request.form.get("document_id")
+            job_id = jobs_service.submit(
+                kind,
+                lambda progress: run_analyze_pdf(pdf_path, use_cache, progress, document_id=document_id),
+                cleanup=lambda: pdf_service.discard(pdf_path),
+                spool=pdf_path,
+            )
+        elif kind == "tts":
+            data = request.get_json(silent=True) or {}
+            text = data.get("text")
+            if not text:
+                return error("Missing 'text'")
+            voice_id = data.get("voice_id") or default_voice_id()
+            job_id = jobs_service.submit(kind, lambda progress: run_tts(text, voice_id, progress))
+        elif kind == "ocr":
+            data = request.get_json(silent=True) or {}
+            gcs_uri = data.get("gcs_uri")
+            if not gcs_uri:
+                return error("Missing 'gcs_uri'")
+            job_id = jobs_service.submit(kind, lambda progress: run_ocr(gcs_uri, progress))
+        else:
+            return error(f"Unknown job type '{kind}'", 404)
+        return _job_accepted(job_id)
+    except pdf_service.PdfLimitError as e:
+        return error(str(e), e.status)
+    except jobs_service.QueueFull as e:
+        resp = error(str(e), 503)
+        resp[0].headers["Retry-After"] = "5"
+        return resp
     except Exception as e:
-        return error(f"Analyze PDF error: {e}", 500)
+        return error(f"Job error: {e}", 500)
+
+
+@app.get("/jobs/<job_id>")
+def get_job(job_id: str):
+    """Returns { ok, job: { id, kind, status, stage, result, error, created, updated } }."""
+    job = jobs_service.get(job_id)
+    if not job:
+        return error("Job not found", 404)
+    return jsonify({"ok": True, "job": job})
+
+
+@app.get("/jobs/<job_id>/events")
+def job_events(job_id: str):
+    """SSE stream of progress events (event: progress / done / failed) until the job finishes."""
+    if not jobs_service.get(job_id):
+        return error("Job not found", 404)
+
+    def events():
+        seen = 0
+        while True:
+            for ev in jobs_service.store.wait(job_id, seen, timeout=15):
+                seen = ev["seq"]
+                status = ev.get("status")
+                yield sse_event(status if status in jobs_service.TERMINAL else "progress", ev)
+                if status in jobs_service.TERMINAL:
+                    return
+            job = jobs_service.get(job_id)
+            if not job:
+                return
+            yield ": keep-alive\n\n"
+
+    return sse_response(events())
+
+
+# --------- Report pipeline (summary -> recommendations / translation -> TTS) ---------
+
+@app.post("/report")
+def report():
+    """
+    Multipart form: file (PDF), target_language?, voice_id?
+    or JSON: { "text": "...", "target_language": "Spanish", "voice_id": "optional" }
+
+    Runs the stages as a dependency graph: recommendations and translation start
+    as soon as the summary exists, TTS as soon as its input text exists, and the
+    PDF upload runs alongside everything else.
+    Streams SSE: one `stage` event { stage, ok, result | error } per finished stage,
+    then `done` { ok, results, errors }. With ?stream=0 returns the `done` body as JSON.
+    """
+    use_cache = cache_allowed()
+    pdf_path = None
+    file = request.files.get("file")
+    if file:
+        if not file.filename.lower().endswith(".pdf"):
+            return error("Please upload a PDF file for now.", 415)
+        form = request.form
+        text = None
+    else:
+        form = request.get_json(silent=True) or {}
+        text = form.get("text")
+        if not text:
+            return error("Missing 'text' or PDF 'file'")
+
+    target = (form.get("target_language") or "").strip()
+    voice_id = form.get("voice_id") or default_voice_id()
+    translate = bool(target) and target.lower() != "english"
+    fused_target = target if translate else None  # the summary call also translates; see report_service
+
+    try:
+        if file:
+            pdf_path = pdf_service.spool(file.stream)
+    except pdf_service.PdfLimitError as e:
+        return error(str(e), e.status)
+
+    Stage = pipeline_service.Stage
+    stages = {}
+    if pdf_path:
+        upload_path = f"uploads/{uuid.uuid4().hex}.pdf"
+        stages["upload"] = Stage("upload", lambda r: {
+            "path": upload_path,
+            "url": upload_file_to_storage(pdf_path, upload_path, "application/pdf"),
+        })
+        stages["summary"] = Stage("summary", lambda r: run_analyze_pdf(
+            pdf_path, use_cache, target=fused_target, document_id=form.get("document_id"),
+        ))
+    else:
+        stages["summary"] = Stage("summary", lambda r: run_process_text(text, use_cache, fused_target))
+    stages["recommendations"] = Stage(
+        "recommendations", lambda r: run_recommendations(r["summary"]["summary"], use_cache), ("summary",)
+    )
+    if translate:
+        stages["translation"] = Stage(
+            "translation", lambda r: run_translate(r["summary"]["summary"], target, use_cache), ("summary",)
+        )
+        stages["tts"] = Stage("tts", lambda r: run_tts(r["translation"]["translation"], voice_id), ("translation",))
+    else:
+        stages["tts"] = Stage("tts", lambda r: run_tts(r["summary"]["summary"], voice_id), ("summary",))
+
+    def events():
+        results, errors = {}, {}
+        try:
+            for name, ok, value in pipeline_service.run(stages):
+                if ok:
+                    results[name] = value
+                    yield {"stage": name, "ok": True, "result": value}
+                else:
+                    errors[name] = value
+                    yield {"stage": name, "ok": False, "error": value}
+        finally:
+            pdf_service.discard(pdf_path)
+        yield {"ok": "summary" in results, "results": results, "errors": errors}
+
+    if (request.args.get("stream") or "").lower() in ("0", "false", "no"):
+        *_, done = events()
+        return jsonify(done)
+
+    def sse():
+        for ev in events():
+            yield sse_event("stage" if "stage" in ev else "done", ev)
+
+    return sse_response(sse())
+
+
+registry.record("import:app", time.perf_counter() - _import_started)
+if registry.timings()["import:app"] > registry.IMPORT_BUDGET_S:
+    print(f"Warning: importing app.py took {registry.timings()['import:app']:.2f}s "
+          f"(budget {registry.IMPORT_BUDGET_S:.2f}s)")
 
 
 # ---------- Run ----------
 
 if __name__ == "__main__":
-    import os
+    # Development server. In production serve asgi.py (async upstream calls), see its docstring.
     port = int(os.getenv("PORT", "5001"))
     app.run(host="0.0.0.0", port=port, debug=True)
\ No newline at end of file
@@ -0,0 +1,373 @@
+# asgi.py
+"""
+Production entry point: the same API, with upstream calls that do not hold a thread.
+
+    pip install uvicorn aiohttp asgiref
+    uvicorn asgi:app --host 0.0.0.0 --port 5001 --workers 4      (or: python asgi.py)
+
+Routes that spend their time waiting on Gemini / ElevenLabs run as coroutines on
+the event loop, so one worker process keeps hundreds of them in flight:
+  POST /process-text, /recommendations, /translate, /tts, /analyze-pdf   (JSON responses)
+Every other request (the SSE variants of those routes, uploads, /chat, jobs, /report,
+/health, /metrics, ...) goes to the Flask app in app.py through asgiref's WSGI adapter,
+run on the loop's thread pool. Request bodies for Flask routes are spooled (memory,
+then disk) before the app sees them; a body over ASYNC_MAX_BODY_MB is refused with 413.
+The async routes validate like their Flask counterparts and call app.run_*_async,
+which sit next to the run_* helpers the Flask routes use.
+
+Upstream calls from both halves pass the same per-process admission_service
+governors; a call turned away there answers 503 with Retry-After.
+
+Blocking work never runs on the loop: PDF extraction stays in pdf_service's process
+pool, Storage SDK calls and cache lookups run in threads. Response shapes, cache keys
+and metrics are the same as app.py's, so both entry points can serve one deployment.
+
+Tunables (env vars):
+  ASYNC_BLOCKING_THREADS   threads per worker for blocking calls and Flask-routed requests (default: 64)
+  ASYNC_MAX_JSON_KB        largest JSON body accepted on the async routes (default: 2048)
+  ASYNC_MAX_BODY_MB        largest body spooled for a Flask route (default: the larger of
+                           UPLOAD_MAX_MB and PDF_MAX_BYTES, plus 1 MB for multipart framing)
+  PORT / WEB_CONCURRENCY   listen port and worker processes for `python asgi.py` (default: 5001 / 1)
+  plus ASYNC_HTTP_* (services/async_http_service.py)
+
+Concurrency ceiling, one worker (bench/run.py, Gemini stand-in median 0.6s / p95 1.8s,
+1 vCPU shared with the load generator):
+    python -m bench.run --server asgi --scenarios process-text --concurrency 256 --requests 1024
+                 concurrency 256                       concurrency 512
+    asgi.py      p50 1.1s  p95 2.3s  116 rps  0 err    p50 2.1s  p95 3.4s  144 rps  0 err
+    app.py       p50 2.0s  p95 3.5s   85 rps  0 err    p50 3.0s  p95 10.9s  77 rps  60 resets
+  At 256 in flight a worker adds almost nothing to the upstream latency; by 512 the
+  single core is saturated and requests queue, but none fail. The hard limit is
+  ASYNC_HTTP_MAX_CONNECTIONS (512) upstream calls per worker: past it calls wait for
+  a connection and fail after HTTP_CONNECT_TIMEOUT. Scale out with --workers (about
+  one per core); each worker has its own pools.
+"""
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+from werkzeug.datastructures import Headers, MultiDict
+from werkzeug.formparser import FormDataParser
+from werkzeug.http import parse_options_header
+
+import app as backend
+from services import (
+    admission_service, async_http_service, elevenlabs_service, metrics_service, pdf_service, speculation_service,
+    upload_service,
+)
+from services.cache_service import bypass_requested
+from services.stream_service import wants_stream
+
+BLOCKING_THREADS = int(os.getenv("ASYNC_BLOCKING_THREADS", "64"))
+MAX_JSON_BYTES = int(os.getenv("ASYNC_MAX_JSON_KB", "2048")) * 1024
+
+_SPOOL_MEMORY = 1024 * 1024   # request bodies above this go to a temp file
+_MULTIPART_SLACK = 1024 * 1024
+
+MAX_BODY_BYTES = int(float(os.getenv("ASYNC_MAX_BODY_MB", "0")) * 1024 * 1024) or (
+    max(upload_service.MAX_BYTES, pdf_service.MAX_BYTES) + _MULTIPART_SLACK
+)
+_TOO_LARGE = f"Request body exceeds {MAX_BODY_BYTES // (1024 * 1024)} MB"
+
+_CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-expose-headers", b"Server-Timing, X-ClariMed-Profile"),
+]
+
+# (status, body) or (status, body, extra headers)
+Result = Tuple[Any, ...]
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+# ---------- request ----------
+
+class Request:
+    """The parts of flask.Request the handlers need (args, headers, body)."""
+
+    def __init__(self, scope, receive):
+        self.scope, self.receive = scope, receive
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.headers = Headers([(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]])
+        self.args = MultiDict(parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True))
+
+    async def chunks(self):
+        while True:
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                raise ClientDisconnected()
+            yield message.get("body", b"")
+            if not message.get("more_body"):
+                return
+
+    async def json(self) -> Dict[str, Any]:
+        """Like request.get_json(silent=True) or {}."""
+        parts, size = [], 0
+        async for chunk in self.chunks():
+            size += len(chunk)
+            if size > MAX_JSON_BYTES:
+                raise backend.ApiError(f"JSON body exceeds {MAX_JSON_BYTES // 1024} KB", 413)
+            parts.append(chunk)
+        try:
+            data = json.loads(b"".join(parts) or b"null")
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    async def spool(self, limit: Optional[int] = None) -> SpooledTemporaryFile:
+        body = SpooledTemporaryFile(max_size=_SPOOL_MEMORY)
+        size = 0
+        try:
+            async for chunk in self.chunks():
+                size += len(chunk)
+                if limit is not None and size > limit:
+                    raise pdf_service.PdfLimitError(f"PDF is larger than {pdf_service.MAX_BYTES // (1024 * 1024)} MB.")
+                body.write(chunk)
+        except BaseException:
+            body.close()
+            raise
+        body.seek(0)
+        return body
+
+
+def error(message: str, code: int = 400) -> Result:
+    return code, {"ok": False, "error": message}
+
+
+def upstream_error(prefix: str, e: Exception) -> Result:
+    """app.upstream_error(): 503 + Retry-After for admission rejections, 500 otherwise."""
+    if isinstance(e, admission_service.Overloaded):
+        return 503, {"ok": False, "error": f"{prefix}: {e}"}, [(b"retry-after", str(e.retry_after).encode())]
+    return error(f"{prefix}: {e}", 500)
+
+
+def cache_allowed(req: Request) -> bool:
+    return not bypass_requested(req.headers)
+
+
+# ---------- async routes ----------
+# Same validation and response shapes as the Flask routes; the work itself is
+# app.run_*_async, next to the run_* helpers the Flask routes and jobs use.
+
+async def process_text(req: Request) -> Result:
+    data = await req.json()
+    text = data.get("text")
+    if not text:
+        return error("Missing 'text'")
+    use_cache = cache_allowed(req)
+    target = data.get("target_language")
+    try:
+        result = await backend.run_process_text_async(text, use_cache, target)
+    except Exception as e:
+        return upstream_error("Gemini error", e)
+    if speculation_service.KINDS:
+        await asyncio.to_thread(backend.speculate_followups, result["summary"], target, data.get("voice_id"), use_cache)
+    return 200, {"ok": True, **result}
+
+
+async def recommendations(req: Request) -> Result:
+    data = await req.json()
+    summary = data.get("summary")
+    if not summary:
+        return error("Missing 'summary'")
+    use_cache = cache_allowed(req)
+    try:
+        speculative = await speculation_service.claim_async("recommendations", (summary,)) if use_cache else None
+        return 200, {"ok": True, **(speculative or await backend.run_recommendations_async(summary, use_cache))}
+    except Exception as e:
+        return upstream_error("Gemini error", e)
+
+
+async def translate(req: Request) -> Result:
+    data = await req.json()
+    text = data.get("text")
+    target = data.get("target_language")
+    if not text or not target:
+        return error("Missing 'text' or 'target_language'")
+    use_cache = cache_allowed(req)
+    try:
+        speculative = await speculation_service.claim_async("translation", (text, target)) if use_cache else None
+        return 200, {"ok": True, **(speculative or await backend.run_translate_async(text, target, use_cache))}
+    except Exception as e:
+        return upstream_error("Gemini error", e)
+
+
+async def tts(req: Request) -> Result:
+    data = await req.json()
+    text = data.get("text")
+    if not text:
+        return error("Missing 'text'")
+    try:
+        voice_id = data.get("voice_id") or backend.default_voice_id()
+        speculative = await speculation_service.claim_async("tts", (text, voice_id)) if cache_allowed(req) else None
+        return 200, {"ok": True, **(speculative or await backend.run_tts_async(text, voice_id))}
+    except elevenlabs_service.ElevenLabsError as e:
+        return error(str(e), 502)
+    except Exception as e:
+        return upstream_error("TTS error", e)
+
+
+def _spool_pdf_upload(req: Request, body) -> Tuple[str, MultiDict]:
+    """Parse the multipart body (thread) and spool its PDF like app.analyze_pdf does; returns (path, form)."""
+    mimetype, options = parse_options_header(req.headers.get("Content-Type", ""))
+    _, form, files = FormDataParser().parse(body, mimetype, None, options)
+    return backend.spool_pdf_upload(files), form
+
+
+async def analyze_pdf(req: Request) -> Result:
+    pdf_path = None
+    try:
+        body = await req.spool(limit=pdf_service.MAX_BYTES + _MULTIPART_SLACK)
+        try:
+            pdf_path, form = await asyncio.to_thread(_spool_pdf_upload, req, body)
+        finally:
+            body.close()
+        use_cache = cache_allowed(req)
+        target = form.get("target_language")
+        result = await backend.run_analyze_pdf_async(
+            pdf_path, use_cache, target=target,
+            document_id=form.get("document_id"),
+            explain_changes=(form.get("explain_changes") or "").lower() in ("1", "true", "yes"),
+        )
+        if speculation_service.KINDS:
+            await asyncio.to_thread(backend.speculate_followups, result["summary"], target, form.get("voice_id"), use_cache)
+        return 200, {"ok": True, **result}
+    except (backend.ApiError, pdf_service.PdfLimitError) as e:
+        return error(str(e), e.status)
+    except Exception as e:
+        return upstream_error("Analyze PDF error", e)
+    finally:
+        pdf_service.discard(pdf_path)
+
+
+ROUTES: Dict[Tuple[str, str], Callable[[Request], Awaitable[Result]]] = {
+    ("POST", "/process-text"): process_text,
+    ("POST", "/recommendations"): recommendations,
+    ("POST", "/translate"): translate,
+    ("POST", "/tts"): tts,
+    ("POST", "/analyze-pdf"): analyze_pdf,
+}
+
+
+async def _serve(handler, req: Request, send):
+    started = time.perf_counter()
+    token = metrics_service.begin_request(req.headers.get("X-ClariMed-Timing") == "1")
+    try:
+        try:
+            status, body, *extra = await handler(req)
+        except ClientDisconnected:
+            return
+        except backend.ApiError as e:
+            status, body, *extra = error(str(e), e.status)
+        elapsed = time.perf_counter() - started
+        metrics_service.REQUEST_SECONDS.observe(elapsed, endpoint=req.path, method=req.method, status=status)
+        headers = list(extra[0]) if extra else []
+        timings = metrics_service.request_timings()
+        if timings is not None:
+            headers.append((b"server-timing", metrics_service.server_timing_header(timings, elapsed).encode("latin-1")))
+        await _send_json(send, status, body, headers)
+    finally:
+        if token is not None:
+            metrics_service.end_request(token)
+
+
+async def _send_json(send, status: int, body: Any, headers=()):
+    payload = json.dumps(body).encode("utf-8")
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(payload)).encode()),
+        *_CORS_HEADERS,
+        *headers,
+    ]})
+    await send({"type": "http.response.body", "body": payload})
+
+
+# ---------- Flask routes (asgiref's WSGI adapter, on the thread pool) ----------
+
+class _WsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs the WSGI app "thread sensitive", i.e. every request on one shared
+    # thread; the Flask app is thread-safe, so use the loop's default executor instead.
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__["run_wsgi_app"].func, thread_sensitive=False)
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+async def _wsgi(scope, receive, send):
+    """Hand the request to the Flask app; its body is spooled first, up to MAX_BODY_BYTES."""
+    length = next((v for k, v in scope["headers"] if k == b"content-length"), None)
+    if length is not None and length.isdigit() and int(length) > MAX_BODY_BYTES:
+        return await _send_json(send, 413, error(_TOO_LARGE)[1])
+    received = 0
+
+    async def capped_receive():
+        nonlocal received
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected()
+        received += len(message.get("body", b""))
+        if received > MAX_BODY_BYTES:
+            raise BodyTooLarge()
+        return message
+
+    try:
+        await _WsgiInstance(backend.app)(scope, capped_receive, send)
+    except ClientDisconnected:
+        return
+    except BodyTooLarge:   # raised while spooling, before the app has started a response
+        await _send_json(send, 413, error(_TOO_LARGE)[1])
+
+
+# ---------- ASGI app ----------
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # The default executor backs asyncio.to_thread and the Flask routes.
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=BLOCKING_THREADS, thread_name_prefix="blocking")
+            )
+            await asyncio.to_thread(backend.start_process)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await async_http_service.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    handler = ROUTES.get((scope["method"], scope["path"]))
+    if handler is not None:
+        req = Request(scope, receive)
+        if not wants_stream(req):   # SSE variants stay on the Flask routes
+            return await _serve(handler, req, send)
+    await _wsgi(scope, receive, send)
+
+
+# ---------- Run ----------
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "asgi:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "5001")),
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+    )
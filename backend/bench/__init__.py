@@ -0,0 +1,4 @@
+"""
+Offline benchmarks: local stand-ins for Gemini, ElevenLabs, Vision and Firebase,
+a generated PDF corpus and a load driver (python -m bench.run --help).
+"""
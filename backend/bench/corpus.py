@@ -0,0 +1,78 @@
+"""
+Generated multi-page lab-report style PDFs (text layer only), deterministic per seed.
+"""
+from __future__ import annotations
+import random
+from typing import List
+
+_SECTIONS = ["HISTORY:", "MEDICATIONS:", "LABS", "IMAGING:", "ASSESSMENT:", "PLAN:"]
+_LABS = [
+    ("Hemoglobin", "g/dL", 11.0, 17.5), ("WBC", "K/uL", 3.5, 12.0), ("Platelets", "K/uL", 140, 420),
+    ("Sodium", "mmol/L", 132, 147), ("Potassium", "mmol/L", 3.2, 5.4), ("Creatinine", "mg/dL", 0.5, 1.6),
+    ("Glucose", "mg/dL", 65, 180), ("ALT", "U/L", 5, 70), ("LDL Cholesterol", "mg/dL", 60, 190),
+    ("TSH", "mIU/L", 0.3, 5.5), ("HbA1c", "%", 4.6, 8.5),
+]
+_NOTES = [
+    "Patient reports intermittent headaches over the past two weeks without visual changes.",
+    "No chest pain, shortness of breath or palpitations at rest.",
+    "Continue lisinopril 10 mg daily and atorvastatin 20 mg nightly.",
+    "Chest x-ray shows no acute cardiopulmonary abnormality.",
+    "Mild hepatic steatosis noted on abdominal ultrasound.",
+    "Follow up with primary care in 4-6 weeks with repeat lipid panel.",
+    "Advised low sodium diet and 150 minutes of moderate exercise per week.",
+    "Return precautions reviewed including fever above 101F or worsening pain.",
+]
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def page_lines(rng: random.Random, page_no: int, lines: int = 40) -> List[str]:
+    out = [f"CLINICAL REPORT - PAGE {page_no}"]
+    while len(out) < lines:
+        out.append(rng.choice(_SECTIONS))
+        for _ in range(rng.randint(3, 7)):
+            if rng.random() < 0.5:
+                name, unit, lo, hi = rng.choice(_LABS)
+                out.append(f"{name}: {rng.uniform(lo * 0.8, hi * 1.2):.1f} {unit} (ref {lo}-{hi})")
+            else:
+                out.append(rng.choice(_NOTES))
+    return out[:lines]
+
+
+def make_pdf(pages: List[List[str]]) -> bytes:
+    """Minimal PDF 1.4 writer: one Helvetica text block per page."""
+    objs = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(len(pages)))
+    objs.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+    font = 3 + 2 * len(pages)
+    for i, lines in enumerate(pages):
+        body = "BT /F1 10 Tf 14 TL 50 760 Td " + " ".join(f"({_escape(l)}) Tj T*" for l in lines) + " ET"
+        stream = body.encode("latin-1", "replace")
+        objs.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 {font} 0 R >> >> /Contents {4 + 2 * i} 0 R >>".encode()
+        )
+        objs.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objs.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for n, obj in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += f"{n} 0 obj\n".encode() + obj + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{o:010d} 00000 n \n".encode() for o in offsets)
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+
+def corpus(count: int, min_pages: int = 2, max_pages: int = 30, seed: int = 7) -> List[bytes]:
+    rng = random.Random(seed)
+    docs = []
+    for _ in range(count):
+        n = rng.randint(min_pages, max_pages)
+        docs.append(make_pdf([page_lines(rng, p + 1) for p in range(n)]))
+    return docs
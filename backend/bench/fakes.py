@@ -0,0 +1,375 @@
+"""
+Local stand-ins for the external services, with realistic latency and payload sizes.
+- FakeGeminiServer / FakeElevenLabsServer: real HTTP servers on 127.0.0.1, so the
+  pooled HTTP layer, retries and serialization are exercised
+  (point GEMINI_API_BASE / ELEVENLABS_API_BASE at them)
+- HttpGeminiModel: drop-in for the SDK's GenerativeModel that talks to the fake server
+  (installed with registry.override("gemini_model", ...))
+- FakeBucket / FakeFirestore / FakeVision: in-memory Storage, Firestore and Vision clients
+
+Latency is lognormal, parameterised by median and p95, plus a per-character cost;
+LATENCY_SCALE multiplies everything (0 = instant, for smoke runs).
+"""
+from __future__ import annotations
+import json, math, random, threading, time, uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class Latency:
+    def __init__(self, median: float, p95: float, per_char: float = 0.0, scale: float = 1.0):
+        self.mu = math.log(median)
+        self.sigma = math.log(p95 / median) / 1.645 if p95 > median else 0.0
+        self.per_char = per_char
+        self.scale = scale
+
+    def sample(self, chars: int = 0) -> float:
+        return self.scale * (random.lognormvariate(self.mu, self.sigma) + self.per_char * chars)
+
+    def sleep(self, chars: int = 0):
+        if self.scale > 0:
+            time.sleep(self.sample(chars))
+
+
+# ---------- canned model output ----------
+
+_SENTENCES = [
+    "Your blood tests are mostly in the normal range.",
+    "Your cholesterol is a little higher than the target, which can raise heart risk over time.",
+    "Your kidney and liver numbers look healthy.",
+    "The scan did not show anything that needs urgent care.",
+    "Your doctor may want to repeat the test in three months.",
+    "Drinking enough water and staying active can help.",
+    "Call your doctor if you notice chest pain, shortness of breath or swelling in your legs.",
+    "Bring this report and your medicine list to your next appointment.",
+]
+
+
+def fake_generation(prompt: str) -> str:
+    """Output shaped like the real prompts ask for (summary + bullets, bullets, or a translation)."""
+    if prompt.startswith("Translate each string in the JSON array"):
+        items = json.loads(prompt.split("\n\n", 1)[-1])
+        return json.dumps(["[es] " + s for s in items], ensure_ascii=False)
+    if prompt.startswith("Translate"):
+        body = prompt.split("\n\n", 1)[-1]
+        return "[es] " + body
+    if "recommendations" in prompt[:400].lower():
+        return "\n".join(f"- {s}" for s in random.sample(_SENTENCES, 6))
+    paragraph = " ".join(random.sample(_SENTENCES, 5))
+    bullets = "\n".join(f"- {s}" for s in random.sample(_SENTENCES, 6))
+    return f"{paragraph}\n{bullets}"
+
+
+def fake_report(prompt: str) -> str:
+    """JSON answer for the fused report prompt (report_service.REPORT_SCHEMA)."""
+    report: Dict[str, Any] = {
+        "summary": " ".join(random.sample(_SENTENCES, 5)),
+        "key_points": random.sample(_SENTENCES, 6),
+        "recommendations": random.sample(_SENTENCES, 6),
+    }
+    if "- translation:" in prompt:
+        report["translation"] = {k: (["[es] " + s for s in v] if isinstance(v, list) else "[es] " + v)
+                                 for k, v in report.items()}
+    return json.dumps(report)
+
+
+def _tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+# ---------- HTTP servers ----------
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024   # the socketserver default (5) drops connection bursts
+
+
+class _Server:
+    """ThreadingHTTPServer on an ephemeral port, served from a daemon thread."""
+
+    handler_cls: type = BaseHTTPRequestHandler
+
+    def __init__(self):
+        owner = self
+
+        class Handler(self.handler_cls):
+            server_owner = owner
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = _HTTPServer(("127.0.0.1", 0), Handler)
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, like the real APIs
+    disable_nagle_algorithm = True  # headers and body are separate writes
+
+    def _body(self) -> Dict[str, Any]:
+        n = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(n) or b"{}")
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeGeminiServer(_Server):
+    """POST /v1beta/models/{model}:generateContent"""
+
+    def __init__(self, latency: Optional[Latency] = None):
+        self.latency = latency or Latency(median=0.6, p95=1.8, per_char=1 / 2000)
+
+        class Handler(_JsonHandler):
+            def do_POST(self):
+                owner = self.server_owner
+                owner.count()
+                req = self._body()
+                prompt = "".join(p.get("text", "")
+                                 for c in req.get("contents", []) for p in c.get("parts", []))
+                structured = "responseSchema" in (req.get("generationConfig") or {})
+                text = fake_report(prompt) if structured else fake_generation(prompt)
+                owner.latency.sleep(len(text))
+                body = {
+                    "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}],
+                    "usageMetadata": {"promptTokenCount": _tokens(prompt), "candidatesTokenCount": _tokens(text)},
+                }
+                self._send(200, json.dumps(body).encode(), "application/json")
+
+        self.handler_cls = Handler
+        super().__init__()
+
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz: 417-byte frames, ~38 frames per second of audio
+_MP3_HEADER = bytes([0xFF, 0xFB, 0x90, 0x64])
+_MP3_FRAME = _MP3_HEADER + bytes(417 - 4)
+_FRAMES_PER_CHAR = 38.28 / 15.0    # ~15 characters of speech per second
+
+
+def fake_mp3(chars: int) -> bytes:
+    return _MP3_FRAME * max(1, int(chars * _FRAMES_PER_CHAR))
+
+
+class FakeElevenLabsServer(_Server):
+    """POST /v1/text-to-speech/{voice_id} -> audio/mpeg"""
+
+    def __init__(self, latency: Optional[Latency] = None):
+        self.latency = latency or Latency(median=0.4, p95=1.2, per_char=1 / 1000)
+
+        class Handler(_JsonHandler):
+            def do_POST(self):
+                owner = self.server_owner
+                owner.count()
+                text = self._body().get("text", "")
+                owner.latency.sleep(len(text))
+                self._send(200, fake_mp3(len(text)), "audio/mpeg")
+
+        self.handler_cls = Handler
+        super().__init__()
+
+
+# ---------- Gemini SDK stand-in ----------
+
+class HttpGeminiModel:
+    """generate_content() over the fake REST server; supports stream=True like the SDK."""
+
+    def __init__(self, base_url: str, model: str = "gemini-2.5-flash"):
+        self.url = f"{base_url}/v1beta/models/{model}:generateContent"
+
+    def generate_content(self, prompt: str, generation_config=None, stream: bool = False):
+        from services import http_service
+
+        r = http_service.post(self.url, json={"contents": [{"parts": [{"text": prompt}]}]}, read_timeout=90)
+        r.raise_for_status()
+        data = r.json()
+        text = data["candidates"][0]["content"]["parts"][0]["text"]
+        usage = SimpleNamespace(
+            prompt_token_count=data["usageMetadata"]["promptTokenCount"],
+            candidates_token_count=data["usageMetadata"]["candidatesTokenCount"],
+        )
+        if not stream:
+            return SimpleNamespace(text=text, usage_metadata=usage)
+        return _Stream(text, usage)
+
+
+class _Stream:
+    def __init__(self, text: str, usage):
+        self._text, self.usage_metadata = text, usage
+
+    def __iter__(self) -> Iterator[SimpleNamespace]:
+        for i in range(0, len(self._text), 80):
+            yield SimpleNamespace(text=self._text[i:i + 80])
+
+
+# ---------- Storage ----------
+
+class FakeBlob:
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self.bucket, self.name = bucket, name
+        self.chunk_size = None
+        self.metadata = None
+        self.size = None
+        self.content_type = None
+
+    def _put(self, data: bytes, content_type: Optional[str]):
+        self.bucket.latency.sleep()
+        with self.bucket.lock:
+            self.bucket.objects[self.name] = (data, content_type)
+
+    def upload_from_string(self, data, content_type=None):
+        self._put(data.encode() if isinstance(data, str) else bytes(data), content_type)
+
+    def upload_from_file(self, file_obj, size=None, content_type=None, rewind=False, **_):
+        parts = []
+        while True:
+            piece = file_obj.read(self.chunk_size or 8 * 1024 * 1024)
+            if not piece:
+                break
+            parts.append(piece)
+        self._put(b"".join(parts), content_type)
+
+    def upload_from_filename(self, filename, content_type=None):
+        with open(filename, "rb") as f:
+            self._put(f.read(), content_type)
+
+    def download_as_bytes(self) -> bytes:
+        self.bucket.latency.sleep()
+        with self.bucket.lock:
+            if self.name not in self.bucket.objects:
+                raise FileNotFoundError(self.name)
+            return self.bucket.objects[self.name][0]
+
+    def exists(self) -> bool:
+        self.bucket.latency.sleep()
+        with self.bucket.lock:
+            return self.name in self.bucket.objects
+
+    def reload(self):
+        with self.bucket.lock:
+            data, self.content_type = self.bucket.objects[self.name]
+        self.size = len(data)
+
+    def delete(self):
+        with self.bucket.lock:
+            self.bucket.objects.pop(self.name, None)
+
+    def generate_signed_url(self, expiration=None, version="v4", method="GET", **_):
+        # Local V4 signing is an RSA signature; ~1 ms of CPU
+        time.sleep(0.001 * self.bucket.latency.scale)
+        return f"https://storage.example/{self.bucket.name}/{self.name}?X-Goog-Signature={uuid.uuid4().hex}"
+
+
+class FakeBucket:
+    def __init__(self, name: str = "bench-bucket", latency: Optional[Latency] = None):
+        self.name = name
+        self.latency = latency or Latency(median=0.03, p95=0.12)
+        self.objects: Dict[str, Any] = {}
+        self.lock = threading.Lock()
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def list_blobs(self, prefix: str = "") -> List[FakeBlob]:
+        with self.lock:
+            return [FakeBlob(self, n) for n in self.objects if n.startswith(prefix)]
+
+
+# ---------- Firestore ----------
+
+class _DocRef:
+    def __init__(self, db: "FakeFirestore", path: str):
+        self.db, self.path = db, path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def set(self, data, merge=False):
+        self.db.latency.sleep()
+        self.db._write(self.path, data, merge)
+
+    def collection(self, name: str) -> "_CollectionRef":
+        return _CollectionRef(self.db, f"{self.path}/{name}")
+
+
+class _CollectionRef:
+    def __init__(self, db: "FakeFirestore", path: str):
+        self.db, self.path = db, path
+
+    def document(self, doc_id: Optional[str] = None) -> _DocRef:
+        return _DocRef(self.db, f"{self.path}/{doc_id or uuid.uuid4().hex[:20]}")
+
+
+class _Batch:
+    def __init__(self, db: "FakeFirestore"):
+        self.db, self.ops = db, []
+
+    def set(self, ref: _DocRef, data, merge=False):
+        self.ops.append((ref.path, data, merge))
+
+    def commit(self):
+        self.db.latency.sleep()
+        for path, data, merge in self.ops:
+            self.db._write(path, data, merge)
+
+
+class FakeFirestore:
+    def __init__(self, latency: Optional[Latency] = None):
+        self.latency = latency or Latency(median=0.04, p95=0.15)
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def _write(self, path, data, merge):
+        with self.lock:
+            self.docs[path] = {**self.docs.get(path, {}), **data} if merge else dict(data)
+
+    def collection(self, name: str) -> _CollectionRef:
+        return _CollectionRef(self, name)
+
+    def document(self, path: str) -> _DocRef:
+        return _DocRef(self, path)
+
+    def batch(self) -> _Batch:
+        return _Batch(self)
+
+
+# ---------- Vision ----------
+
+class FakeVision:
+    """batch_annotate_files for inline PDFs, shaped like the Vision response."""
+
+    def __init__(self, latency: Optional[Latency] = None):
+        self.latency = latency or Latency(median=1.2, p95=3.0)
+
+    def batch_annotate_files(self, requests):
+        self.latency.sleep()
+        pages = [
+            SimpleNamespace(
+                error=SimpleNamespace(message=""),
+                context=SimpleNamespace(page_number=n),
+                full_text_annotation=SimpleNamespace(text=" ".join(random.sample(_SENTENCES, 4))),
+            )
+            for n in requests[0].pages
+        ]
+        return SimpleNamespace(responses=[SimpleNamespace(responses=pages)])
@@ -0,0 +1,369 @@
+"""
+Load driver for the backend against local stand-ins (no quota, no network).
+
+    cd backend
+    python -m bench.run --concurrency 8 --requests 100 --out bench.json
+    python -m bench.run --latency-scale 0 --requests 20            # quick smoke run
+    python -m bench.run --baseline bench.json                      # compare with an earlier run
+    python -m bench.run --server asgi                               # asgi.py under uvicorn
+
+Each scenario (process-text, analyze-pdf, tts, upload, file-url) is driven on its own
+over real HTTP at the given concurrency. The server under test runs in a child process
+(threaded werkzeug for app.py, uvicorn for asgi.py) so the load generator and the fake
+upstreams do not share its interpreter. The JSON report has p50/p95/p99/max latency,
+RPS and error counts per scenario, the server's peak RSS, mean server-side stage times
+(from services/metrics_service.py) and the git commit, so runs can be compared between
+commits. Gemini response caching is bypassed unless --cache is given.
+"""
+from __future__ import annotations
+import argparse, io, json, logging, multiprocessing, os, random, resource, subprocess, sys, tempfile, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from bench import corpus, fakes
+
+SCENARIOS = ("process-text", "analyze-pdf", "tts", "upload", "file-url")
+
+SEEDED_OBJECTS = [f"uploads/bench-{i}.pdf" for i in range(200)]   # present in the fake bucket for file-url
+
+
+# ---------- environment ----------
+
+def _prepare_env(args, gemini: fakes.FakeGeminiServer, eleven: fakes.FakeElevenLabsServer) -> str:
+    """Point every service at the stand-ins; must run before services/ is imported."""
+    workdir = tempfile.mkdtemp(prefix="clarimed-bench-")
+    secrets_path = os.path.join(workdir, "secrets.json")
+    with open(secrets_path, "w") as f:
+        json.dump({
+            "FIREBASE_PROJECT_ID": "bench",
+            "FIREBASE_STORAGE_BUCKET": "bench-bucket",
+            "GEMINI_API_KEY": "bench",
+            "GEMINI_MODEL": "gemini-2.5-flash",
+            "ELEVENLABS_API_KEY": "bench",
+            "ELEVENLABS_DEFAULT_VOICE_ID": "bench-voice",
+        }, f)
+    os.environ.update({
+        "CLARIMED_SECRETS_PATH": secrets_path,
+        "CLARIMED_CACHE_DIR": os.path.join(workdir, "cache"),
+        "GEMINI_API_BASE": gemini.base_url,
+        "ELEVENLABS_API_BASE": eleven.base_url,
+        "HTTP_POOL_SIZE": os.environ.get("HTTP_POOL_SIZE", str(max(10, args.concurrency * 4))),
+    })
+    return workdir
+
+
+def _install_clients(args):
+    from services import registry
+
+    scale = args.latency_scale
+    registry.override("firebase_app", object())
+    registry.override("gemini_model", fakes.HttpGeminiModel(os.environ["GEMINI_API_BASE"]))
+    registry.override("bucket", fakes.FakeBucket(latency=fakes.Latency(0.03, 0.12, scale=scale)))
+    registry.override("firestore", fakes.FakeFirestore(latency=fakes.Latency(0.04, 0.15, scale=scale)))
+    registry.override("vision_client", fakes.FakeVision(latency=fakes.Latency(1.2, 3.0, scale=scale)))
+    for path in SEEDED_OBJECTS:
+        registry.bucket().objects[path] = (b"%PDF-1.4 bench", "application/pdf")
+    return registry
+
+
+def _serve_wsgi(app):
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)   # no per-request access log
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+
+def _serve_asgi(app):
+    """asgi.py under uvicorn (one worker) on an ephemeral port, from a daemon thread."""
+    import socket
+    import uvicorn
+
+    # proto must be IPPROTO_TCP or asyncio skips TCP_NODELAY on accepted connections
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning", access_log=False, backlog=4096))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True   # runs the lifespan shutdown (closes upstream sessions)
+        thread.join(10)
+    return f"http://127.0.0.1:{sock.getsockname()[1]}", stop
+
+
+def _server_main(args, conn):
+    """Child process: import the app with the stand-ins installed, serve, answer control messages."""
+    import app as backend   # services read their env (inherited from the parent) at import time
+
+    _install_clients(args)
+    if args.server == "asgi":
+        import asgi
+        base, stop = _serve_asgi(asgi.app)
+    else:
+        base, stop = _serve_wsgi(backend.app)
+    sampler = _RssSampler()
+    sampler.start()
+    conn.send(base)
+    while True:
+        message = conn.recv()
+        if message == "peak":
+            conn.send(sampler.reset())
+        elif message == "stats":
+            conn.send({
+                "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+                "stages": _stage_means(),
+            })
+        else:
+            stop()
+            return
+
+
+class _ServerProcess:
+    def __init__(self, args):
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_server_main, args=(args, child), daemon=True)
+        self.process.start()
+        if not self.conn.poll(120):
+            raise RuntimeError("server process did not start")
+        self.base_url = self.conn.recv()
+
+    def call(self, message: str):
+        self.conn.send(message)
+        return self.conn.recv()
+
+    def stop(self):
+        self.conn.send("stop")
+        self.process.join(10)
+
+
+# ---------- measurement ----------
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0   # KiB on Linux
+
+
+class _RssSampler(threading.Thread):
+    def __init__(self, interval: float = 0.05):
+        super().__init__(daemon=True)
+        self.interval, self.peak = interval, _rss_mb()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.peak = max(self.peak, _rss_mb())
+
+    def reset(self) -> float:
+        """Peak since the last reset, in MB."""
+        peak, self.peak = max(self.peak, _rss_mb()), _rss_mb()
+        return round(peak, 1)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def _summary(latencies: List[float], errors: int, wall: float) -> Dict[str, Any]:
+    lat = sorted(latencies)
+    ms = lambda v: round(v * 1000, 1)
+    return {
+        "requests": len(lat) + errors,
+        "errors": errors,
+        "rps": round((len(lat) + errors) / wall, 2) if wall else 0.0,
+        "mean_ms": ms(sum(lat) / len(lat)) if lat else 0.0,
+        "p50_ms": ms(percentile(lat, 50)),
+        "p95_ms": ms(percentile(lat, 95)),
+        "p99_ms": ms(percentile(lat, 99)),
+        "max_ms": ms(lat[-1]) if lat else 0.0,
+    }
+
+
+def drive(name: str, make_request: Callable[[Any, int], Any], total: int, concurrency: int) -> Dict[str, Any]:
+    import requests
+
+    local = threading.local()
+    latencies: List[float] = []
+    errors: List[str] = []
+    lock = threading.Lock()
+
+    def one(i: int):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            resp = make_request(session, i)
+            ok = resp.status_code < 400
+            detail = "" if ok else f"{resp.status_code} {resp.text[:200]}"
+        except Exception as e:
+            ok, detail = False, f"{type(e).__name__}: {e}"
+        elapsed = time.perf_counter() - start
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors.append(detail)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    result = _summary(latencies, len(errors), time.perf_counter() - started)
+    if errors:
+        result["first_error"] = errors[0]
+    print(f"  {name:<13} p50 {result['p50_ms']:>8} ms  p95 {result['p95_ms']:>8} ms  "
+          f"p99 {result['p99_ms']:>8} ms  {result['rps']:>7} rps  errors {len(errors)}", file=sys.stderr)
+    return result
+
+
+# ---------- scenarios ----------
+
+def _report_text(rng: random.Random, pages: int = 2) -> str:
+    return "\n".join("\n".join(corpus.page_lines(rng, p + 1)) for p in range(pages))
+
+
+def build_scenarios(args, base: str) -> Dict[str, Callable[[Any, int], Any]]:
+    rng = random.Random(args.seed)
+    no_cache = {} if args.cache else {"X-ClariMed-No-Cache": "1"}
+    texts = [_report_text(rng, rng.randint(1, 3)) for _ in range(32)]
+    pdfs = corpus.corpus(args.pdfs, max_pages=args.max_pages, seed=args.seed)
+    uploads = [os.urandom(rng.randint(200_000, 2_000_000)) for _ in range(8)]
+
+    def process_text(s, i):
+        return s.post(f"{base}/process-text", json={"text": texts[i % len(texts)]}, headers=no_cache, timeout=300)
+
+    def analyze_pdf(s, i):
+        files = {"file": (f"report-{i}.pdf", io.BytesIO(pdfs[i % len(pdfs)]), "application/pdf")}
+        return s.post(f"{base}/analyze-pdf", files=files, headers=no_cache, timeout=600)
+
+    def tts(s, i):
+        text = " ".join(rng.sample(fakes._SENTENCES, 4)) + f" Reference number {uuid.uuid4().hex[:6]}."
+        return s.post(f"{base}/tts", json={"text": text}, timeout=300)
+
+    def upload(s, i):
+        files = {"file": (f"scan-{i}.pdf", io.BytesIO(uploads[i % len(uploads)]), "application/pdf")}
+        return s.post(f"{base}/upload", files=files, timeout=300)
+
+    def file_url(s, i):
+        return s.get(f"{base}/file-url", params={"path": SEEDED_OBJECTS[i % len(SEEDED_OBJECTS)]}, timeout=60)
+
+    return {"process-text": process_text, "analyze-pdf": analyze_pdf, "tts": tts,
+            "upload": upload, "file-url": file_url}
+
+
+# ---------- report ----------
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def _stage_means() -> Dict[str, Dict[str, float]]:
+    from services import metrics_service
+
+    out: Dict[str, Dict[str, float]] = {}
+    with metrics_service._lock:
+        rows = list(metrics_service.STAGE_SECONDS._values.items())
+    for (stage, outcome), row in rows:
+        if outcome != "ok" or not row[-1]:
+            continue
+        out[stage] = {"count": int(row[-1]), "mean_ms": round(row[-2] / row[-1] * 1000, 2)}
+    return dict(sorted(out.items()))
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Scenarios whose p95 or RPS got worse than `threshold` (fraction) versus baseline."""
+    regressions = []
+    for name, cur in report["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        if old["p95_ms"] and cur["p95_ms"] > old["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {old['p95_ms']} -> {cur['p95_ms']} ms")
+        if old["rps"] and cur["rps"] < old["rps"] * (1 - threshold):
+            regressions.append(f"{name}: rps {old['rps']} -> {cur['rps']}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ", ".join(SCENARIOS))
+    p.add_argument("--requests", type=int, default=50, help="requests per scenario")
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--latency-scale", type=float, default=1.0, help="multiply stand-in latencies (0 = instant)")
+    p.add_argument("--pdfs", type=int, default=12, help="documents in the generated PDF corpus")
+    p.add_argument("--max-pages", type=int, default=30)
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--server", choices=("wsgi", "asgi"), default="wsgi",
+                   help="threaded Flask server (app.py) or uvicorn (asgi.py)")
+    p.add_argument("--cache", action="store_true", help="allow Gemini response cache hits")
+    p.add_argument("--out", help="write the JSON report here (default: stdout)")
+    p.add_argument("--baseline", help="earlier JSON report to compare against")
+    p.add_argument("--threshold", type=float, default=0.10, help="regression threshold for --baseline")
+    args = p.parse_args(argv)
+
+    names = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in names if s not in SCENARIOS]
+    if unknown:
+        p.error(f"unknown scenario(s): {unknown}")
+
+    gemini = fakes.FakeGeminiServer(fakes.Latency(0.6, 1.8, per_char=1 / 2000, scale=args.latency_scale)).start()
+    eleven = fakes.FakeElevenLabsServer(fakes.Latency(0.4, 1.2, per_char=1 / 1000, scale=args.latency_scale)).start()
+    _prepare_env(args, gemini, eleven)
+    server = _ServerProcess(args)
+    scenarios = build_scenarios(args, server.base_url)
+
+    print(f"benchmark ({args.server}): {args.requests} requests x concurrency {args.concurrency}, "
+          f"latency scale {args.latency_scale}", file=sys.stderr)
+    results = {}
+    try:
+        for name in names:
+            server.call("peak")
+            results[name] = drive(name, scenarios[name], args.requests, args.concurrency)
+            results[name]["peak_rss_mb"] = server.call("peak")
+        stats = server.call("stats")
+    finally:
+        server.stop()
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "cpus": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "baseline")},
+        "scenarios": results,
+        "peak_rss_mb": stats["peak_rss_mb"],
+        "stages": stats["stages"],
+        "fake_calls": {"gemini": gemini.requests, "elevenlabs": eleven.requests},
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for r in regressions:
+            print("REGRESSION", r, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+"""
+Admission control for upstream providers (Gemini, ElevenLabs).
+- Governor per provider: a concurrency cap plus token buckets for requests per
+  second and units per minute (Gemini: tokens, ElevenLabs: characters). Callers
+  wait for capacity in a bounded queue; when the queue is full, or the wait would
+  pass ADMISSION_MAX_WAIT_S, Overloaded is raised at once (routes answer 503 with
+  Retry-After) instead of piling more calls onto a provider that is already
+  returning 429s
+- SingleFlight: identical calls already in flight (double-clicks, several tabs)
+  wait for the first one's result instead of making their own upstream call
+- Works from threads (slot / do) and from the event loop (slot_async / do_async)
+
+Unit budgets are charged up front from an estimate (prompt characters / 4 for
+Gemini) and corrected with charge() once the real usage is known, so a burst of
+long answers slows the next calls down rather than overrunning the quota.
+
+Budgets are per process: with several workers, divide the provider quota by the
+worker count.
+
+Tunables (env vars, 0 = unlimited):
+  GEMINI_MAX_CONCURRENT        in-flight Gemini calls (default: 32)
+  GEMINI_RPS                   Gemini requests per second (default: 30)
+  GEMINI_TPM                   Gemini tokens per minute, prompt + response (default: 1000000)
+  ELEVENLABS_MAX_CONCURRENT    in-flight ElevenLabs calls (default: 8)
+  ELEVENLABS_RPS               ElevenLabs requests per second (default: 0)
+  ELEVENLABS_CHARS_PER_MIN     ElevenLabs characters per minute (default: 0)
+  ADMISSION_QUEUE              callers allowed to wait per provider (default: 128)
+  ADMISSION_MAX_WAIT_S         longest wait for capacity before giving up (default: 10)
+"""
+from __future__ import annotations
+import asyncio, math, os, threading, time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from services import metrics_service
+
+QUEUE = int(os.getenv("ADMISSION_QUEUE", "128"))
+MAX_WAIT_S = float(os.getenv("ADMISSION_MAX_WAIT_S", "10"))
+
+_ASYNC_POLL_S = 0.05   # async waiters re-check at least this often (slot releases also wake them)
+
+
+class Overloaded(RuntimeError):
+    """The provider's budget is exhausted and its wait queue is full (or the wait timed out)."""
+
+    def __init__(self, provider: str, retry_after: int):
+        super().__init__(f"{provider} is busy; try again in {retry_after}s.")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """rate units/second, holding at most `burst`; may go negative after charge()."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate, self.burst = rate, max(burst, 1.0)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self, cost: float, now: float) -> float:
+        """Seconds until `cost` is available (0 = now)."""
+        self._refill(now)
+        cost = min(cost, self.burst)   # a single huge call must not wait forever
+        return 0.0 if self.tokens >= cost else (cost - self.tokens) / self.rate
+
+    def take(self, cost: float):
+        self.tokens -= min(cost, self.burst)
+
+    def charge(self, units: float):
+        self.tokens -= units
+
+
+class Governor:
+    def __init__(self, provider: str, max_concurrent: int, rps: float, units_per_min: float,
+                 queue: int = QUEUE, max_wait_s: float = MAX_WAIT_S):
+        self.provider = provider
+        self.max_concurrent = max_concurrent
+        self.queue, self.max_wait_s = queue, max_wait_s
+        self._requests = TokenBucket(rps, rps) if rps > 0 else None
+        self._units = TokenBucket(units_per_min / 60.0, units_per_min / 6.0) if units_per_min > 0 else None
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        self._async_waiters: Dict[Any, Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = {}
+        self._stats = {"admitted": 0, "rejected": 0, "timed_out": 0}
+
+    # --- core (call with self._cond held) ---
+
+    def _try_admit(self, cost: float) -> Optional[float]:
+        """Admit now and return 0, or return seconds to wait (None: until a slot frees up)."""
+        if self.max_concurrent and self._in_flight >= self.max_concurrent:
+            return None
+        now = time.monotonic()
+        delay = max(
+            self._requests.delay(1, now) if self._requests else 0.0,
+            self._units.delay(cost, now) if self._units else 0.0,
+        )
+        if delay > 0:
+            return delay
+        if self._requests:
+            self._requests.take(1)
+        if self._units:
+            self._units.take(cost)
+        self._in_flight += 1
+        self._stats["admitted"] += 1
+        return 0.0
+
+    def _retry_after(self, cost: float) -> int:
+        now = time.monotonic()
+        delay = max(
+            self._requests.delay(1, now) if self._requests else 0.0,
+            self._units.delay(cost, now) if self._units else 0.0,
+        )
+        return max(1, math.ceil(delay))
+
+    def _reject(self, cost: float, outcome: str) -> Overloaded:
+        self._stats["timed_out" if outcome == "timeout" else "rejected"] += 1
+        metrics_service.ADMISSION.inc(provider=self.provider, outcome=outcome)
+        return Overloaded(self.provider, self._retry_after(cost))
+
+    def _release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+            waiters = list(self._async_waiters.values())
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def _admitted(self, waited: float):
+        metrics_service.ADMISSION.inc(provider=self.provider, outcome="admitted")
+        if waited > 0.001:
+            metrics_service.observe_stage(f"{self.provider}_queue", waited)
+
+    # --- threads ---
+
+    def acquire(self, cost: float = 0):
+        started = time.monotonic()
+        deadline = started + self.max_wait_s
+        with self._cond:
+            delay = self._try_admit(cost)
+            if delay != 0.0:
+                if self._waiting >= self.queue:
+                    raise self._reject(cost, "rejected")
+                self._waiting += 1
+                try:
+                    while delay != 0.0:
+                        remaining = deadline - time.monotonic()
+                        # A budget refill that lands after the deadline is not worth waiting for.
+                        if remaining <= 0 or (delay is not None and delay > remaining):
+                            raise self._reject(cost, "timeout")
+                        self._cond.wait(remaining if delay is None else min(delay, remaining))
+                        delay = self._try_admit(cost)
+                finally:
+                    self._waiting -= 1
+        self._admitted(time.monotonic() - started)
+
+    @contextmanager
+    def slot(self, cost: float = 0):
+        self.acquire(cost)
+        try:
+            yield
+        finally:
+            self._release()
+
+    # --- event loop ---
+
+    async def acquire_async(self, cost: float = 0):
+        started = time.monotonic()
+        deadline = started + self.max_wait_s
+        with self._cond:
+            delay = self._try_admit(cost)
+            if delay == 0.0:
+                self._admitted(0)
+                return
+            if self._waiting >= self.queue:
+                raise self._reject(cost, "rejected")
+            self._waiting += 1
+            event = asyncio.Event()
+            token = object()
+            self._async_waiters[token] = (asyncio.get_running_loop(), event)
+        try:
+            while delay != 0.0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (delay is not None and delay > remaining):
+                    with self._cond:
+                        raise self._reject(cost, "timeout")
+                timeout = min(remaining, _ASYNC_POLL_S if delay is None else min(delay, _ASYNC_POLL_S * 4))
+                try:
+                    await asyncio.wait_for(event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+                with self._cond:
+                    delay = self._try_admit(cost)
+        finally:
+            with self._cond:
+                self._waiting -= 1
+                self._async_waiters.pop(token, None)
+        self._admitted(time.monotonic() - started)
+
+    @asynccontextmanager
+    async def slot_async(self, cost: float = 0):
+        await self.acquire_async(cost)
+        try:
+            yield
+        finally:
+            self._release()
+
+    # --- accounting ---
+
+    def charge(self, units: float):
+        """Bill units the up-front estimate did not cover (e.g. response tokens)."""
+        if self._units and units > 0:
+            with self._cond:
+                self._units.charge(units)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return dict(self._stats, in_flight=self._in_flight, waiting=self._waiting)
+
+
+class SingleFlight:
+    """Coalesce identical in-flight calls: followers get the leader's result (or exception)."""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result: Any = None
+            self.error: Optional[BaseException] = None
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self._lock = threading.Lock()
+        self._calls: Dict[str, "SingleFlight._Call"] = {}
+        self._tasks: Dict[Tuple[int, str], "asyncio.Future"] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = SingleFlight._Call()
+        if not leader:
+            metrics_service.ADMISSION.inc(provider=self.provider, outcome="coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        # The call runs as its own task so a caller that goes away does not cancel it for the others.
+        task_key = (id(asyncio.get_running_loop()), key)
+        task = self._tasks.get(task_key)
+        if task is None:
+            task = self._tasks[task_key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._tasks.pop(task_key, None))
+        else:
+            metrics_service.ADMISSION.inc(provider=self.provider, outcome="coalesced")
+        return await asyncio.shield(task)
+
+
+def _env(name: str, default: str) -> float:
+    return float(os.getenv(name, default))
+
+
+gemini = Governor(
+    "gemini",
+    max_concurrent=int(_env("GEMINI_MAX_CONCURRENT", "32")),
+    rps=_env("GEMINI_RPS", "30"),
+    units_per_min=_env("GEMINI_TPM", "1000000"),
+)
+elevenlabs = Governor(
+    "elevenlabs",
+    max_concurrent=int(_env("ELEVENLABS_MAX_CONCURRENT", "8")),
+    rps=_env("ELEVENLABS_RPS", "0"),
+    units_per_min=_env("ELEVENLABS_CHARS_PER_MIN", "0"),
+)
+gemini_flight = SingleFlight("gemini")
+elevenlabs_flight = SingleFlight("elevenlabs")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def stats() -> Dict[str, Any]:
+    return {"gemini": gemini.stats(), "elevenlabs": elevenlabs.stats()}
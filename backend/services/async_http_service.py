@@ -0,0 +1,108 @@
+"""
+Async counterpart of http_service for the ASGI entry point (asgi.py).
+- One aiohttp.ClientSession per event loop, sized for hundreds of in-flight calls
+  (httpx's pool degrades badly past ~100 concurrent requests; aiohttp's does not)
+- Same timeouts, retry policy (429 / 5xx / connection errors, jittered backoff,
+  Retry-After, no retry of a POST after a read timeout) and per-host counters as
+  http_service; stats() there covers both
+- Responses are read fully and returned as Response, which has the attributes
+  callers use on requests.Response (status_code, headers, content, text, json())
+
+aiohttp is only needed when serving through asgi.py; the WSGI app never imports this.
+
+Tunables (env vars):
+  ASYNC_HTTP_MAX_CONNECTIONS   open connections per process, all hosts (default: 512)
+  ASYNC_HTTP_KEEPALIVE_S       how long an idle connection is kept for reuse (default: 30)
+  plus HTTP_CONNECT_TIMEOUT / HTTP_MAX_RETRIES / HTTP_BACKOFF_* from http_service
+"""
+from __future__ import annotations
+import asyncio, json, os, time
+from typing import Any, Dict
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from services import http_service
+
+MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", "512"))
+KEEPALIVE_S = float(os.getenv("ASYNC_HTTP_KEEPALIVE_S", "30"))
+
+_sessions: Dict[int, aiohttp.ClientSession] = {}
+
+
+class Response:
+    def __init__(self, status_code: int, headers, content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", "replace")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+def _session() -> aiohttp.ClientSession:
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(id(loop))
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS, limit_per_host=0, keepalive_timeout=KEEPALIVE_S)
+        session = _sessions[id(loop)] = aiohttp.ClientSession(connector=connector)
+    return session
+
+
+async def aclose():
+    """Close this loop's session (ASGI lifespan shutdown)."""
+    session = _sessions.pop(id(asyncio.get_running_loop()), None)
+    if session is not None:
+        await session.close()
+
+
+async def request(
+    method: str,
+    url: str,
+    *,
+    read_timeout: float = 60,
+    connect_timeout: float = http_service.CONNECT_TIMEOUT,
+    retries: int = http_service.MAX_RETRIES,
+    **kwargs: Any,
+) -> Response:
+    """
+    Like http_service.request, without holding a thread while waiting.
+    Returns the last response (callers still check status); raises the last
+    connection error if every attempt failed to get a response, and any other
+    failure of a non-idempotent method straight away.
+    """
+    host = urlsplit(url).netloc
+    session = _session()
+    # `connect` includes waiting for a free pool slot: a saturated pool fails like an unreachable host.
+    timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout, sock_read=read_timeout)
+    idempotent = method.upper() in http_service.IDEMPOTENT
+    for attempt in range(retries + 1):
+        start = time.perf_counter()
+        try:
+            async with session.request(method, url, timeout=timeout, **kwargs) as r:
+                resp = Response(r.status, r.headers, await r.read())
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            http_service._record(host, time.perf_counter() - start, None, attempt > 0)
+            # Only a failure to connect proves a POST never reached the upstream.
+            never_sent = isinstance(e, (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError))
+            if attempt >= retries or not (idempotent or never_sent):
+                raise
+            await asyncio.sleep(http_service._backoff(attempt, None))
+            continue
+        http_service._record(host, time.perf_counter() - start, resp.status_code, attempt > 0)
+        if resp.status_code not in http_service.RETRY_STATUSES or attempt >= retries:
+            return resp
+        await asyncio.sleep(http_service._backoff(attempt, http_service._retry_after(resp)))
+    raise AssertionError("unreachable")
+
+
+async def post(url: str, **kwargs: Any) -> Response:
+    return await request("POST", url, **kwargs)
+
+
+async def get(url: str, **kwargs: Any) -> Response:
+    return await request("GET", url, **kwargs)
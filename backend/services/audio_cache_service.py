@@ -0,0 +1,144 @@
+"""
+Content-addressed TTS audio.
+Audio is stored at tts/{sha256}.mp3 where the hash covers (normalized text, voice_id,
+model_id, voice_settings). Multi-unit texts also store each unit at tts/seg/{sha256}.mp3
+so a text that shares sentences with an earlier one only synthesizes the new ones.
+
+A local index (TwoTierCache, namespace "tts_index") remembers which objects exist,
+so a hit costs no blob.exists() round trip.
+
+get_or_synthesize_async is the event-loop twin used by asgi.py: synthesis is
+async HTTP, blocking Storage calls run on the loop's thread pool.
+"""
+from __future__ import annotations
+import asyncio, re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from services import elevenlabs_service, metrics_service
+from services.cache_service import TwoTierCache, make_key
+
+_index = TwoTierCache("tts_index")
+
+_IO_PARALLELISM = 8
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace runs (keeping paragraph breaks) so cosmetic edits still hit."""
+    paras = [" ".join(p.split()) for p in re.split(r"\n\s*\n", text or "")]
+    return "\n\n".join(p for p in paras if p)
+
+
+def audio_key(text: str, voice_id: str, model_id: str, voice_settings: Dict[str, Any]) -> str:
+    return make_key("tts", normalize_text(text), voice_id, model_id, voice_settings)
+
+
+def _known(bucket, path: str) -> bool:
+    if _index.get(path):
+        return True
+    if bucket.blob(path).exists():
+        _index.set(path, True)
+        return True
+    return False
+
+
+def _upload(bucket, path: str, data: bytes):
+    with metrics_service.timed("storage_upload"):
+        bucket.blob(path).upload_from_string(data, content_type="audio/mpeg")
+    metrics_service.STORAGE_BYTES.inc(len(data), kind="tts")
+    _index.set(path, True)
+
+
+def _fetch_segment(bucket, path: str) -> Optional[bytes]:
+    if not _index.get(path):
+        return None  # only trust the index here; a stray exists() per sentence would cost more than it saves
+    try:
+        return bucket.blob(path).download_as_bytes()
+    except Exception:
+        _index.delete(path)
+        return None
+
+
+def _segment_paths(units: List[str], voice_id: str, model_id: str, settings: Dict[str, Any]) -> List[str]:
+    return [f"tts/seg/{audio_key(u, voice_id, model_id, settings)}.mp3" for u in units]
+
+
+def _segments(bucket, units: List[str], voice_id: str, model_id: str, settings: Dict[str, Any]) -> Tuple[List[bytes], int]:
+    """MP3 bytes per unit, reusing stored segments; returns (parts, units_synthesized)."""
+    paths = _segment_paths(units, voice_id, model_id, settings)
+    with ThreadPoolExecutor(max_workers=_IO_PARALLELISM) as pool:
+        parts: List[Optional[bytes]] = list(pool.map(metrics_service.bind(lambda p: _fetch_segment(bucket, p)), paths))
+
+    missing = [i for i, p in enumerate(parts) if p is None]
+    if missing:
+        fresh = elevenlabs_service.synthesize_units([units[i] for i in missing], voice_id, model_id, settings)
+        for i, data in zip(missing, fresh):
+            parts[i] = data
+        with ThreadPoolExecutor(max_workers=_IO_PARALLELISM) as pool:
+            list(pool.map(metrics_service.bind(lambda i: _upload(bucket, paths[i], parts[i])), missing))
+    return parts, len(missing)
+
+
+def get_or_synthesize(
+    bucket,
+    text: str,
+    voice_id: str,
+    model_id: str = elevenlabs_service.DEFAULT_MODEL_ID,
+    voice_settings: Optional[Dict[str, Any]] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Return (storage_path, info) for the audio of text; synthesizes and uploads
+    only what is not stored yet. info = {cached, units, synthesized}.
+    """
+    settings = voice_settings or elevenlabs_service.DEFAULT_VOICE_SETTINGS
+    path = f"tts/{audio_key(text, voice_id, model_id, settings)}.mp3"
+    if _known(bucket, path):
+        return path, {"cached": True, "units": 0, "synthesized": 0}
+
+    units = elevenlabs_service.split_units(text) or [normalize_text(text)]
+    if len(units) == 1:
+        data = elevenlabs_service.synthesize_units(units, voice_id, model_id, settings)[0]
+        synthesized = 1
+    else:
+        parts, synthesized = _segments(bucket, units, voice_id, model_id, settings)
+        data = elevenlabs_service.join_mp3(parts)
+    _upload(bucket, path, data)
+    return path, {"cached": False, "units": len(units), "synthesized": synthesized}
+
+
+async def _segments_async(bucket, units: List[str], voice_id: str, model_id: str, settings: Dict[str, Any]) -> Tuple[List[bytes], int]:
+    paths = _segment_paths(units, voice_id, model_id, settings)
+    parts: List[Optional[bytes]] = list(await asyncio.gather(
+        *(asyncio.to_thread(_fetch_segment, bucket, p) for p in paths)
+    ))
+    missing = [i for i, p in enumerate(parts) if p is None]
+    if missing:
+        fresh = await elevenlabs_service.synthesize_units_async([units[i] for i in missing], voice_id, model_id, settings)
+        for i, data in zip(missing, fresh):
+            parts[i] = data
+        await asyncio.gather(*(asyncio.to_thread(_upload, bucket, paths[i], parts[i]) for i in missing))
+    return parts, len(missing)
+
+
+async def get_or_synthesize_async(
+    bucket,
+    text: str,
+    voice_id: str,
+    model_id: str = elevenlabs_service.DEFAULT_MODEL_ID,
+    voice_settings: Optional[Dict[str, Any]] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """get_or_synthesize() for the event loop; same storage layout and info."""
+    settings = voice_settings or elevenlabs_service.DEFAULT_VOICE_SETTINGS
+    path = f"tts/{audio_key(text, voice_id, model_id, settings)}.mp3"
+    if await asyncio.to_thread(_known, bucket, path):
+        return path, {"cached": True, "units": 0, "synthesized": 0}
+
+    units = elevenlabs_service.split_units(text) or [normalize_text(text)]
+    if len(units) == 1:
+        data = (await elevenlabs_service.synthesize_units_async(units, voice_id, model_id, settings))[0]
+        synthesized = 1
+    else:
+        parts, synthesized = await _segments_async(bucket, units, voice_id, model_id, settings)
+        data = await asyncio.to_thread(elevenlabs_service.join_mp3, parts)
+    await asyncio.to_thread(_upload, bucket, path, data)
+    return path, {"cached": False, "units": len(units), "synthesized": synthesized}
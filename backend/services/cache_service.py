@@ -0,0 +1,266 @@
+"""
+Content-addressed two-tier cache (in-process LRU + on-disk SQLite).
+Used for Gemini responses and anything else that is a pure function of its inputs.
+
+Tunables (env vars):
+  CLARIMED_CACHE_DIR          directory for the SQLite file (default: backend/.cache)
+  CLARIMED_CACHE_TTL          seconds before an entry expires (default: 7 days, 0 = never)
+  CLARIMED_CACHE_MEM_ITEMS    max entries kept in the in-process LRU (default: 512)
+  CLARIMED_CACHE_DISK_MB      max on-disk payload size per namespace (default: 256)
+"""
+from __future__ import annotations
+import hashlib, json, os, sqlite3, threading, time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+CACHE_DIR = os.getenv(
+    "CLARIMED_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache"),
+)
+DEFAULT_TTL = int(os.getenv("CLARIMED_CACHE_TTL", str(7 * 24 * 3600)))
+DEFAULT_MEM_ITEMS = int(os.getenv("CLARIMED_CACHE_MEM_ITEMS", "512"))
+DEFAULT_DISK_BYTES = int(float(os.getenv("CLARIMED_CACHE_DISK_MB", "256")) * 1024 * 1024)
+
+
+def make_key(*parts: Any) -> str:
+    """Stable sha256 over JSON-serialisable parts (model id, prompt, settings, ...)."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def bypass_requested(headers) -> bool:
+    """True if the request asked us not to use cached results."""
+    flag = (headers.get("X-ClariMed-No-Cache") or "").strip().lower()
+    if flag in ("1", "true", "yes"):
+        return True
+    cc = (headers.get("Cache-Control") or "").lower()
+    return "no-cache" in cc or "no-store" in cc
+
+
+class TwoTierCache:
+    """
+    Bounded LRU in front of a SQLite table. Values must be JSON-serialisable.
+    The SQLite file is shared by every worker process on the host (WAL mode).
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        ttl: int = DEFAULT_TTL,
+        mem_items: int = DEFAULT_MEM_ITEMS,
+        disk_bytes: int = DEFAULT_DISK_BYTES,
+        path: Optional[str] = None,
+    ):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.mem_items = mem_items
+        self.disk_bytes = disk_bytes
+        self.path = path or os.path.join(CACHE_DIR, "cache.sqlite3")
+        self._mem: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()   # update() without a disk tier
+        self._local = threading.local()
+        self._stats = {"mem_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._disk_ok = True
+        self._init_disk()
+
+    # ---- disk tier ----
+
+    def _conn(self) -> Optional[sqlite3.Connection]:
+        if not self._disk_ok:
+            return None
+        conn = getattr(self._local, "conn", None)
+        pid = getattr(self._local, "pid", None)
+        if conn is None or pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _init_disk(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn().executescript(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL,"
+                " PRIMARY KEY (ns, key));"
+                "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (ns, accessed);"
+            )
+        except Exception as e:
+            # Memory-only is still useful; never fail a request because of the cache.
+            print("Cache disk tier disabled:", e)
+            self._disk_ok = False
+
+    def _expired(self, created: float) -> bool:
+        return bool(self.ttl) and (time.time() - created) > self.ttl
+
+    # ---- public API ----
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                created, value = hit
+                if not self._expired(created):
+                    self._mem.move_to_end(key)
+                    self._stats["mem_hits"] += 1
+                    return value
+                del self._mem[key]
+
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                "SELECT value, created FROM entries WHERE ns=? AND key=?", (self.namespace, key)
+            ).fetchone() if conn else None
+            if row is not None:
+                value_json, created = row
+                if self._expired(created):
+                    conn.execute("DELETE FROM entries WHERE ns=? AND key=?", (self.namespace, key))
+                else:
+                    conn.execute(
+                        "UPDATE entries SET accessed=? WHERE ns=? AND key=?",
+                        (time.time(), self.namespace, key),
+                    )
+                    value = json.loads(value_json)
+                    self._remember(key, created, value)
+                    with self._lock:
+                        self._stats["disk_hits"] += 1
+                    return value
+        except Exception as e:
+            print("Cache read error:", e)
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def set(self, key: str, value: Any):
+        now = time.time()
+        self._remember(key, now, value)
+        try:
+            conn = self._conn()
+            if not conn:
+                return
+            value_json = json.dumps(value, ensure_ascii=False)
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (ns, key, value, size, created, accessed) VALUES (?,?,?,?,?,?)",
+                (self.namespace, key, value_json, len(value_json), now, now),
+            )
+            with self._lock:
+                self._stats["writes"] += 1
+                writes = self._stats["writes"]
+            if writes % 64 == 0:
+                self._evict_disk(conn)
+        except Exception as e:
+            print("Cache write error:", e)
+
+    def update(self, key: str, fn: Callable[[Optional[Any]], Optional[Any]]) -> Optional[Any]:
+        """
+        Atomically replace the value for key with fn(current) (current is None when missing
+        or expired; returning None leaves the entry as it is). Returns the resulting value.
+        On disk, the read and the write are one SQLite transaction, so updates from every
+        worker on the host apply one after another; fn must be quick, it runs under the lock.
+        """
+        conn = self._conn()
+        if conn is None:
+            with self._update_lock:
+                with self._lock:
+                    hit = self._mem.get(key)
+                    current = hit[1] if hit is not None and not self._expired(hit[0]) else None
+                value = fn(current)
+                if value is not None:
+                    self._remember(key, time.time(), value)
+                return value if value is not None else current
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value, created FROM entries WHERE ns=? AND key=?", (self.namespace, key)
+            ).fetchone()
+            current = json.loads(row[0]) if row is not None and not self._expired(row[1]) else None
+            value = fn(current)
+            if value is not None:
+                now = time.time()
+                value_json = json.dumps(value, ensure_ascii=False)
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (ns, key, value, size, created, accessed) VALUES (?,?,?,?,?,?)",
+                    (self.namespace, key, value_json, len(value_json), now, now),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if value is None:
+            return current
+        self._remember(key, now, value)
+        with self._lock:
+            self._stats["writes"] += 1
+        return value
+
+    def delete(self, key: str):
+        with self._lock:
+            self._mem.pop(key, None)
+        try:
+            conn = self._conn()
+            if conn:
+                conn.execute("DELETE FROM entries WHERE ns=? AND key=?", (self.namespace, key))
+        except Exception as e:
+            print("Cache delete error:", e)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], use_cache: bool = True) -> Any:
+        """Return cached value for key, or compute, store and return it."""
+        if use_cache:
+            value = self.get(key)
+            if value is not None:
+                return value
+        value = compute()
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._stats)
+            out["mem_items"] = len(self._mem)
+        hits = out["mem_hits"] + out["disk_hits"]
+        total = hits + out["misses"]
+        out["hit_rate"] = round(hits / total, 4) if total else 0.0
+        return out
+
+    # ---- eviction ----
+
+    def _remember(self, key: str, created: float, value: Any):
+        with self._lock:
+            self._mem[key] = (created, value)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.mem_items:
+                self._mem.popitem(last=False)
+
+    def _evict_disk(self, conn: sqlite3.Connection):
+        """Drop expired rows, then least-recently-used rows until under the size cap."""
+        if self.ttl:
+            conn.execute(
+                "DELETE FROM entries WHERE ns=? AND created < ?", (self.namespace, time.time() - self.ttl)
+            )
+        (total,) = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries WHERE ns=?", (self.namespace,)
+        ).fetchone()
+        if total <= self.disk_bytes:
+            return
+        excess = total - self.disk_bytes
+        freed, doomed = 0, []
+        for key, size in conn.execute(
+            "SELECT key, size FROM entries WHERE ns=? ORDER BY accessed ASC", (self.namespace,)
+        ):
+            doomed.append((self.namespace, key))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM entries WHERE ns=? AND key=?", doomed)
+        with self._lock:
+            self._stats["evictions"] += len(doomed)
+
+
+# Shared instance for Gemini text responses.
+gemini_cache = TwoTierCache("gemini")
@@ -0,0 +1,133 @@
+"""
+Server-side chat sessions for /chat.
+- The report summary is stored once per session instead of being resent per message
+- Recent turns are kept verbatim; once they exceed the token budget the oldest ones
+  are folded into a rolling "memory" paragraph, so the prompt size stays flat
+- Sessions live in the SQLite tier of a TwoTierCache namespace only (no per-process
+  copy), so every worker on the host reads the same session; changes go through
+  TwoTierCache.update (one transaction), so concurrent turns from different workers
+  are appended one after another instead of overwriting each other. Idle sessions
+  expire on their own
+- Compaction calls Gemini outside that transaction and is applied only if the turns
+  it folded are still the oldest ones (otherwise the next turn compacts again)
+
+Tunables (env vars):
+  CHAT_HISTORY_TOKENS   token budget for verbatim turns before compaction (default: 1200)
+  CHAT_KEEP_TURNS       turns always kept verbatim after compaction (default: 4)
+  CHAT_SESSION_TTL_S    idle seconds before a session is dropped (default: 6 hours)
+"""
+from __future__ import annotations
+import os, uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from services.cache_service import TwoTierCache
+from services.summarize_service import estimate_tokens
+
+HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "1200"))
+KEEP_TURNS = int(os.getenv("CHAT_KEEP_TURNS", "4"))
+SESSION_TTL_S = int(os.getenv("CHAT_SESSION_TTL_S", str(6 * 3600)))
+
+OFF_TOPIC_REPLY = (
+    "🙏 I’m a medical assistant and can only answer health-related questions. "
+    "Sorry for the inconvenience!"
+)
+
+Session = Dict[str, Any]   # {id, summary, memory, turns: [{role, text}]}
+
+# mem_items=0: an in-process copy would go stale as soon as another worker updates the session
+_sessions = TwoTierCache("chat_sessions", ttl=SESSION_TTL_S, mem_items=0)
+
+
+def new_session(summary: str = "", history: Optional[List[Dict[str, str]]] = None) -> Session:
+    turns = [{"role": t.get("role", "user"), "text": t.get("text", "")}
+             for t in (history or []) if t.get("text")]
+    return {"id": uuid.uuid4().hex, "summary": summary, "memory": "", "turns": turns}
+
+
+def load(session_id: str) -> Optional[Session]:
+    return _sessions.get(session_id) if session_id else None
+
+
+def save(session: Session):
+    _sessions.set(session["id"], session)
+
+
+def set_summary(session: Session, summary: str) -> Session:
+    """Replace the report summary, keeping turns other workers may have added meanwhile."""
+    def apply(current: Optional[Session]) -> Session:
+        current = current or session
+        current["summary"] = summary
+        return current
+
+    return _sessions.update(session["id"], apply)
+
+
+def _format_turns(turns: List[Dict[str, str]]) -> str:
+    return "\n".join(f"{'User' if t['role'] == 'user' else 'Assistant'}: {t['text']}" for t in turns)
+
+
+def build_prompt(session: Session, question: str) -> str:
+    parts = [
+        "You are ClariMed AI — a friendly, factual medical assistant.",
+        "Your task is to help the user understand their report summary and related medical concerns.",
+        "Use clear, 6th–8th grade-level explanations. Do not give prescriptions.",
+        "Be empathetic and brief (4–6 sentences max).",
+        "",
+        "Report Summary:",
+        session.get("summary") or "(none provided)",
+    ]
+    if session.get("memory"):
+        parts += ["", "Earlier in this conversation:", session["memory"]]
+    if session.get("turns"):
+        parts += ["", "Conversation so far:", _format_turns(session["turns"])]
+    parts += ["", "User’s new question:", question]
+    return "\n".join(parts)
+
+
+def compaction_prompt(memory: str, turns: List[Dict[str, str]]) -> str:
+    return (
+        "Condense this part of a conversation between a patient and a medical assistant "
+        "into a short paragraph (max 120 words). Keep the patient's concerns, facts about "
+        "their health and anything the assistant advised; drop pleasantries.\n\n"
+        + (f"Previous notes:\n{memory}\n\n" if memory else "")
+        + f"Conversation:\n{_format_turns(turns)}"
+    )
+
+
+def _history_tokens(turns: List[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(t["text"]) for t in turns)
+
+
+def record_turn(session: Session, question: str, answer: str, condense: Callable[[str], str]) -> Session:
+    """
+    Append a question/answer pair to the stored session; when the verbatim turns exceed
+    the budget, fold all but the last KEEP_TURNS into session["memory"] with one
+    condense() call. Returns the session as stored.
+    """
+    pair = [{"role": "user", "text": question}, {"role": "assistant", "text": answer}]
+
+    def append(current: Optional[Session]) -> Session:
+        current = current or session   # expired meanwhile: start again from what we had
+        current["turns"] = current.get("turns", []) + pair
+        return current
+
+    latest = _sessions.update(session["id"], append)
+    turns = latest["turns"]
+    if _history_tokens(turns) <= HISTORY_TOKENS or len(turns) <= KEEP_TURNS:
+        return latest
+
+    old, memory = turns[:-KEEP_TURNS], latest.get("memory", "")
+    try:
+        folded = condense(compaction_prompt(memory, old)).strip()
+    except Exception as e:
+        print("Chat compaction failed (keeping full history):", e)
+        return latest
+
+    def compact(current: Optional[Session]) -> Optional[Session]:
+        if current is None or current.get("memory", "") != memory or current["turns"][:len(old)] != old:
+            return None   # another worker compacted first
+        current["memory"] = folded
+        current["turns"] = current["turns"][len(old):]
+        return current
+
+    return _sessions.update(session["id"], compact)
@@ -0,0 +1,265 @@
+"""
+Prompt-size reduction for extracted PDF text, applied before chunking/summarizing.
+Raw page text carries a lot of layout: the same header, footer and patient banner
+on every page, page numbers, words hyphenated across lines, sentences broken at
+the page margin, and tables padded out with runs of spaces or dot leaders.
+condense() removes that without touching the clinical content:
+
+- Boilerplate: lines near the top/bottom of a page that repeat on at least
+  CONDENSE_REPEAT_RATIO of the pages are kept once, on the first page they appear;
+  "Page 3 of 12"-style lines are dropped. Lines count as repeats only if they match
+  exactly apart from page numbers, dates and times: any other number (a lab value,
+  a dose) that differs keeps the line
+- Layout: soft hyphens and hyphenation breaks are joined, lines broken mid-sentence
+  are rejoined, whitespace is collapsed, and table rows (3+ columns, or a dot leader)
+  become "a | b | c"; a table header row repeated on later pages is kept once
+- Budget: if the result is still over CONDENSE_TOKEN_BUDGET, whole sections are
+  dropped lowest priority first (disclaimers, billing, signatures before anything
+  else; impression, findings, results, medications, plan last), later ones first,
+  and a marker line says how many were omitted
+
+Pages keep their count and order (a page can become empty), so page-aligned
+callers such as document_index_service's chunk breaks still line up.
+The returned stats, and the clarimed_prompt_saved_total counter, report the
+characters and estimated tokens removed.
+
+Tunables (env vars):
+  CONDENSE_PDF_TEXT       1 = condense extracted PDF text, 0 = send it as extracted (default: 1)
+  CONDENSE_TOKEN_BUDGET   estimated tokens kept per document, 0 = no limit (default: 100000)
+  CONDENSE_REPEAT_RATIO   share of pages a header/footer line must appear on (default: 0.6)
+"""
+from __future__ import annotations
+import math, os, re
+from collections import Counter
+from typing import Any, Dict, List, Set, Tuple
+
+from services import metrics_service
+from services.summarize_service import estimate_tokens
+
+ENABLED = os.getenv("CONDENSE_PDF_TEXT", "1").lower() not in ("0", "false", "no")
+TOKEN_BUDGET = int(os.getenv("CONDENSE_TOKEN_BUDGET", "100000"))
+REPEAT_RATIO = float(os.getenv("CONDENSE_REPEAT_RATIO", "0.6"))
+
+_EDGE_LINES = 3        # lines at the top and bottom of a page checked for boilerplate
+_MIN_PAGES = 3         # fewer pages than this: nothing can be told apart as boilerplate
+
+_DIGITS = re.compile(r"\d+")
+_MONTH = r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?"
+_DATE = re.compile(
+    r"\b(?:\d{4}-\d{1,2}-\d{1,2}|\d{1,2}/\d{1,2}/\d{2,4}|\d{1,2}\.\d{1,2}\.\d{4})\b"
+    r"|\b\d{1,2}:\d{2}(?::\d{2})?(?:\s*[ap]\.?m\b\.?)?"
+    rf"|\b{_MONTH}\s+\d{{1,2}},?\s+\d{{4}}\b|\b\d{{1,2}}\s+{_MONTH}\s+\d{{4}}\b",
+    re.I,
+)
+_PAGE_REF = re.compile(r"\bpage\s*\d{1,4}(?:\s*(?:of|/)\s*\d{1,4})?|\b\d{1,4}\s+of\s+\d{1,4}\s*$", re.I)
+_SPACES = re.compile(r"[ \t\u00a0\u2007\u202f]+")
+_GAP = re.compile(r"\t+|[ \u00a0]{2,}")
+_LEADER = re.compile(r"\s*(?:\.\s?|·\s?|_){4,}\s*")
+_PAGE_NUMBER = re.compile(
+    r"^\s*(?:page\s*\d{1,4}(?:\s*(?:of|/)\s*\d{1,4})?|\d{1,4}\s*(?:of|/)\s*\d{1,4}|[-–—]\s*\d{1,4}\s*[-–—])\s*$",
+    re.I,
+)
+_HYPHENATED = re.compile(r"[^\W\d_]{2,}-$")
+_LIST_ITEM = re.compile(r"^(?:[-*•▪◦]|\d{1,3}[.)]|[a-z][.)])\s")
+_OPEN_END = re.compile(r"[^.!?:;|]$")
+
+_HIGH = re.compile(
+    r"impression|assessment|diagnos|finding|conclusion|result|lab|medication|allerg|plan\b|recommend|"
+    r"follow[- ]?up|discharge|chief complaint|history of present|critical|warning|urgent",
+    re.I,
+)
+_LOW = re.compile(
+    r"disclaimer|confidential|copyright|all rights reserved|billing|insurance|invoice|privacy|"
+    r"electronically signed|signed by|dictated by|transcribed|methodology|reference range guide|"
+    r"this (?:report|document|message) (?:is|was|may)|for (?:professional|internal) use",
+    re.I,
+)
+_HEADING = re.compile(r"^(?:\d+[.)]\s+)?[A-Z][A-Z0-9 /&()\-]{2,60}:?$|^[A-Za-z][\w /&()\-]{2,60}:$")
+
+
+def _shape(line: str) -> str:
+    """A header/footer line with its page number, dates and times blanked; every other number is kept."""
+    line = _DATE.sub("#date", _PAGE_REF.sub("#page", line))
+    return _SPACES.sub(" ", line).strip().lower()
+
+
+# ---------- boilerplate ----------
+
+def _edges(lines: List[str]) -> Set[int]:
+    """Indices of the first and last _EDGE_LINES non-blank lines."""
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    return set(filled[:_EDGE_LINES] + filled[-_EDGE_LINES:])
+
+
+def _repeated_shapes(pages: List[List[str]]) -> Set[str]:
+    if len(pages) < _MIN_PAGES:
+        return set()
+    seen: Counter = Counter()
+    for lines in pages:
+        seen.update({_shape(lines[i]) for i in _edges(lines)})
+    need = max(2, math.ceil(len(pages) * REPEAT_RATIO))
+    return {shape for shape, n in seen.items() if shape and n >= need}
+
+
+def _strip_boilerplate(pages: List[List[str]]) -> Tuple[List[List[str]], int]:
+    """
+    Drop repeats of header/footer lines; lines whose values differ are content and stay.
+
+    >>> pages = [[f"Potassium {k} mmol/L", f"St. Mary Lab  printed 2024-01-0{i}", "body", f"Page {i} of 4"]
+    ...          for i, k in enumerate(["3.1", "5.9", "6.8 CRITICAL", "4.0"], 1)]
+    >>> [line for page in _strip_boilerplate(pages)[0] for line in page if "Potassium" in line or "Lab" in line]
+    ['Potassium 3.1 mmol/L', 'St. Mary Lab  printed 2024-01-01', 'Potassium 5.9 mmol/L', 'Potassium 6.8 CRITICAL mmol/L', 'Potassium 4.0 mmol/L']
+    """
+    repeated = _repeated_shapes(pages)
+    kept: Set[str] = set()
+    removed = 0
+    out = []
+    for lines in pages:
+        edges = _edges(lines)
+        page = []
+        for i, line in enumerate(lines):
+            if i in edges:
+                if _PAGE_NUMBER.match(line):
+                    removed += 1
+                    continue
+                shape = _shape(line)
+                if shape in repeated:
+                    if shape in kept:
+                        removed += 1
+                        continue
+                    kept.add(shape)
+            page.append(line)
+        out.append(page)
+    return out, removed
+
+
+# ---------- layout ----------
+
+def _compact(line: str) -> str:
+    """Collapse whitespace; table rows become pipe-separated cells."""
+    line = line.replace("\u00ad", "")   # soft hyphens
+    leader = bool(_LEADER.search(line))
+    if leader:
+        line = _LEADER.sub("  ", line)
+    cells = [c for c in _GAP.split(line.strip()) if c.strip()]
+    if len(cells) >= 3 or (leader and len(cells) == 2):
+        return " | ".join(_SPACES.sub(" ", c).strip() for c in cells)
+    return _SPACES.sub(" ", line).strip()
+
+
+def _is_row(line: str) -> bool:
+    return " | " in line
+
+
+def _reflow(lines: List[str], headers: Set[str]) -> str:
+    out: List[str] = []
+    for raw in lines:
+        line = _compact(raw)
+        if not line:
+            if out and out[-1]:
+                out.append("")
+            continue
+        if _is_row(line) and not _DIGITS.search(line):
+            # a table header row (no values) repeated on later pages
+            if line in headers:
+                continue
+            headers.add(line)
+        prev = out[-1] if out else ""
+        if prev and not _is_row(prev) and not _is_row(line) and line[0].islower() and not _LIST_ITEM.match(line):
+            if _HYPHENATED.search(prev):
+                out[-1] = prev[:-1] + line
+                continue
+            if _OPEN_END.search(prev) and not _HEADING.match(prev):
+                out[-1] = f"{prev} {line}"
+                continue
+        out.append(line)
+    return "\n".join(out).strip()
+
+
+# ---------- budget ----------
+
+def _sections(page: str) -> List[str]:
+    """Split a page at blank lines and heading lines; "\n".join() gives the page back."""
+    sections: List[List[str]] = [[]]
+    for line in page.split("\n"):
+        if (not line or _HEADING.match(line)) and any(sections[-1]):
+            sections.append([])
+        sections[-1].append(line)
+    return ["\n".join(s) for s in sections]
+
+
+def _priority(section: str, inherited: int) -> int:
+    head = section.strip()[:120]
+    if _LOW.search(head):
+        return 0
+    if _HIGH.search(head):
+        return 2
+    return inherited
+
+
+def _fit(pages: List[str], budget: int) -> Tuple[List[str], int]:
+    """Drop whole sections, lowest priority and latest first, until the pages fit the budget."""
+    split = [_sections(page) for page in pages]
+    ranked: List[Tuple[int, int, int, int]] = []   # (priority, page, position, tokens)
+    inherited = 1   # text under a heading shares the heading's priority
+    used = 0
+    for p, sections in enumerate(split):
+        for n, section in enumerate(sections):
+            first = section.strip().split("\n", 1)[0]
+            if _HEADING.match(first):
+                inherited = _priority(first, 1)
+            cost = estimate_tokens(section)
+            ranked.append((_priority(section, inherited), p, n, cost))
+            used += cost
+    if budget <= 0 or used <= budget:
+        return pages, 0
+
+    dropped: Set[Tuple[int, int]] = set()
+    for _, p, n, cost in sorted(ranked, key=lambda t: (t[0], -t[1], -t[2])):
+        if used <= budget or len(dropped) == len(ranked) - 1:
+            break
+        dropped.add((p, n))
+        used -= cost
+
+    out = [
+        "\n".join(s for n, s in enumerate(sections) if (p, n) not in dropped).strip()
+        for p, sections in enumerate(split)
+    ]
+    last = max((p for p, page in enumerate(out) if page), default=len(out) - 1)
+    out[last] = f"{out[last]}\n\n[{len(dropped)} lower-priority section(s) omitted to fit the length limit]".strip()
+    return out, len(dropped)
+
+
+# ---------- entry point ----------
+
+def condense(pages: List[str], budget: int = TOKEN_BUDGET) -> Tuple[List[str], Dict[str, Any]]:
+    """Condensed page texts (same count and order as `pages`) and what was saved."""
+    chars_in = sum(len(p) for p in pages)
+    tokens_in = sum(estimate_tokens(p) for p in pages)
+
+    split, boilerplate_lines = _strip_boilerplate([p.splitlines() for p in pages])
+    chars_boilerplate = chars_in - sum(len("\n".join(lines)) for lines in split)
+    headers: Set[str] = set()
+    out = [_reflow(lines, headers) for lines in split]
+    chars_layout = chars_in - chars_boilerplate - sum(len(p) for p in out)
+    out, sections_dropped = _fit(out, budget)
+    chars_out = sum(len(p) for p in out)
+
+    tokens_out = sum(estimate_tokens(p) for p in out)
+    for reason, chars in (
+        ("boilerplate", chars_boilerplate),
+        ("layout", chars_layout),
+        ("budget", chars_in - chars_boilerplate - chars_layout - chars_out),
+    ):
+        if chars > 0:
+            metrics_service.PROMPT_SAVED.inc(chars, unit="chars", reason=reason)
+    if tokens_in > tokens_out:
+        metrics_service.PROMPT_SAVED.inc(tokens_in - tokens_out, unit="tokens", reason="total")
+    return out, {
+        "chars_in": chars_in,
+        "chars_out": chars_out,
+        "chars_saved": chars_in - chars_out,
+        "tokens_saved": max(0, tokens_in - tokens_out),
+        "boilerplate_lines": boilerplate_lines,
+        "sections_dropped": sections_dropped,
+    }
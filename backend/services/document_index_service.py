@@ -0,0 +1,148 @@
+"""
+Per-page document index for incremental PDF re-analysis.
+Re-uploads are usually the same PDF, or the same PDF with a page or two added.
+Every page is fingerprinted (pdf_service.page_fingerprints, no extraction) and its
+extracted text is stored under that fingerprint, so a re-upload only extracts (and
+OCRs) pages never seen before. The fingerprint covers the content stream and the
+page's whole resource tree (fonts, encodings, ToUnicode maps, font files, images,
+nested forms), so a stored text is only reused for a page that extraction would
+read the same way. Chunk boundaries are content-defined (a page whose
+fingerprint falls in a fixed hash bucket starts a chunk), so chunk notes, which
+the response cache keys by chunk text, are reused for every chunk the edit did not
+touch. Only the changed chunks and the final merge go to Gemini.
+
+The index also remembers the last analyzed version of each upload (page
+fingerprints, summary, key points) under a document_id the server issues: random
+and unguessable, returned with the analysis, so only whoever received it can read
+the previous summary back or replace it. A re-upload that sends it back gets what
+changed since. An id the server never issued (or whose version has expired) is
+treated as a first upload and gets a new id; nothing is ever stored under an id a
+client chose. Two uploads that merely look alike are never compared with each other.
+
+Tunables (env vars):
+  DOC_INDEX_TTL_S      how long page texts and versions are kept (default: 30 days)
+  DOC_CHUNK_EVERY      average pages between content-defined chunk breaks (default: 4)
+"""
+from __future__ import annotations
+import os, secrets, time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services import metrics_service, pdf_service
+from services.cache_service import TwoTierCache, make_key
+
+TTL_S = int(os.getenv("DOC_INDEX_TTL_S", str(30 * 24 * 3600)))
+CHUNK_EVERY = max(1, int(os.getenv("DOC_CHUNK_EVERY", "4")))
+
+_pages = TwoTierCache("doc_pages", ttl=TTL_S)        # fingerprint -> extracted text
+_versions = TwoTierCache("doc_versions", ttl=TTL_S)  # issued document_id -> last analyzed version
+
+_CHANGED_TEXT_CHARS = 12000
+
+
+def _version_key(document_id: str) -> str:
+    return make_key("issued_doc", document_id)
+
+
+class Document:
+    """
+    One uploaded PDF: its page fingerprints, page texts and the previous version, if any.
+    `document_id` is one an earlier analysis returned; otherwise a new one is issued.
+    """
+
+    def __init__(self, pdf_path: str, document_id: Optional[str] = None):
+        self.path = pdf_path
+        self.fingerprints = pdf_service.page_fingerprints(pdf_path)
+        document_id = (document_id or "").strip()
+        self.previous: Optional[Dict[str, Any]] = _versions.get(_version_key(document_id)) if document_id else None
+        self.document_id = document_id if self.previous else secrets.token_urlsafe(24)
+        self.texts: Dict[int, str] = {}
+        self.reused = 0
+
+    def extract(self, ocr: Optional[pdf_service.OcrFn] = None, use_cache: bool = True) -> Tuple[List[str], List[dict]]:
+        """Non-empty page texts in order and page_errors; only unseen pages are extracted."""
+        missing = []
+        for i, fp in enumerate(self.fingerprints):
+            text = _pages.get(fp) if use_cache else None
+            if text is None:
+                missing.append(i)
+            else:
+                self.texts[i] = text
+        self.reused = len(self.fingerprints) - len(missing)
+        metrics_service.PDF_PAGES.inc(self.reused, outcome="reused")
+
+        errors: List[dict] = []
+        if missing:
+            extracted, errors = pdf_service.extract_page_map(self.path, ocr, indices=missing)
+            failed = {e["page"] - 1 for e in errors}
+            for i in missing:
+                self.texts[i] = extracted.get(i, "")
+                if i not in failed:
+                    _pages.set(self.fingerprints[i], self.texts[i])
+        return self.pages(), errors
+
+    def _order(self) -> List[int]:
+        return [i for i in range(len(self.fingerprints)) if self.texts.get(i)]
+
+    def pages(self) -> List[str]:
+        return [self.texts[i] for i in self._order()]
+
+    def breaks(self) -> List[bool]:
+        """Content-defined chunk breaks, parallel to pages()."""
+        return [int(self.fingerprints[i][:8], 16) % CHUNK_EVERY == 0 for i in self._order()]
+
+    def changes(self) -> Optional[Dict[str, Any]]:
+        """What differs from the last analyzed version of this document_id (None for a first upload or unknown id)."""
+        if not self.previous:
+            return None
+        old = set(self.previous["pages"])
+        new = set(self.fingerprints)
+        added = [i + 1 for i, fp in enumerate(self.fingerprints) if fp not in old]
+        return {
+            "previous_analyzed_at": self.previous["analyzed_at"],
+            "unchanged_pages": len(self.fingerprints) - len(added),
+            "added_pages": added,
+            "removed_pages": sum(1 for fp in self.previous["pages"] if fp not in new),
+            "previous_summary": self.previous["summary"],
+            "previous_key_points": self.previous["key_points"],
+        }
+
+    def added_text(self) -> str:
+        """Text of the pages that are new since the last version (bounded)."""
+        old = set((self.previous or {}).get("pages", ()))
+        parts = [self.texts.get(i, "") for i, fp in enumerate(self.fingerprints) if fp not in old]
+        return "\n\n".join(p for p in parts if p)[:_CHANGED_TEXT_CHARS]
+
+    def save(self, summary: str, key_points: List[str]):
+        """Remember this version for the next upload that sends back this document_id."""
+        _versions.set(_version_key(self.document_id), {
+            "pages": self.fingerprints,
+            "summary": summary,
+            "key_points": key_points,
+            "analyzed_at": time.time(),
+        })
+
+
+def changes_prompt(previous_summary: str, added_text: str, removed_pages: int) -> str:
+    removed = f"{removed_pages} page(s) of the earlier version are no longer included.\n" if removed_pages else ""
+    return (
+        "You are a careful, friendly medical assistant. A patient uploaded a new version of a medical report.\n"
+        "Using the summary of the earlier version and the text of the pages that are new, write 2–5 '- ' bullets "
+        "in plain language saying what is new or different. Do not repeat what has not changed and do not guess.\n"
+        f"{removed}"
+        "\n"
+        f"EARLIER SUMMARY:\n{previous_summary}\n\n"
+        f"NEW PAGES:\n{added_text}"
+    )
+
+
+def explain_changes(doc: Document, changes: Dict[str, Any], generate: Callable[[str], str]) -> List[str]:
+    """Bullets describing the delta (one Gemini call over the new pages only)."""
+    added = doc.added_text()
+    if not added and not changes["removed_pages"]:
+        return []
+    text = generate(changes_prompt(changes["previous_summary"], added, changes["removed_pages"]))
+    return [line.strip("-• ").strip() for line in text.splitlines() if line.strip()]
+
+
+def stats() -> Dict[str, Any]:
+    return {"pages": _pages.stats(), "versions": _versions.stats()}
@@ -1,33 +1,235 @@
 """
-ElevenLabs TTS (returns list of MP3 bytes, one per paragraph).
+ElevenLabs TTS.
+- tts_paragraphs: list of MP3 bytes, one per paragraph
+- synthesize: one MP3 for a whole text; sentence/paragraph units are synthesized
+  concurrently and their MP3 frames concatenated in order (no re-encode)
+- synthesize_units_async: the same fan-out on the event loop (ASGI entry point)
+- every request passes the ElevenLabs governor in admission_service (characters
+  are the unit budget); identical in-flight requests share one call
+
+Tunables (env vars):
+  TTS_PARALLELISM       max concurrent ElevenLabs requests per call (default: 4)
+  TTS_UNIT_CHARS        target characters per synthesis unit (default: 400)
+  ELEVENLABS_API_BASE   API root, e.g. a local stand-in for benchmarks (default: https://api.elevenlabs.io)
 """
 from __future__ import annotations
-import os, json
-from typing import List
-import requests
+import asyncio, os, re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from services import admission_service, http_service, metrics_service, registry
+from services.cache_service import make_key
+
+PARALLELISM = int(os.getenv("TTS_PARALLELISM", "4"))
+UNIT_CHARS = int(os.getenv("TTS_UNIT_CHARS", "400"))
+API_BASE = os.getenv("ELEVENLABS_API_BASE", "https://api.elevenlabs.io").rstrip("/")
+
+DEFAULT_MODEL_ID = "eleven_multilingual_v2"
+DEFAULT_VOICE_SETTINGS = {"stability": 0.3, "similarity_boost": 0.7}
+
+class ElevenLabsError(RuntimeError):
+    def __init__(self, status: int, body: str):
+        super().__init__(f"ElevenLabs error {status}: {body}")
+        self.status = status
+        self.body = body
 
 def _secrets():
-    p = os.path.join(os.path.dirname(__file__), "secrets.json")
-    with open(p, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return registry.secrets()
 
-def tts_paragraphs(paragraphs: List[str], voice_id: str | None = None) -> List[bytes]:
+def _post_tts(url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> bytes:
+    chars = len(payload.get("text", ""))
+
+    def call() -> bytes:
+        with admission_service.elevenlabs.slot(chars), metrics_service.timed("elevenlabs"):
+            r = http_service.post(url, headers=headers, json=payload, read_timeout=60)
+            if r.status_code >= 400:
+                # log the real reason to console
+                print("ElevenLabs error:", r.status_code, r.text)
+                raise ElevenLabsError(r.status_code, r.text)
+        metrics_service.TTS_CHARS.inc(chars)
+        metrics_service.TTS_BYTES.observe(len(r.content))
+        return r.content
+
+    return admission_service.elevenlabs_flight.do(make_key(url, payload), call)
+
+async def _post_tts_async(url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> bytes:
+    from services import async_http_service  # aiohttp is only required in async serving mode
+
+    chars = len(payload.get("text", ""))
+
+    async def call() -> bytes:
+        async with admission_service.elevenlabs.slot_async(chars):
+            with metrics_service.timed("elevenlabs"):
+                r = await async_http_service.post(url, headers=headers, json=payload, read_timeout=60)
+                if r.status_code >= 400:
+                    print("ElevenLabs error:", r.status_code, r.text)
+                    raise ElevenLabsError(r.status_code, r.text)
+        metrics_service.TTS_CHARS.inc(chars)
+        metrics_service.TTS_BYTES.observe(len(r.content))
+        return r.content
+
+    return await admission_service.elevenlabs_flight.do_async(make_key(url, payload), call)
+
+def _request_parts(voice_id: Optional[str]):
     s = _secrets()
     api_key = s.get("ELEVENLABS_API_KEY")
-    if not api_key:
-        return []
     voice = voice_id or s.get("ELEVENLABS_DEFAULT_VOICE_ID", "EXAVITQu4vr4xnSDxMaL")
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice}"
-
+    url = f"{API_BASE}/v1/text-to-speech/{voice}"
     headers = {
-        "xi-api-key": api_key,
+        "xi-api-key": api_key or "",
         "accept": "audio/mpeg",
         "content-type": "application/json",
     }
+    return api_key, url, headers
+
+def tts_paragraphs(paragraphs: List[str], voice_id: str | None = None) -> List[bytes]:
+    api_key, url, headers = _request_parts(voice_id)
+    if not api_key:
+        return []
+    items = list(paragraphs or [])
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(PARALLELISM, len(items)))) as pool:
+        return list(pool.map(metrics_service.bind(lambda p: _post_tts(url, headers, {"text": p})), items))
+
+# ---------- text units ----------
+
+_SENTENCE_END = re.compile(r"(?<=[.!?。！？])\s+")
+
+def split_units(text: str, max_chars: int = UNIT_CHARS) -> List[str]:
+    """
+    Split on paragraphs, then sentences, and merge neighbours up to max_chars.
+    Units never cross a paragraph break, so pauses land where the text has them.
+    """
+    units: List[str] = []
+    for para in re.split(r"\n\s*\n", text or ""):
+        para = " ".join(para.split())
+        if not para:
+            continue
+        current = ""
+        for sentence in _SENTENCE_END.split(para):
+            if current and len(current) + 1 + len(sentence) > max_chars:
+                units.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}" if current else sentence
+        if current:
+            units.append(current)
+    return units
+
+# ---------- MP3 stitching ----------
+
+_BITRATES = {
+    # (mpeg1?, layer3) kbps tables indexed by the 4-bit bitrate field
+    True: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0],
+    False: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, 0],
+}
+_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+def _frame_len(h: bytes) -> int:
+    """Length of the Layer III frame starting with header h, or 0 if h is not a valid header."""
+    if len(h) < 4 or h[0] != 0xFF or (h[1] & 0xE0) != 0xE0:
+        return 0
+    version = (h[1] >> 3) & 0x03          # 3 = MPEG1, 2 = MPEG2, 0 = MPEG2.5
+    layer = (h[1] >> 1) & 0x03            # 1 = Layer III
+    br_idx = (h[2] >> 4) & 0x0F
+    sr_idx = (h[2] >> 2) & 0x03
+    if version == 1 or layer != 1 or br_idx in (0, 15) or sr_idx == 3:
+        return 0
+    mpeg1 = version == 3
+    bitrate = _BITRATES[mpeg1][br_idx] * 1000
+    sample_rate = _SAMPLE_RATES[version][sr_idx]
+    padding = (h[2] >> 1) & 0x01
+    return (144 if mpeg1 else 72) * bitrate // sample_rate + padding
+
+def _is_info_frame(frame: bytes) -> bool:
+    """Xing/Info/VBRI header frames carry whole-file length data and no audio."""
+    mpeg1 = ((frame[1] >> 3) & 0x03) == 3
+    mono = ((frame[3] >> 6) & 0x03) == 3
+    side = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+    tag = frame[4 + side: 8 + side]
+    return tag in (b"Xing", b"Info") or frame[36:40] == b"VBRI"
+
+def mp3_frames(data: bytes) -> bytes:
+    """Audio frames of one MP3 file, without ID3 tags or Xing/Info/VBRI header frames."""
+    pos, end = 0, len(data)
+    if data[:3] == b"ID3" and end >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        pos = 10 + size + (10 if data[5] & 0x10 else 0)
+    if end - pos >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+
+    out = bytearray()
+    first = True
+    while pos + 4 <= end:
+        n = _frame_len(data[pos:pos + 4])
+        if not n:
+            pos += 1  # resync past junk
+            continue
+        frame = data[pos:min(pos + n, end)]
+        if not (first and _is_info_frame(frame)):
+            out += frame
+        first = False
+        pos += n
+    return bytes(out)
+
+def join_mp3(parts: List[bytes]) -> bytes:
+    """Concatenate MP3 files frame-by-frame; a single part is returned untouched."""
+    if len(parts) == 1:
+        return parts[0]
+    return b"".join(mp3_frames(p) for p in parts)
+
+# ---------- synthesis ----------
+
+def synthesize_units(
+    units: List[str],
+    voice_id: Optional[str] = None,
+    model_id: str = DEFAULT_MODEL_ID,
+    voice_settings: Optional[Dict[str, Any]] = None,
+    parallelism: int = PARALLELISM,
+) -> List[bytes]:
+    """One MP3 per unit, synthesized concurrently; results are in input order."""
+    api_key, url, headers = _request_parts(voice_id)
+    if not api_key:
+        raise RuntimeError("ELEVENLABS_API_KEY missing in services/secrets.json")
+    settings = voice_settings or DEFAULT_VOICE_SETTINGS
+
+    def one(unit: str) -> bytes:
+        payload = {"text": unit, "model_id": model_id, "voice_settings": settings}
+        return _post_tts(url, headers, payload)
+
+    if len(units) == 1:
+        return [one(units[0])]
+    with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(units)))) as pool:
+        return list(pool.map(metrics_service.bind(one), units))
+
+async def synthesize_units_async(
+    units: List[str],
+    voice_id: Optional[str] = None,
+    model_id: str = DEFAULT_MODEL_ID,
+    voice_settings: Optional[Dict[str, Any]] = None,
+    parallelism: int = PARALLELISM,
+) -> List[bytes]:
+    """synthesize_units() without threads: at most `parallelism` requests in flight per call."""
+    api_key, url, headers = _request_parts(voice_id)
+    if not api_key:
+        raise RuntimeError("ELEVENLABS_API_KEY missing in services/secrets.json")
+    settings = voice_settings or DEFAULT_VOICE_SETTINGS
+    gate = asyncio.Semaphore(max(1, parallelism))
+
+    async def one(unit: str) -> bytes:
+        async with gate:
+            payload = {"text": unit, "model_id": model_id, "voice_settings": settings}
+            return await _post_tts_async(url, headers, payload)
+
+    return list(await asyncio.gather(*(one(u) for u in units)))
 
-    results: List[bytes] = []
-    for p in paragraphs or []:
-        r = requests.post(url, headers=headers, json={"text": p}, timeout=60)
-        r.raise_for_status()
-        results.append(r.content)
-    return results
\ No newline at end of file
+def synthesize(
+    text: str,
+    voice_id: Optional[str] = None,
+    model_id: str = DEFAULT_MODEL_ID,
+    voice_settings: Optional[Dict[str, Any]] = None,
+    parallelism: int = PARALLELISM,
+) -> bytes:
+    """Synthesize text as one MP3; units run concurrently and are stitched in order."""
+    units = split_units(text) or [text]
+    return join_mp3(synthesize_units(units, voice_id, model_id, voice_settings, parallelism))
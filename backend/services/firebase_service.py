@@ -3,8 +3,7 @@ Firebase helpers (auth + Firestore + Storage), via services/secrets.json and fir
 Degrades gracefully if not configured (functions return None/No-ops).
 """
 from __future__ import annotations
-import os, json, uuid
-from functools import lru_cache
+import uuid
 from typing import Any, Dict, Optional
 
 try:
@@ -17,42 +16,29 @@ except Exception:
     firestore = None
     storage = None
 
-@lru_cache(maxsize=1)
+from services import registry, write_buffer_service
+
 def _secrets() -> Dict[str, Any]:
-    path = os.path.join(os.path.dirname(__file__), "secrets.json")
-    if not os.path.exists(path):
+    try:
+        return registry.secrets()
+    except FileNotFoundError:
         return {}
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-_app = None
-_db = None
-_bucket = None
 
 def _maybe_init():
-    """Initialize Firebase Admin app + Firestore + Storage if secrets provided."""
-    global _app, _db, _bucket
-    if _app or not firebase_admin:
-        return
+    """(app, db, bucket) from the shared registry, or Nones if Firebase isn't configured."""
+    if not firebase_admin:
+        return None, None, None
     s = _secrets()
-    pid = s.get("FIREBASE_PROJECT_ID")
-    sa_path = s.get("FIREBASE_ADMIN_PATH")
-    bucket_name = s.get("FIREBASE_STORAGE_BUCKET")
-
-    if not (pid and sa_path and os.path.exists(sa_path)):
-        return  # not configured
-
-    cred = credentials.Certificate(sa_path)
-    _app = firebase_admin.initialize_app(cred, {
-        "projectId": pid,
-        "storageBucket": bucket_name
-    })
-    _db = firestore.client()
-    _bucket = storage.bucket() if storage else None
+    if not (s.get("FIREBASE_PROJECT_ID") and s.get("FIREBASE_ADMIN_PATH")):
+        return None, None, None  # not configured
+    try:
+        return registry.firebase_app(), registry.db(), registry.bucket()
+    except Exception:
+        return None, None, None
 
 def verify_id_token_optional(req) -> Optional[str]:
     """Returns uid from Authorization: Bearer <idToken>, or None if not configured/invalid."""
-    _maybe_init()
+    _app, _, _ = _maybe_init()
     if not (_app and auth):
         return None
     authz = req.headers.get("Authorization", "")
@@ -60,27 +46,27 @@ def verify_id_token_optional(req) -> Optional[str]:
         return None
     token = authz.split(" ", 1)[1].strip()
     try:
-        decoded = auth.verify_id_token(token)
+        decoded = auth.verify_id_token(token, app=_app)
         return decoded.get("uid")
     except Exception:
         return None
 
 def save_session_result_optional(uid: str, session_id: str, payload: Dict[str, Any]):
-    """Saves session JSON under /users/{uid}/sessions/{session_id} if Firestore available."""
-    _maybe_init()
+    """Saves session JSON under /users/{uid}/sessions/{session_id} if Firestore available (write-behind)."""
+    _, _db, _ = _maybe_init()
     if not (_db and uid):
         return
     payload = dict(payload or {})
     payload.setdefault("createdAt", firestore.SERVER_TIMESTAMP)
     payload["updatedAt"] = firestore.SERVER_TIMESTAMP
-    _db.collection("users").document(uid).collection("sessions").document(session_id).set(payload, merge=True)
+    write_buffer_service.enqueue(f"users/{uid}/sessions/{session_id}", payload, merge=True)
 
 def upload_bytes_to_storage(object_name: str, data: bytes, content_type: str = "application/octet-stream") -> Optional[str]:
     """
     Uploads bytes to Firebase Storage and returns a **download URL** using a token.
     No-op returns None if storage not configured.
     """
-    _maybe_init()
+    _, _, _bucket = _maybe_init()
     if not _bucket:
         return None
 
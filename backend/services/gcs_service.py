@@ -3,22 +3,17 @@ Google Cloud Storage helpers (signed URLs + upload bytes).
 Reads bucket & creds from services/secrets.json.
 """
 from __future__ import annotations
-import os, json, datetime
+import datetime
 from typing import Optional
 from google.cloud import storage
 
+from services import registry
+
 def _secrets():
-    p = os.path.join(os.path.dirname(__file__), "secrets.json")
-    with open(p, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return registry.secrets()
 
 def _client() -> storage.Client:
-    s = _secrets()
-    cred_path = s.get("GOOGLE_APPLICATION_CREDENTIALS")
-    if not (cred_path and os.path.exists(cred_path)):
-        raise RuntimeError("GOOGLE_APPLICATION_CREDENTIALS missing or not found.")
-    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = cred_path
-    return storage.Client()
+    return registry.storage_client()
 
 def _bucket():
     s = _secrets()
@@ -27,8 +22,10 @@ def _bucket():
         raise RuntimeError("GCP_BUCKET_NAME missing in secrets.json")
     return _client().bucket(name)
 
-def signed_upload_url(object_name: str, content_type: str = "application/pdf", expires_minutes: int = 15) -> str:
-    blob = _bucket().blob(object_name)
+def signed_upload_url(object_name: str, content_type: str = "application/pdf", expires_minutes: int = 15,
+                      bucket: Optional[storage.Bucket] = None) -> str:
+    """Signed PUT URL; the client must send the same Content-Type header."""
+    blob = (bucket or _bucket()).blob(object_name)
     return blob.generate_signed_url(
         version="v4",
         expiration=datetime.timedelta(minutes=expires_minutes),
@@ -1,41 +1,101 @@
 """
 Gemini service wrapper (reads keys from services/secrets.json).
+Calls go through admission_service: the Gemini governor's budgets apply, and
+identical requests already in flight share one upstream call.
+
+Tunables (env vars):
+  GEMINI_API_BASE   REST API root, e.g. a local stand-in for benchmarks
+                    (default: https://generativelanguage.googleapis.com)
 """
 from __future__ import annotations
-import json, os
-from functools import lru_cache
-from typing import Any, Dict
+import json, os, re
+from typing import Any, Dict, Optional
 import requests
 
-@lru_cache(maxsize=1)
+from services import admission_service, http_service, metrics_service, registry
+from services.cache_service import make_key
+
+API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com").rstrip("/")
+
 def _secrets() -> Dict[str, Any]:
-    p = os.path.join(os.path.dirname(__file__), "secrets.json")
-    if not os.path.exists(p):
-        raise FileNotFoundError(f"Missing secrets file: {p}")
-    with open(p, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    data = registry.secrets()
     if not data.get("GEMINI_API_KEY"):
         raise RuntimeError("GEMINI_API_KEY missing in services/secrets.json")
     return data
 
-def _endpoint() -> str:
-    model = _secrets().get("GEMINI_MODEL", "gemini-1.5-flash")
-    return f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+def _endpoint(model: Optional[str] = None) -> str:
+    model = model or registry.gemini_model_id()
+    return f"{API_BASE}/v1beta/models/{model}:generateContent"
 
 def _api_key() -> str:
     return _secrets()["GEMINI_API_KEY"]
 
-def _post(prompt_text: str, timeout: int = 90) -> Dict[str, Any]:
-    url = _endpoint()
+def _payload(prompt_text: str, generation_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    metrics_service.GEMINI_CHARS.inc(len(prompt_text), direction="prompt")
+    payload: Dict[str, Any] = {"contents": [{"parts": [{"text": prompt_text}]}]}
+    if generation_config:
+        payload["generationConfig"] = generation_config
+    return payload
+
+def _record_usage(data: Dict[str, Any], estimate: int = 0):
+    """Count tokens and bill the governor for whatever the up-front estimate missed."""
+    usage = data.get("usageMetadata") or {}
+    prompt, response = usage.get("promptTokenCount", 0), usage.get("candidatesTokenCount", 0)
+    metrics_service.GEMINI_TOKENS.inc(prompt, direction="prompt")
+    metrics_service.GEMINI_TOKENS.inc(response, direction="response")
+    admission_service.gemini.charge((prompt or estimate) + response - estimate)
+
+def _post(
+    prompt_text: str,
+    timeout: int = 90,
+    generation_config: Optional[Dict[str, Any]] = None,
+    model: Optional[str] = None,
+) -> Dict[str, Any]:
+    url = _endpoint(model)
     headers = {"Content-Type": "application/json"}
     params = {"key": _api_key()}
-    payload = {"contents": [{"parts": [{"text": prompt_text}]}]}
-    r = requests.post(url, headers=headers, params=params, json=payload, timeout=timeout)
-    try:
-        r.raise_for_status()
-    except requests.HTTPError as e:
-        raise RuntimeError(f"Gemini HTTP error: {e}\n{r.text[:600]}") from e
-    return r.json()
+    payload = _payload(prompt_text, generation_config)
+    estimate = admission_service.estimate_tokens(prompt_text)
+
+    def call() -> Dict[str, Any]:
+        with admission_service.gemini.slot(estimate), metrics_service.timed("gemini_http"):
+            r = http_service.post(url, headers=headers, params=params, json=payload, read_timeout=timeout)
+            try:
+                r.raise_for_status()
+            except requests.HTTPError as e:
+                raise RuntimeError(f"Gemini HTTP error: {e}\n{r.text[:600]}") from e
+        data = r.json()
+        _record_usage(data, estimate)
+        return data
+
+    return admission_service.gemini_flight.do(make_key(url, payload), call)
+
+async def _post_async(
+    prompt_text: str,
+    model: Optional[str] = None,
+    generation_config: Optional[Dict[str, Any]] = None,
+    timeout: int = 90,
+) -> Dict[str, Any]:
+    """_post() for the ASGI entry point: the event loop keeps serving while Gemini works."""
+    from services import async_http_service  # aiohttp is only required in async serving mode
+
+    url = _endpoint(model)
+    headers = {"Content-Type": "application/json"}
+    params = {"key": _api_key()}
+    payload = _payload(prompt_text, generation_config)
+    estimate = admission_service.estimate_tokens(prompt_text)
+
+    async def call() -> Dict[str, Any]:
+        async with admission_service.gemini.slot_async(estimate):
+            with metrics_service.timed("gemini_http"):
+                r = await async_http_service.post(url, headers=headers, params=params, json=payload, read_timeout=timeout)
+                if r.status_code >= 400:
+                    raise RuntimeError(f"Gemini HTTP error: {r.status_code}\n{r.text[:600]}")
+        data = r.json()
+        _record_usage(data, estimate)
+        return data
+
+    return await admission_service.gemini_flight.do_async(make_key(url, payload), call)
 
 def _extract_text(api_json: Dict[str, Any]) -> str:
     try:
@@ -51,17 +111,103 @@ def _strip_fences(txt: str) -> str:
             t = t[4:].lstrip()
     return t
 
-def generate_json(prompt_text: str) -> Dict[str, Any]:
-    data = _post(prompt_text)
-    cleaned = _strip_fences(_extract_text(data))
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+def repair_json(txt: str) -> Any:
+    """
+    Parse model output as JSON, fixing the usual damage locally instead of asking again:
+    code fences, prose around the value, trailing commas, and output cut off mid-value
+    (open strings, arrays and objects are closed).
+    """
+    t = _strip_fences(txt)
+    try:
+        return json.loads(t)
+    except json.JSONDecodeError:
+        pass
+    starts = [i for i in (t.find("{"), t.find("[")) if i >= 0]
+    if not starts:
+        raise ValueError("no JSON object or array in model output")
+    t = t[min(starts):]
+    end = max(t.rfind("}"), t.rfind("]"))
+    try:
+        return json.loads(_TRAILING_COMMA.sub(r"\1", t[:end + 1]))
+    except json.JSONDecodeError:
+        pass
+    # Truncated: walk the text, then close whatever is still open.
+    closers, in_string, escaped = [], False, False
+    for ch in t:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            closers.append("}" if ch == "{" else "]")
+        elif ch in "}]" and closers:
+            closers.pop()
+    if in_string:
+        t += '"'
+    close = "".join(reversed(closers))
+    # as is, then without a dangling key ("key" or "key": right at the cut)
+    for candidate in (t, re.sub(r',?\s*"[^"]*"\s*:?\s*$', "", t)):
+        candidate = re.sub(r"[,:]\s*$", "", candidate.rstrip())
+        try:
+            return json.loads(_TRAILING_COMMA.sub(r"\1", candidate + close))
+        except json.JSONDecodeError:
+            continue
+    raise ValueError("model output is not repairable JSON")
+
+def _json_config(schema: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not schema:
+        return None
+    return {"responseMimeType": "application/json", "responseSchema": schema}
+
+def _parse_json(data: Dict[str, Any]) -> Any:
+    text = _extract_text(data)
+    metrics_service.GEMINI_CHARS.inc(len(text), direction="response")
     try:
-        return json.loads(cleaned)
-    except json.JSONDecodeError as e:
-        raise RuntimeError(f"Gemini did not return valid JSON: {e}\nPreview:\n{cleaned[:800]}") from e
+        return repair_json(text)
+    except ValueError as e:
+        raise RuntimeError(f"Gemini did not return valid JSON: {e}\nPreview:\n{text[:800]}") from e
+
+def generate_json(prompt_text: str, schema: Optional[Dict[str, Any]] = None, model: Optional[str] = None) -> Any:
+    """
+    JSON generation. With a schema (OpenAPI subset, see REPORT_SCHEMA in report_service)
+    Gemini is asked for application/json output that follows it.
+    `model` defaults to registry.gemini_model_id(), like every other Gemini call.
+    """
+    return _parse_json(_post(prompt_text, generation_config=_json_config(schema), model=model))
+
+async def generate_json_async(
+    prompt_text: str,
+    schema: Optional[Dict[str, Any]] = None,
+    model: Optional[str] = None,
+) -> Any:
+    return _parse_json(await _post_async(prompt_text, model, _json_config(schema)))
+
+def generate_text(prompt_text: str) -> str:
+    """Plain-text generation over REST (sync)."""
+    text = _extract_text(_post(prompt_text))
+    metrics_service.GEMINI_CHARS.inc(len(text), direction="response")
+    return text
 
 def translate_values(json_payload: Dict[str, Any], target_language: str) -> Dict[str, Any]:
-    prompt = (
-        "Translate the JSON VALUES (not keys) to '{lang}'. "
-        "Preserve keys and structure. Return ONLY valid JSON.\n\n{payload}"
-    ).format(lang=target_language, payload=json.dumps(json_payload, ensure_ascii=False))
-    return generate_json(prompt)
\ No newline at end of file
+    """Translate the string values (not keys); sentences already in the translation memory are reused."""
+    from services import translation_memory_service
+
+    model = registry.gemini_model_id()
+    return translation_memory_service.translate_values(json_payload, target_language, model, generate_text)
+
+async def generate_text_async(
+    prompt_text: str,
+    model: Optional[str] = None,
+    generation_config: Optional[Dict[str, Any]] = None,
+) -> str:
+    """Plain-text generation over REST (async); the SDK path in app.generate_text is the sync twin."""
+    text = _extract_text(await _post_async(prompt_text, model, generation_config))
+    metrics_service.GEMINI_CHARS.inc(len(text), direction="response")
+    return text
@@ -0,0 +1,149 @@
+"""
+Shared outbound HTTP layer (ElevenLabs, Gemini REST, future providers).
+- One keep-alive requests.Session per host per process (pools recreated after fork)
+- Separate connect / read timeouts
+- Retries 429 / 5xx / connection errors with jittered exponential backoff, honouring Retry-After;
+  a non-idempotent request (POST) that timed out reading the response is not retried,
+  since the upstream may already have acted on it
+- Per-host latency and error counters (stats())
+
+Tunables (env vars):
+  HTTP_POOL_SIZE         keep-alive connections per host (default: 16; size to worker threads)
+  HTTP_CONNECT_TIMEOUT   seconds to establish a connection (default: 5)
+  HTTP_MAX_RETRIES       retries after the first attempt (default: 3)
+  HTTP_BACKOFF_BASE      first backoff step in seconds (default: 0.5)
+  HTTP_BACKOFF_MAX       cap for a single wait, including Retry-After (default: 20)
+"""
+from __future__ import annotations
+import os, random, threading, time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "20"))
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+IDEMPOTENT = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+_lock = threading.Lock()
+_sessions: Dict[str, requests.Session] = {}
+_sessions_pid: Optional[int] = None
+_stats: Dict[str, Dict[str, float]] = {}
+
+
+def _session(host: str) -> requests.Session:
+    global _sessions_pid
+    with _lock:
+        if _sessions_pid != os.getpid():
+            # Never share sockets with a parent process.
+            _sessions.clear()
+            _stats.clear()
+            _sessions_pid = os.getpid()
+        s = _sessions.get(host)
+        if s is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _sessions[host] = s
+        return s
+
+
+def _record(host: str, seconds: float, status: Optional[int], retried: bool):
+    with _lock:
+        st = _stats.setdefault(host, {
+            "requests": 0, "errors": 0, "retries": 0, "status_4xx": 0, "status_5xx": 0,
+            "latency_sum_s": 0.0, "latency_max_s": 0.0,
+        })
+        st["requests"] += 1
+        st["latency_sum_s"] += seconds
+        st["latency_max_s"] = max(st["latency_max_s"], seconds)
+        if retried:
+            st["retries"] += 1
+        if status is None:
+            st["errors"] += 1
+        elif 400 <= status < 500:
+            st["status_4xx"] += 1
+        elif status >= 500:
+            st["status_5xx"] += 1
+
+
+def stats() -> Dict[str, Dict[str, float]]:
+    with _lock:
+        out = {}
+        for host, st in _stats.items():
+            row = dict(st)
+            row["latency_avg_s"] = round(st["latency_sum_s"] / st["requests"], 4) if st["requests"] else 0.0
+            out[host] = row
+        return out
+
+
+def _retry_after(resp: requests.Response) -> Optional[float]:
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def _backoff(attempt: int, retry_after: Optional[float]) -> float:
+    if retry_after is not None:
+        return min(BACKOFF_MAX, retry_after)
+    # "full jitter": uniform in [0, base * 2^attempt]
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def request(
+    method: str,
+    url: str,
+    *,
+    read_timeout: float = 60,
+    connect_timeout: float = CONNECT_TIMEOUT,
+    retries: int = MAX_RETRIES,
+    **kwargs: Any,
+) -> requests.Response:
+    """
+    Like requests.request, over a pooled per-host session with retries.
+    Returns the last response (callers still check status); raises the last
+    connection error if every attempt failed to get a response, and a read
+    timeout on a non-idempotent method straight away.
+    """
+    host = urlsplit(url).netloc
+    session = _session(host)
+    idempotent = method.upper() in IDEMPOTENT
+    for attempt in range(retries + 1):
+        start = time.perf_counter()
+        try:
+            resp = session.request(method, url, timeout=(connect_timeout, read_timeout), **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            _record(host, time.perf_counter() - start, None, attempt > 0)
+            if attempt >= retries or (isinstance(e, requests.ReadTimeout) and not idempotent):
+                raise
+            time.sleep(_backoff(attempt, None))
+            continue
+        _record(host, time.perf_counter() - start, resp.status_code, attempt > 0)
+        if resp.status_code not in RETRY_STATUSES or attempt >= retries:
+            return resp
+        time.sleep(_backoff(attempt, _retry_after(resp)))
+    raise AssertionError("unreachable")
+
+
+def post(url: str, **kwargs: Any) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def get(url: str, **kwargs: Any) -> requests.Response:
+    return request("GET", url, **kwargs)
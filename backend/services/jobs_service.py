@@ -0,0 +1,333 @@
+"""
+Background jobs for long-running endpoints (analyze-pdf, tts, ocr).
+- submit() returns a job id at once; a bounded per-kind thread pool runs the work
+- Work functions report per-stage progress through a callback
+- Job state and progress events live in a pluggable store: in-memory (single process)
+  or SQLite (shared by every worker on the host, survives restarts)
+- Jobs run in the process that accepted them. Each job records that process's
+  lease (lease_service) and its spooled input file; a queued/running job whose
+  process is gone is marked failed and its file removed, on a worker's first
+  request (reap) and whenever it is read, so /jobs/<id>/events clients get a
+  `failed` event instead of keep-alives forever
+
+Tunables (env vars):
+  CLARIMED_JOB_STORE        "memory" or "sqlite" (default: sqlite)
+  JOB_CONCURRENCY_<KIND>    workers per kind, e.g. JOB_CONCURRENCY_ANALYZE_PDF (default: 2)
+  JOB_QUEUE_LIMIT           max queued + running jobs per kind before submit() refuses (default: 64)
+  JOB_RETENTION_S           finished jobs older than this are purged (default: 1 day)
+"""
+from __future__ import annotations
+import json, os, sqlite3, threading, time, traceback, uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from services import lease_service
+from services.cache_service import CACHE_DIR
+
+STORE_KIND = os.getenv("CLARIMED_JOB_STORE", "sqlite").lower()
+DEFAULT_CONCURRENCY = 2
+QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "64"))
+RETENTION_S = int(os.getenv("JOB_RETENTION_S", str(24 * 3600)))
+
+TERMINAL = ("done", "failed")
+ORPHANED = "The server restarted before this job finished; please submit it again."
+
+Progress = Callable[..., None]
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+# ---------- stores ----------
+
+class JobStore:
+    """Interface; job dicts have id, kind, status, stage, result, error, created, updated, owner, spool."""
+
+    def create(self, job_id: str, kind: str, owner: Optional[str] = None, spool: Optional[str] = None):
+        raise NotImplementedError
+    def update(self, job_id: str, **fields): raise NotImplementedError
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]: raise NotImplementedError
+    def add_event(self, job_id: str, event: Dict[str, Any]): raise NotImplementedError
+    def events(self, job_id: str, after: int = 0) -> List[Dict[str, Any]]: raise NotImplementedError
+    def purge(self, older_than: float): raise NotImplementedError
+    def unfinished(self) -> List[Dict[str, Any]]: raise NotImplementedError
+
+    def wait(self, job_id: str, after: int, timeout: float) -> List[Dict[str, Any]]:
+        """Block up to timeout for events newer than `after` (polling fallback)."""
+        deadline = time.monotonic() + timeout
+        while True:
+            evs = self.events(job_id, after)
+            if evs or time.monotonic() >= deadline:
+                return evs
+            time.sleep(0.25)
+
+
+class MemoryJobStore(JobStore):
+    def __init__(self):
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._events: Dict[str, List[Dict[str, Any]]] = {}
+        self._cond = threading.Condition()
+
+    def create(self, job_id, kind, owner=None, spool=None):
+        now = time.time()
+        with self._cond:
+            self._jobs[job_id] = {"id": job_id, "kind": kind, "status": "queued", "stage": None,
+                                  "result": None, "error": None, "created": now, "updated": now,
+                                  "owner": owner, "spool": spool}
+            self._events[job_id] = []
+
+    def update(self, job_id, **fields):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields, updated=time.time())
+            self._cond.notify_all()
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def add_event(self, job_id, event):
+        with self._cond:
+            evs = self._events.setdefault(job_id, [])
+            evs.append(dict(event, seq=len(evs) + 1))
+            self._cond.notify_all()
+
+    def events(self, job_id, after=0):
+        with self._cond:
+            return list(self._events.get(job_id, [])[after:])
+
+    def wait(self, job_id, after, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._events.get(job_id, [])) > after, timeout=timeout)
+            return list(self._events.get(job_id, [])[after:])
+
+    def unfinished(self):
+        with self._cond:
+            return [dict(job) for job in self._jobs.values() if job["status"] not in TERMINAL]
+
+    def purge(self, older_than):
+        with self._cond:
+            for jid in [j for j, job in self._jobs.items()
+                        if job["status"] in TERMINAL and job["updated"] < older_than]:
+                self._jobs.pop(jid, None)
+                self._events.pop(jid, None)
+
+
+class SqliteJobStore(JobStore):
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(CACHE_DIR, "jobs.sqlite3")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT, status TEXT, stage TEXT,"
+            " result TEXT, error TEXT, created REAL, updated REAL, owner TEXT, spool TEXT);"
+            "CREATE TABLE IF NOT EXISTS job_events ("
+            " job_id TEXT, seq INTEGER, body TEXT, PRIMARY KEY (job_id, seq));"
+        )
+        columns = {row[1] for row in self._conn().execute("PRAGMA table_info(jobs)")}
+        for column in ("owner", "spool"):
+            if column not in columns:   # job stores created before jobs recorded their process
+                try:
+                    self._conn().execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+                except sqlite3.OperationalError:
+                    pass   # another worker added it first
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def create(self, job_id, kind, owner=None, spool=None):
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, kind, status, created, updated, owner, spool) VALUES (?,?,?,?,?,?,?)",
+            (job_id, kind, "queued", now, now, owner, spool),
+        )
+
+    def update(self, job_id, **fields):
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"], ensure_ascii=False)
+        fields["updated"] = time.time()
+        cols = ", ".join(f"{k}=?" for k in fields)
+        self._conn().execute(f"UPDATE jobs SET {cols} WHERE id=?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        cur = self._conn().execute(
+            "SELECT id, kind, status, stage, result, error, created, updated, owner, spool FROM jobs WHERE id=?",
+            (job_id,),
+        )
+        row = cur.fetchone()
+        if row is None:
+            return None
+        job = dict(zip([d[0] for d in cur.description], row))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def unfinished(self):
+        cur = self._conn().execute(
+            "SELECT id, kind, status, owner, spool FROM jobs WHERE status NOT IN ('done','failed')"
+        )
+        names = [d[0] for d in cur.description]
+        return [dict(zip(names, row)) for row in cur.fetchall()]
+
+    def add_event(self, job_id, event):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            (seq,) = conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) + 1 FROM job_events WHERE job_id=?", (job_id,)
+            ).fetchone()
+            conn.execute(
+                "INSERT INTO job_events (job_id, seq, body) VALUES (?,?,?)",
+                (job_id, seq, json.dumps(dict(event, seq=seq), ensure_ascii=False)),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def events(self, job_id, after=0):
+        rows = self._conn().execute(
+            "SELECT body FROM job_events WHERE job_id=? AND seq>? ORDER BY seq", (job_id, after)
+        ).fetchall()
+        return [json.loads(b) for (b,) in rows]
+
+    def purge(self, older_than):
+        conn = self._conn()
+        doomed = [r[0] for r in conn.execute(
+            "SELECT id FROM jobs WHERE status IN ('done','failed') AND updated<?", (older_than,)
+        )]
+        conn.executemany("DELETE FROM job_events WHERE job_id=?", [(j,) for j in doomed])
+        conn.executemany("DELETE FROM jobs WHERE id=?", [(j,) for j in doomed])
+
+
+def _make_store() -> JobStore:
+    if STORE_KIND == "memory":
+        return MemoryJobStore()
+    try:
+        return SqliteJobStore()
+    except Exception as e:
+        print("Job store: SQLite unavailable, using memory:", e)
+        return MemoryJobStore()
+
+
+store: JobStore = _make_store()
+
+
+# ---------- runner ----------
+
+_lock = threading.Lock()
+_pools: Dict[str, ThreadPoolExecutor] = {}
+_pools_pid: Optional[int] = None
+_active: Dict[str, int] = {}
+
+
+def concurrency(kind: str) -> int:
+    env = "JOB_CONCURRENCY_" + kind.upper().replace("-", "_")
+    return int(os.getenv(env, str(DEFAULT_CONCURRENCY)))
+
+
+def _pool(kind: str) -> ThreadPoolExecutor:
+    global _pools_pid
+    if _pools_pid != os.getpid():
+        _pools.clear()
+        _active.clear()
+        _pools_pid = os.getpid()
+    pool = _pools.get(kind)
+    if pool is None:
+        pool = _pools[kind] = ThreadPoolExecutor(max_workers=concurrency(kind), thread_name_prefix=f"job-{kind}")
+    return pool
+
+
+def submit(
+    kind: str,
+    work: Callable[[Progress], Dict[str, Any]],
+    cleanup: Optional[Callable[[], None]] = None,
+    spool: Optional[str] = None,
+) -> str:
+    """
+    Queue work(progress) on the pool for `kind`; returns the job id.
+    progress(stage, **data) records a stage event; work's return value is the job result.
+    `spool` is a temp file the job owns; it is removed by reap() if this process dies first
+    (cleanup() is still what removes it normally).
+    """
+    with _lock:
+        pool = _pool(kind)
+        if _active.get(kind, 0) >= QUEUE_LIMIT:
+            raise QueueFull(f"Too many pending '{kind}' jobs; try again shortly.")
+        _active[kind] = _active.get(kind, 0) + 1
+
+    job_id = uuid.uuid4().hex
+    store.create(job_id, kind, lease_service.token(), spool)
+    store.add_event(job_id, {"status": "queued", "stage": None})
+
+    def progress(stage: str, **data):
+        store.update(job_id, stage=stage)
+        store.add_event(job_id, {"status": "running", "stage": stage, **data})
+
+    def run():
+        try:
+            store.update(job_id, status="running")
+            result = work(progress)
+            store.update(job_id, status="done", stage="done", result=result)
+            store.add_event(job_id, {"status": "done", "stage": "done", "result": result})
+        except Exception as e:
+            traceback.print_exc()
+            store.update(job_id, status="failed", error=str(e))
+            store.add_event(job_id, {"status": "failed", "error": str(e)})
+        finally:
+            with _lock:
+                _active[kind] -= 1
+            if cleanup:
+                cleanup()
+            store.purge(time.time() - RETENTION_S)
+
+    try:
+        pool.submit(run)
+    except Exception:
+        with _lock:
+            _active[kind] -= 1
+        if cleanup:
+            cleanup()
+        raise
+    return job_id
+
+
+def _fail_orphan(job: Dict[str, Any]) -> bool:
+    """Mark a queued/running job whose process is gone as failed; True if it was orphaned."""
+    if job["status"] in TERMINAL or lease_service.alive(job.get("owner")):
+        return False
+    store.update(job["id"], status="failed", error=ORPHANED)
+    store.add_event(job["id"], {"status": "failed", "error": ORPHANED})
+    if job.get("spool"):
+        try:
+            os.remove(job["spool"])
+        except OSError:
+            pass
+    return True
+
+
+def reap() -> int:
+    """Fail every unfinished job no live process owns (app.start_process); returns how many."""
+    try:
+        return sum(_fail_orphan(job) for job in store.unfinished())
+    except Exception as e:
+        print("Job store: could not reap orphaned jobs:", e)
+        return 0
+
+
+def get(job_id: str) -> Optional[Dict[str, Any]]:
+    job = store.get(job_id)
+    if job is not None and _fail_orphan(job):
+        job = store.get(job_id)
+    if job is not None:
+        job.pop("owner", None)   # internal: not part of the API
+        job.pop("spool", None)
+    return job
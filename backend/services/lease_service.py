@@ -0,0 +1,78 @@
+"""
+Process leases: tell whether the process that owns a piece of shared state is still alive.
+PIDs are a poor owner id: after a container restart the new process very often has the
+same PID as the one that died (1, or another low number). Instead each process holds an
+exclusive flock on its own lease file for as long as it lives; the kernel releases it
+when the process exits or crashes, however it dies. A lease whose file can be locked
+by someone else therefore belongs to a dead process.
+
+- token(): this process's lease id ("<pid>-<random>"), taken on first use
+- alive(token): False once the owner is gone (unknown / empty tokens count as gone)
+- A forked child drops the parent's lease and takes its own on first use
+- Lease files live in CLARIMED_CACHE_DIR/leases; a dead owner's file is removed by
+  the first alive() that finds it unlocked
+"""
+from __future__ import annotations
+import fcntl, os, threading, uuid
+from typing import Optional
+
+from services.cache_service import CACHE_DIR
+
+LEASE_DIR = os.path.join(CACHE_DIR, "leases")
+
+_lock = threading.Lock()
+_token: Optional[str] = None
+_fd: Optional[int] = None
+
+
+def _path(token: str) -> str:
+    return os.path.join(LEASE_DIR, f"{token}.lock")
+
+
+def token() -> str:
+    """This process's lease token, held until the process exits."""
+    global _token, _fd
+    with _lock:
+        if _token is None:
+            os.makedirs(LEASE_DIR, exist_ok=True)
+            tok = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+            fd = os.open(_path(tok), os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            _token, _fd = tok, fd
+        return _token
+
+
+def alive(tok: Optional[str]) -> bool:
+    """Whether the process holding lease `tok` is still running."""
+    if not tok:
+        return False
+    if tok == _token:
+        return True
+    try:
+        fd = os.open(_path(tok), os.O_RDWR)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)   # also releases the lock if we got it
+    try:
+        os.remove(_path(tok))
+    except OSError:
+        pass
+    return False
+
+
+def _after_fork():
+    # The child shares the parent's open lock file; closing our copy keeps the parent's
+    # lock (it still holds the descriptor) without pinning it to the child's lifetime.
+    global _lock, _token, _fd
+    if _fd is not None:
+        os.close(_fd)
+    _lock = threading.Lock()
+    _token, _fd = None, None
+
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,258 @@
+"""
+In-process metrics (Prometheus text format at /metrics), per-request Server-Timing
+and an opt-in sampling profiler.
+- timed(stage) / observe_stage(stage, seconds) feed the clarimed_stage_seconds
+  histogram and, when the current request asked for it, its Server-Timing header
+- Work fanned out to thread pools keeps the request's timing context when the
+  callable is wrapped with bind()
+- start_profile() / finish_profile() sample the serving thread's stack every PROFILE_INTERVAL_MS
+  and writes collapsed stacks (flamegraph.pl / speedscope format) to CACHE_DIR
+
+Metrics are per process; with several workers, scrape each one or aggregate.
+
+Tunables (env vars):
+  METRICS_SERVER_TIMING   "1" to send Server-Timing on every response (default: only
+                          when the request has `X-ClariMed-Timing: 1`)
+  PROFILE_TOKEN           enables the profiler for requests sending
+                          `X-ClariMed-Profile: <token>` (default: unset = disabled)
+  PROFILE_INTERVAL_MS     sampling interval (default: 5)
+"""
+from __future__ import annotations
+import contextvars, os, sys, threading, time, uuid
+from collections import Counter as _Tally
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from services.cache_service import CACHE_DIR
+
+SERVER_TIMING_ALWAYS = os.getenv("METRICS_SERVER_TIMING", "") in ("1", "true", "yes")
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_INTERVAL_S = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000.0
+PROFILE_DIR = os.path.join(CACHE_DIR, "profiles")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (100, 1_000, 5_000, 20_000, 100_000, 500_000, 2_000_000, 10_000_000)
+
+LabelKey = Tuple[str, ...]
+
+_INF = 'le="+Inf"'
+
+_registry: List["_Metric"] = []
+_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> LabelKey:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = super().render()
+        with _lock:
+            items = list(self._values.items())
+        for key, v in items:
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {v:g}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelKey, List[float]] = {}   # per-bucket counts + [sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with _lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self):
+        lines = super().render()
+        with _lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        for key, row in items:
+            for bound, n in zip(self.buckets, row):
+                le = 'le="%g"' % bound
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {n:g}")
+            lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, _INF)} {row[-1]:g}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {row[-2]:.6f}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {row[-1]:g}")
+        return lines
+
+
+def render() -> str:
+    with _lock:
+        metrics = list(_registry)
+    out: List[str] = []
+    for m in metrics:
+        out.extend(m.render())
+    return "\n".join(out) + "\n"
+
+
+# ---------- metrics ----------
+
+REQUEST_SECONDS = Histogram("clarimed_request_seconds", "HTTP request latency", ("endpoint", "method", "status"))
+STAGE_SECONDS = Histogram("clarimed_stage_seconds", "Latency of internal stages", ("stage", "outcome"))
+GEMINI_CHARS = Counter("clarimed_gemini_chars_total", "Characters sent to / received from Gemini", ("direction",))
+GEMINI_TOKENS = Counter("clarimed_gemini_tokens_total", "Gemini tokens reported by the API", ("direction",))
+TTS_BYTES = Histogram("clarimed_tts_audio_bytes", "Audio bytes per ElevenLabs call", (), SIZE_BUCKETS)
+TTS_CHARS = Counter("clarimed_tts_chars_total", "Characters synthesized by ElevenLabs")
+STORAGE_BYTES = Counter("clarimed_storage_upload_bytes_total", "Bytes uploaded to Cloud Storage", ("kind",))
+FIRESTORE_OPS = Counter("clarimed_firestore_ops_total", "Firestore document writes committed", ("outcome",))
+PDF_PAGES = Counter("clarimed_pdf_pages_total", "PDF pages extracted", ("outcome",))
+TM_SEGMENTS = Counter("clarimed_translation_segments_total", "Translation memory lookups", ("outcome",))
+SPECULATION = Counter("clarimed_speculation_total", "Speculative precompute tasks by outcome", ("kind", "outcome"))
+ADMISSION = Counter("clarimed_admission_total", "Upstream calls by admission outcome", ("provider", "outcome"))
+PROMPT_SAVED = Counter(
+    "clarimed_prompt_saved_total", "Characters / estimated tokens removed from PDF text before prompting", ("unit", "reason")
+)
+
+
+# ---------- per-request timing ----------
+
+_request_timings: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "clarimed_request_timings", default=None
+)
+
+
+def begin_request(collect: bool) -> Optional[contextvars.Token]:
+    """Start collecting Server-Timing entries for this request (if asked for)."""
+    return _request_timings.set([]) if (collect or SERVER_TIMING_ALWAYS) else None
+
+
+def end_request(token: contextvars.Token):
+    _request_timings.reset(token)
+
+
+def request_timings() -> Optional[List[Tuple[str, float]]]:
+    return _request_timings.get()
+
+
+def observe_stage(stage: str, seconds: float, outcome: str = "ok"):
+    STAGE_SECONDS.observe(seconds, stage=stage, outcome=outcome)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))   # list.append is atomic; pool threads share the list
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start, outcome)
+
+
+def bind(fn: Callable) -> Callable:
+    """Run fn (on any thread) in a copy of the caller's context, so its stages count for this request."""
+    ctx = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return ctx.copy().run(fn, *args, **kwargs)
+    return run
+
+
+def server_timing_header(timings: List[Tuple[str, float]], total: Optional[float] = None) -> str:
+    """Sum per stage; concurrent stages overlap, so entries can add up to more than total."""
+    sums: Dict[str, float] = {}
+    counts: _Tally = _Tally()
+    for stage, seconds in list(timings):
+        sums[stage] = sums.get(stage, 0.0) + seconds
+        counts[stage] += 1
+    parts = [f'{s};dur={sums[s] * 1000:.1f};desc="x{counts[s]}"' for s in sums]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# ---------- sampling profiler ----------
+
+def profile_requested(headers) -> bool:
+    return bool(PROFILE_TOKEN) and headers.get("X-ClariMed-Profile", "") == PROFILE_TOKEN
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, thread_id: int):
+        super().__init__(name="profiler", daemon=True)
+        self.thread_id = thread_id
+        self.stacks: _Tally = _Tally()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(PROFILE_INTERVAL_S):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def start_profile() -> _Sampler:
+    sampler = _Sampler(threading.get_ident())
+    sampler.start()
+    return sampler
+
+
+def finish_profile(sampler: _Sampler) -> str:
+    """Stop sampling and write collapsed stacks; returns the profile file name."""
+    sampler.stop()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.folded"
+    with open(os.path.join(PROFILE_DIR, name), "w", encoding="utf-8") as f:
+        for stack, n in sampler.stacks.most_common():
+            f.write(f"{stack} {n}\n")
+    return name
@@ -1,56 +1,136 @@
 """
 Google Vision OCR.
-- If the GCS URI ends with .pdf -> use async batch (PDF OCR)
-- Else -> use document_text_detection for images
+- Images (png/jpg) -> document_text_detection
+- Small inline PDFs (scanned pages cut out by pdf_service) -> batch_annotate_files
+- PDFs -> async_batch_annotate_files; the sharded JSON output is read back from GCS
+  in parallel, assembled in page order and deleted afterwards
+
+Non-blocking use:
+    handle = submit_pdfs(["gs://b/a.pdf", "gs://b/b.pdf"])   # one Vision request for all files
+    while not poll(handle): ...
+    texts = collect(handle)                                    # [text_a, text_b]
+
+Tunables (env vars):
+  OCR_BATCH_SIZE   pages per output JSON shard, 1-100 (default: 20)
+  OCR_TIMEOUT_S    how long run_ocr_gcs waits for a PDF operation (default: 180)
 """
 from __future__ import annotations
-import os, json, time
-from typing import Tuple
+import json, os, uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
 from google.cloud import vision
 
-def _secrets():
-    p = os.path.join(os.path.dirname(__file__), "secrets.json")
-    with open(p, "r", encoding="utf-8") as f:
-        return json.load(f)
+from services import registry
+
+BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "20"))
+TIMEOUT_S = float(os.getenv("OCR_TIMEOUT_S", "180"))
+
+_IO_PARALLELISM = 8
 
 def _client() -> vision.ImageAnnotatorClient:
-    cred = _secrets().get("GOOGLE_APPLICATION_CREDENTIALS")
-    if not (cred and os.path.exists(cred)):
-        raise RuntimeError("GOOGLE_APPLICATION_CREDENTIALS missing or not found.")
-    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = cred
-    return vision.ImageAnnotatorClient()
+    return registry.vision_client()
 
-def run_ocr_gcs(gcs_uri: str) -> str:
-    client = _client()
+def _split_gcs_uri(uri: str) -> Tuple[str, str]:
+    if not uri.startswith("gs://"):
+        raise ValueError(f"Not a gs:// URI: {uri}")
+    bucket, _, name = uri[5:].partition("/")
+    return bucket, name
+
+@dataclass
+class OcrBatch:
+    """Handle for one async_batch_annotate_files operation covering several PDFs."""
+    operation: object
+    inputs: List[str]
+    outputs: List[str] = field(default_factory=list)   # gs:// prefix per input, same order
+
+def submit_pdfs(gcs_uris: List[str], batch_size: int = BATCH_SIZE) -> OcrBatch:
+    """Start OCR for many PDFs in a single Vision request; returns immediately."""
+    feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+    run_id = uuid.uuid4().hex
+    requests, outputs = [], []
+    for i, uri in enumerate(gcs_uris):
+        # Unique output prefix per run/file so concurrent runs never read each other's shards
+        out_uri = f"{uri.rsplit('/', 1)[0]}/_ocr_output/{run_id}/{i}/"
+        outputs.append(out_uri)
+        requests.append(vision.AsyncAnnotateFileRequest(
+            features=[feature],
+            input_config=vision.InputConfig(gcs_source=vision.GcsSource(uri=uri), mime_type="application/pdf"),
+            output_config=vision.OutputConfig(
+                gcs_destination=vision.GcsDestination(uri=out_uri),
+                batch_size=max(1, min(100, batch_size)),
+            ),
+        ))
+    operation = _client().async_batch_annotate_files(requests=requests)
+    return OcrBatch(operation=operation, inputs=list(gcs_uris), outputs=outputs)
+
+def poll(batch: OcrBatch) -> bool:
+    """True once the Vision operation has finished (successfully or not)."""
+    return batch.operation.done()
 
+def _read_shard(blob) -> List[Tuple[int, str]]:
+    data = json.loads(blob.download_as_bytes())
+    pages = []
+    for resp in data.get("responses", []):
+        page_no = (resp.get("context") or {}).get("pageNumber", 0)
+        text = (resp.get("fullTextAnnotation") or {}).get("text", "")
+        pages.append((page_no, text))
+    return pages
+
+def _collect_one(prefix_uri: str, cleanup: bool) -> str:
+    bucket_name, prefix = _split_gcs_uri(prefix_uri)
+    bucket = registry.storage_client().bucket(bucket_name)
+    blobs = list(bucket.list_blobs(prefix=prefix))
+    with ThreadPoolExecutor(max_workers=_IO_PARALLELISM) as pool:
+        shards = list(pool.map(_read_shard, blobs))
+        if cleanup:
+            list(pool.map(lambda b: b.delete(), blobs))
+    pages: Dict[int, str] = {}
+    for shard in shards:
+        for page_no, text in shard:
+            pages[page_no] = text
+    return "\n\n".join(pages[k].strip() for k in sorted(pages) if pages[k].strip())
+
+def collect(batch: OcrBatch, timeout: float = TIMEOUT_S, cleanup: bool = True) -> List[str]:
+    """Wait for the operation, then return the text of each input PDF (input order)."""
+    batch.operation.result(timeout=timeout)
+    with ThreadPoolExecutor(max_workers=max(1, min(_IO_PARALLELISM, len(batch.outputs)))) as pool:
+        return list(pool.map(lambda p: _collect_one(p, cleanup), batch.outputs))
+
+def run_ocr_many(gcs_uris: List[str], batch_size: int = BATCH_SIZE) -> List[str]:
+    """Blocking OCR for several PDFs with one Vision operation."""
+    if not gcs_uris:
+        return []
+    return collect(submit_pdfs(gcs_uris, batch_size))
+
+def ocr_pdf_bytes(pdf_bytes: bytes, page_count: int) -> List[str]:
+    """
+    Synchronous OCR of a small inline PDF (Vision accepts up to 5 pages per request).
+    Returns one text per page, in page order.
+    """
+    feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+    request = vision.AnnotateFileRequest(
+        input_config=vision.InputConfig(content=pdf_bytes, mime_type="application/pdf"),
+        features=[feature],
+        pages=list(range(1, page_count + 1)),
+    )
+    response = _client().batch_annotate_files(requests=[request])
+    texts = [""] * page_count
+    for page_resp in response.responses[0].responses:
+        if page_resp.error and page_resp.error.message:
+            raise RuntimeError(f"OCR error: {page_resp.error.message}")
+        idx = page_resp.context.page_number - 1
+        if 0 <= idx < page_count and page_resp.full_text_annotation:
+            texts[idx] = page_resp.full_text_annotation.text
+    return texts
+
+def run_ocr_gcs(gcs_uri: str) -> str:
     if gcs_uri.lower().endswith(".pdf"):
-        # Async batch for PDFs (first page for speed; tweak as needed)
-        mime_type = "application/pdf"
-        feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
-        gcs_source = vision.GcsSource(uri=gcs_uri)
-        input_config = vision.InputConfig(gcs_source=gcs_source, mime_type=mime_type)
-        # Write output JSON to a temp GCS path next to input
-        out_uri = gcs_uri.rsplit("/", 1)[0] + "/_ocr_output/"
-        gcs_destination = vision.GcsDestination(uri=out_uri)
-        output_config = vision.OutputConfig(gcs_destination=gcs_destination, batch_size=1)
-
-        request = vision.AsyncAnnotateFileRequest(features=[feature], input_config=input_config, output_config=output_config)
-        operation = client.async_batch_annotate_files(requests=[request])
-
-        operation.result(timeout=180)  # wait up to 3 minutes
-        # We won't fetch the JSON back from GCS here; for hackathon, call simple detection again per page OR
-        # do a quick single-image pass:
-        # Fallback (fast): try simple text detection (works for image-like PDFs sometimes)
-        image = vision.Image(source=vision.ImageSource(gcs_image_uri=gcs_uri))
-        response = client.document_text_detection(image=image)
-        if response.error and response.error.message:
-            raise RuntimeError(f"OCR error: {response.error.message}")
-        return response.full_text_annotation.text if response.full_text_annotation else ""
-
-    else:
-        # images (png/jpg)
-        image = vision.Image(source=vision.ImageSource(gcs_image_uri=gcs_uri))
-        response = client.document_text_detection(image=image)
-        if response.error and response.error.message:
-            raise RuntimeError(f"OCR error: {response.error.message}")
-        return response.full_text_annotation.text if response.full_text_annotation else ""
\ No newline at end of file
+        return run_ocr_many([gcs_uri])[0]
+
+    # images (png/jpg)
+    image = vision.Image(source=vision.ImageSource(gcs_image_uri=gcs_uri))
+    response = _client().document_text_detection(image=image)
+    if response.error and response.error.message:
+        raise RuntimeError(f"OCR error: {response.error.message}")
+    return response.full_text_annotation.text if response.full_text_annotation else ""
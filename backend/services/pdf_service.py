@@ -0,0 +1,385 @@
+"""
+PDF text extraction engine.
+- Spools the upload to a temp file (bounded copy, never the whole file in RAM)
+- Fans page ranges out to a process pool and yields page texts in order
+- Enforces page / byte / time limits and reports per-page failures
+- Classifies each page: pages with a usable text layer stay on the local pypdf path,
+  image-only (scanned) pages are cut into small PDFs and sent to an OCR callback
+  in concurrent batches, then merged back in page order
+- page_fingerprints: a content hash per page (content stream + the full resource tree:
+  fonts, encodings, ToUnicode maps, images, nested forms), cheap next to extraction,
+  so callers can extract only the pages they have not seen before
+
+Tunables (env vars):
+  PDF_MAX_BYTES       max upload size in bytes (default: 50 MB)
+  PDF_MAX_PAGES       max page count (default: 500)
+  PDF_TIMEOUT_S       wall-clock budget for extraction (default: 120)
+  PDF_WORKERS         process pool size (default: CPU count)
+  PDF_PAGES_PER_TASK  pages handed to a worker per task (default: 8)
+  PDF_MIN_TEXT_CHARS  fewer letters/digits than this on an image page means "scanned" (default: 25)
+  PDF_OCR_PAGES       pages per OCR request (default: 5, the Vision sync limit)
+  PDF_OCR_PARALLELISM concurrent OCR requests (default: 4)
+"""
+from __future__ import annotations
+import hashlib, io, multiprocessing, os, tempfile, threading, time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+from services import metrics_service
+
+MAX_BYTES = int(os.getenv("PDF_MAX_BYTES", str(50 * 1024 * 1024)))
+MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "500"))
+TIMEOUT_S = float(os.getenv("PDF_TIMEOUT_S", "120"))
+WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 2)))
+PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+MIN_TEXT_CHARS = int(os.getenv("PDF_MIN_TEXT_CHARS", "25"))
+OCR_PAGES = int(os.getenv("PDF_OCR_PAGES", "5"))
+OCR_PARALLELISM = int(os.getenv("PDF_OCR_PARALLELISM", "4"))
+
+_COPY_CHUNK = 1024 * 1024
+
+
+class PdfLimitError(ValueError):
+    """Upload exceeds a configured limit (size, pages or time)."""
+
+    def __init__(self, message: str, status: int = 413):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class PageText:
+    index: int                    # 0-based page number
+    text: str
+    error: Optional[str] = None   # set when extraction failed for this page
+    needs_ocr: bool = False       # image page without a usable text layer
+    seconds: float = 0.0          # extraction time (measured in the worker)
+
+
+# ---------- spooling ----------
+
+def spool(stream: BinaryIO, max_bytes: int = MAX_BYTES) -> str:
+    """Copy an upload stream to a temp .pdf file in fixed-size chunks; returns its path."""
+    fd, path = tempfile.mkstemp(suffix=".pdf", prefix="clarimed-")
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = stream.read(_COPY_CHUNK)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise PdfLimitError(f"PDF is larger than {max_bytes // (1024 * 1024)} MB.")
+                out.write(chunk)
+    except BaseException:
+        discard(path)
+        raise
+    return path
+
+
+def discard(path: Optional[str]):
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# ---------- worker side ----------
+
+_reader: Tuple[Optional[str], Optional[PdfReader]] = (None, None)
+
+
+def _open(path: str) -> PdfReader:
+    # Keep the last reader per worker so consecutive ranges skip re-parsing the xref.
+    global _reader
+    if _reader[0] != path:
+        _reader = (path, PdfReader(path))
+    return _reader[1]
+
+
+def has_text_layer(text: str, min_chars: int = MIN_TEXT_CHARS) -> bool:
+    """Enough real letters/digits to trust; broken font encodings yield mostly symbols."""
+    return sum(ch.isalnum() for ch in text) >= min_chars
+
+
+def _has_images(page) -> bool:
+    try:
+        return len(page.images) > 0
+    except Exception:
+        return False
+
+
+def _extract_range(path: str, start: int, stop: int) -> List[Tuple[int, str, Optional[str], bool, float]]:
+    out = []
+    try:
+        reader = _open(path)
+    except Exception as e:
+        return [(i, "", f"open failed: {e}", False, 0.0) for i in range(start, stop)]
+    for i in range(start, stop):
+        t0 = time.perf_counter()
+        try:
+            page = reader.pages[i]
+            text = (page.extract_text() or "").strip()
+            needs_ocr = not has_text_layer(text) and _has_images(page)
+            out.append((i, text, None, needs_ocr, time.perf_counter() - t0))
+        except Exception as e:
+            out.append((i, "", f"{type(e).__name__}: {e}", False, time.perf_counter() - t0))
+    return out
+
+
+def _page(row) -> PageText:
+    page = PageText(*row)
+    metrics_service.observe_stage("pdf_page", page.seconds, "error" if page.error else "ok")
+    metrics_service.PDF_PAGES.inc(outcome="error" if page.error else "needs_ocr" if page.needs_ocr else "text")
+    return page
+
+
+# ---------- pool ----------
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """One pool per process, created after fork; forkserver keeps gRPC state out of workers."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context(method))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+# ---------- public API ----------
+
+def page_count(path: str) -> int:
+    return len(PdfReader(path).pages)
+
+
+def _check_pages(total: int, max_pages: int):
+    if total > max_pages:
+        raise PdfLimitError(f"PDF has {total} pages; the limit is {max_pages}.")
+
+
+def _ranges(indices: Sequence[int], pages_per_task: int) -> List[Tuple[int, int]]:
+    """Contiguous [start, stop) runs of the (sorted) indices, at most pages_per_task long."""
+    ranges: List[Tuple[int, int]] = []
+    for i in indices:
+        if ranges and ranges[-1][1] == i and i - ranges[-1][0] < pages_per_task:
+            ranges[-1] = (ranges[-1][0], i + 1)
+        else:
+            ranges.append((i, i + 1))
+    return ranges
+
+
+def iter_pages(
+    path: str,
+    max_pages: int = MAX_PAGES,
+    timeout: float = TIMEOUT_S,
+    pages_per_task: int = PAGES_PER_TASK,
+    indices: Optional[Sequence[int]] = None,
+) -> Iterator[PageText]:
+    """
+    Yield PageText for every page (or only the given 0-based indices), in order.
+    Small jobs are read in-process; larger ones are split into ranges and extracted
+    on the process pool with at most 2x WORKERS ranges in flight, so memory stays
+    flat in the page count.
+    """
+    try:
+        total = page_count(path)
+    except Exception as e:
+        raise PdfLimitError(f"Could not read PDF: {e}", 422) from e
+    _check_pages(total, max_pages)
+    wanted = sorted(set(indices)) if indices is not None else range(total)
+
+    deadline = time.monotonic() + timeout
+    if len(wanted) <= pages_per_task or WORKERS <= 1:
+        for start, stop in _ranges(wanted, len(wanted) or 1):
+            for row in _extract_range(path, start, stop):
+                if time.monotonic() > deadline:
+                    raise PdfLimitError(f"PDF extraction exceeded {timeout:.0f}s.", 504)
+                yield _page(row)
+        return
+
+    pool = _get_pool()
+    ranges = _ranges(wanted, pages_per_task)
+    window = max(2, WORKERS * 2)
+    pending = []
+    next_range = 0
+    try:
+        while next_range < len(ranges) or pending:
+            while next_range < len(ranges) and len(pending) < window:
+                start, stop = ranges[next_range]
+                pending.append(pool.submit(_extract_range, path, start, stop))
+                next_range += 1
+            fut = pending.pop(0)
+            remaining = deadline - time.monotonic()
+            try:
+                results = fut.result(timeout=max(0.0, remaining))
+            except FutureTimeout:
+                raise PdfLimitError(f"PDF extraction exceeded {timeout:.0f}s.", 504)
+            for row in results:
+                yield _page(row)
+    finally:
+        for f in pending:
+            f.cancel()
+
+
+def subset_pdf(path: str, indices: List[int]) -> bytes:
+    """A small PDF containing only the given (0-based) pages, in that order."""
+    reader = PdfReader(path)
+    writer = PdfWriter()
+    for i in indices:
+        writer.add_page(reader.pages[i])
+    buf = io.BytesIO()
+    writer.write(buf)
+    return buf.getvalue()
+
+
+# OCR callback: (pdf_bytes, page_count) -> one text per page of that small PDF.
+OcrFn = Callable[[bytes, int], List[str]]
+
+
+def _ocr_pages(path: str, indices: List[int], ocr: OcrFn) -> Tuple[dict, List[dict]]:
+    """OCR the given pages in concurrent batches; returns ({index: text}, page_errors)."""
+    batches = [indices[k:k + OCR_PAGES] for k in range(0, len(indices), OCR_PAGES)]
+
+    def run(batch: List[int]):
+        try:
+            with metrics_service.timed("ocr"):
+                return batch, ocr(subset_pdf(path, batch), len(batch)), None
+        except Exception as e:
+            return batch, None, f"OCR failed: {e}"
+
+    texts: dict = {}
+    errors: List[dict] = []
+    with ThreadPoolExecutor(max_workers=max(1, min(OCR_PARALLELISM, len(batches)))) as pool:
+        for batch, result, err in pool.map(metrics_service.bind(run), batches):
+            if err:
+                errors.extend({"page": i + 1, "error": err} for i in batch)
+                continue
+            for i, text in zip(batch, result):
+                texts[i] = (text or "").strip()
+    return texts, errors
+
+
+def extract_page_map(
+    path: str, ocr: Optional[OcrFn] = None, indices: Optional[Sequence[int]] = None, **limits
+) -> Tuple[Dict[int, str], List[dict]]:
+    """
+    {0-based index: text} for every page (or the given indices), plus page_errors
+    ({page, error}, 1-based). With an ocr callback, scanned pages are OCR'd (only
+    those) and merged in place.
+    """
+    results: List[PageText] = []
+    errors: List[dict] = []
+    with metrics_service.timed("pdf_extract"):
+        for page in iter_pages(path, indices=indices, **limits):
+            if page.error:
+                errors.append({"page": page.index + 1, "error": page.error})
+            results.append(page)
+
+    scanned = [p.index for p in results if p.needs_ocr]
+    if scanned and ocr is not None:
+        ocr_texts, ocr_errors = _ocr_pages(path, scanned, ocr)
+        errors.extend(ocr_errors)
+        for p in results:
+            if p.index in ocr_texts:
+                p.text = ocr_texts[p.index]
+        errors.sort(key=lambda e: e["page"])
+
+    return {p.index: p.text for p in results}, errors
+
+
+def extract_pages(path: str, ocr: Optional[OcrFn] = None, **limits) -> Tuple[List[str], List[dict]]:
+    """Non-empty page texts in order, plus page_errors ({page, error}, 1-based)."""
+    texts, errors = extract_page_map(path, ocr, **limits)
+    return [texts[i] for i in sorted(texts) if texts[i]], errors
+
+
+# ---------- fingerprints ----------
+
+_FINGERPRINT_KEYS = ("/Resources", "/Rotate", "/MediaBox", "/CropBox", "/UserUnit")
+_IN_PROGRESS = b"cycle"
+
+
+def _hash_object(h, obj, memo: Dict[Tuple[int, int], bytes]):
+    """Feed a canonical form of a PDF object tree into h (streams by their raw bytes).
+
+    Indirect objects are hashed once per document into `memo` and fed in as their digest,
+    so fonts and images shared by many pages cost one pass, and object numbering does not
+    matter. "/Parent" back-references are skipped (they lead to the whole page tree).
+    """
+    if isinstance(obj, IndirectObject):
+        ref = (obj.idnum, obj.generation)
+        digest = memo.get(ref)
+        if digest is None:
+            memo[ref] = _IN_PROGRESS
+            sub = hashlib.sha256()
+            _hash_object(sub, obj.get_object(), memo)
+            digest = memo[ref] = sub.digest()
+        h.update(b"R" + digest)
+        return
+    if isinstance(obj, DictionaryObject):   # includes streams
+        h.update(b"<<")
+        for key in sorted(obj):
+            if key in ("/Parent", "/P"):
+                continue
+            h.update(key.encode("latin-1", "replace"))
+            _hash_object(h, obj.raw_get(key), memo)
+        h.update(b">>")
+        if isinstance(obj, StreamObject):
+            data = getattr(obj, "_data", None)
+            h.update(b"stream" + (data if isinstance(data, bytes) else obj.get_data()))
+        return
+    if isinstance(obj, ArrayObject):
+        h.update(b"[")
+        for item in obj:
+            _hash_object(h, item, memo)
+            h.update(b",")
+        h.update(b"]")
+        return
+    if isinstance(obj, bytes):
+        h.update(b"b" + obj)
+        return
+    h.update(f"{type(obj).__name__}:{obj!r};".encode("utf-8", "replace"))
+
+
+def _page_fingerprint(page, memo: Dict[Tuple[int, int], bytes]) -> str:
+    """
+    sha256 over everything that decides what a page shows: its content stream(s) and its
+    whole resource tree (fonts with their encodings, ToUnicode maps and font files, images,
+    form XObjects with their own resources, ...), plus rotation and page boxes.
+    """
+    h = hashlib.sha256()
+    contents = page.get_contents()
+    if contents is not None:
+        h.update(contents.get_data())
+    for key in _FINGERPRINT_KEYS:
+        value = page.raw_get(key) if key in page else None
+        if value is not None:
+            h.update(key.encode("latin-1"))
+            _hash_object(h, value, memo)
+    return h.hexdigest()
+
+
+def page_fingerprints(path: str, max_pages: int = MAX_PAGES) -> List[str]:
+    """One content hash per page, in order (no text extraction, no OCR)."""
+    try:
+        reader = PdfReader(path)
+        _check_pages(len(reader.pages), max_pages)
+        with metrics_service.timed("pdf_fingerprint"):
+            memo: Dict[Tuple[int, int], bytes] = {}
+            return [_page_fingerprint(page, memo) for page in reader.pages]
+    except PdfLimitError:
+        raise
+    except Exception as e:
+        raise PdfLimitError(f"Could not read PDF: {e}", 422) from e
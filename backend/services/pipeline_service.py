@@ -0,0 +1,78 @@
+"""
+Tiny dependency-graph runner for multi-stage requests (/report).
+Each stage starts as soon as all of its dependencies have finished, on a shared
+bounded thread pool; results are yielded in completion order so callers can
+stream them. A stage whose dependency failed is reported as skipped.
+
+Tunables (env vars):
+  PIPELINE_PARALLELISM   max concurrently running stages across all pipelines (default: 16)
+"""
+from __future__ import annotations
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from services import metrics_service
+
+PARALLELISM = int(os.getenv("PIPELINE_PARALLELISM", "16"))
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_pid: Optional[int] = None
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ThreadPoolExecutor(max_workers=PARALLELISM, thread_name_prefix="pipeline")
+        _pool_pid = os.getpid()
+    return _pool
+
+
+@dataclass
+class Stage:
+    name: str
+    fn: Callable[[Dict[str, Any]], Any]        # receives results of finished stages by name
+    deps: Tuple[str, ...] = field(default_factory=tuple)
+
+
+def run(stages: Dict[str, Stage]) -> Iterator[Tuple[str, bool, Any]]:
+    """
+    Run stages respecting deps; yields (name, ok, result_or_error_message)
+    as each stage finishes (or is skipped because a dependency failed).
+    """
+    for st in stages.values():
+        unknown = [d for d in st.deps if d not in stages]
+        if unknown:
+            raise ValueError(f"Stage '{st.name}' depends on unknown stage(s): {unknown}")
+
+    pool = _get_pool()
+    results: Dict[str, Any] = {}
+    failed: set = set()
+    pending = dict(stages)
+    running: Dict[Future, str] = {}
+
+    while pending or running:
+        for name, st in list(pending.items()):
+            if any(d in failed for d in st.deps):
+                del pending[name]
+                failed.add(name)
+                yield name, False, "skipped: a dependency failed"
+            elif all(d in results for d in st.deps):
+                del pending[name]
+                snapshot = dict(results)
+                running[pool.submit(metrics_service.bind(st.fn), snapshot)] = name
+        if not running:
+            if pending:  # only reachable with a dependency cycle
+                raise ValueError(f"Dependency cycle among stages: {sorted(pending)}")
+            break
+
+        done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+        for fut in done:
+            name = running.pop(fut)
+            try:
+                results[name] = fut.result()
+                yield name, True, results[name]
+            except Exception as e:
+                failed.add(name)
+                yield name, False, str(e)
@@ -0,0 +1,201 @@
+"""
+Lazy, fork-safe config and client registry.
+- secrets.json is parsed once per process (optionally re-read when its mtime changes)
+- Firebase / Firestore / Storage / Gemini / GCS / Vision clients are created on first
+  use in the process that uses them, so nothing gRPC-backed exists before a pre-fork
+  server forks, and each client is reused afterwards
+- Creation times are recorded (timings()) so cold-start cost is visible in /health
+
+Tunables (env vars):
+  CLARIMED_SECRETS_PATH     path to secrets.json (default: services/secrets.json)
+  CLARIMED_RELOAD_SECRETS   "1" to re-read secrets.json (and rebuild clients) when it changes
+  CLARIMED_IMPORT_BUDGET_S  warn when importing the app takes longer than this (default: 1.0)
+"""
+from __future__ import annotations
+import json, os, threading, time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+HERE = Path(__file__).resolve().parent
+BACKEND_DIR = HERE.parent
+SECRETS_PATH = Path(os.getenv("CLARIMED_SECRETS_PATH", str(HERE / "secrets.json")))
+RELOAD_SECRETS = os.getenv("CLARIMED_RELOAD_SECRETS", "") in ("1", "true", "yes")
+IMPORT_BUDGET_S = float(os.getenv("CLARIMED_IMPORT_BUDGET_S", "1.0"))
+
+_RELOAD_CHECK_S = 2.0
+
+_lock = threading.RLock()
+_pid: Optional[int] = None
+_secrets: Optional[Dict[str, Any]] = None
+_secrets_mtime: float = 0.0
+_secrets_checked: float = 0.0
+_clients: Dict[str, Any] = {}
+_overrides: Dict[str, Any] = {}
+_firebase_app = None
+_timings: Dict[str, float] = {}
+
+
+def _check_pid():
+    """Drop everything inherited from a parent process; children build their own clients."""
+    global _pid, _firebase_app
+    if _pid == os.getpid():
+        return
+    _clients.clear()
+    if _firebase_app is not None:
+        try:
+            import firebase_admin
+            firebase_admin.delete_app(_firebase_app)
+        except Exception:
+            pass
+        _firebase_app = None
+    _pid = os.getpid()
+
+
+def _reset_clients():
+    global _firebase_app
+    _clients.clear()
+    if _firebase_app is not None:
+        import firebase_admin
+        firebase_admin.delete_app(_firebase_app)
+        _firebase_app = None
+
+
+def record(name: str, seconds: float):
+    _timings[name] = round(seconds, 4)
+
+
+def timings() -> Dict[str, float]:
+    return dict(_timings)
+
+
+# ---------- config ----------
+
+def secrets() -> Dict[str, Any]:
+    global _secrets, _secrets_mtime, _secrets_checked
+    with _lock:
+        _check_pid()
+        if _secrets is not None and not RELOAD_SECRETS:
+            return _secrets
+        now = time.monotonic()
+        if _secrets is not None and now - _secrets_checked < _RELOAD_CHECK_S:
+            return _secrets
+        _secrets_checked = now
+        if not SECRETS_PATH.exists():
+            raise FileNotFoundError(f"Missing secrets.json at {SECRETS_PATH}")
+        mtime = SECRETS_PATH.stat().st_mtime
+        if _secrets is not None and mtime == _secrets_mtime:
+            return _secrets
+        start = time.perf_counter()
+        with SECRETS_PATH.open(encoding="utf-8") as f:
+            data = json.load(f)
+        if _secrets is not None:
+            _reset_clients()  # credentials may have changed
+        _secrets, _secrets_mtime = data, mtime
+        record("secrets", time.perf_counter() - start)
+        return _secrets
+
+
+def resolve_path(value: str) -> Path:
+    """Paths in secrets.json are relative to backend/."""
+    return (BACKEND_DIR / value).resolve()
+
+
+# ---------- clients ----------
+
+def _get(name: str, factory: Callable[[], Any]) -> Any:
+    with _lock:
+        _check_pid()
+        if name in _overrides:
+            return _overrides[name]
+        client = _clients.get(name)
+        if client is None:
+            start = time.perf_counter()
+            client = factory()
+            record(name, time.perf_counter() - start)
+            _clients[name] = client
+        return client
+
+
+def override(name: str, obj: Any):
+    """Install a stand-in client (benchmarks, local runs). Pass None to remove it."""
+    with _lock:
+        if obj is None:
+            _overrides.pop(name, None)
+        else:
+            _overrides[name] = obj
+
+
+def firebase_app():
+    def make():
+        global _firebase_app
+        import firebase_admin
+        from firebase_admin import credentials
+
+        s = secrets()
+        cred_path = resolve_path(s["FIREBASE_ADMIN_PATH"])
+        if not cred_path.exists():
+            raise FileNotFoundError(
+                f"Service account JSON not found at {cred_path}. "
+                f"Update 'FIREBASE_ADMIN_PATH' in secrets.json."
+            )
+        if firebase_admin._apps:
+            return firebase_admin.get_app()
+        _firebase_app = firebase_admin.initialize_app(
+            credentials.Certificate(str(cred_path)),
+            {
+                "projectId": s["FIREBASE_PROJECT_ID"],
+                "storageBucket": s["FIREBASE_STORAGE_BUCKET"],
+            },
+        )
+        return _firebase_app
+    return _get("firebase_app", make)
+
+
+def db():
+    def make():
+        from firebase_admin import firestore
+        return firestore.client(firebase_app())
+    return _get("firestore", make)
+
+
+def bucket():
+    def make():
+        from firebase_admin import storage
+        return storage.bucket(app=firebase_app())  # default bucket from config
+    return _get("bucket", make)
+
+
+def gemini_model_id() -> str:
+    return secrets().get("GEMINI_MODEL", "gemini-2.5-flash")
+
+
+def gemini_model():
+    def make():
+        import google.generativeai as genai
+        genai.configure(api_key=secrets()["GEMINI_API_KEY"])
+        return genai.GenerativeModel(gemini_model_id())
+    return _get("gemini_model", make)
+
+
+def _google_credentials() -> str:
+    cred = secrets().get("GOOGLE_APPLICATION_CREDENTIALS")
+    if not (cred and os.path.exists(cred)):
+        raise RuntimeError("GOOGLE_APPLICATION_CREDENTIALS missing or not found.")
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = cred
+    return cred
+
+
+def storage_client():
+    def make():
+        from google.cloud import storage
+        _google_credentials()
+        return storage.Client()
+    return _get("gcs_client", make)
+
+
+def vision_client():
+    def make():
+        from google.cloud import vision
+        _google_credentials()
+        return vision.ImageAnnotatorClient()
+    return _get("vision_client", make)
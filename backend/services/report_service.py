@@ -0,0 +1,182 @@
+"""
+Fused report generation: summary, key points, recommendations and (optionally) a
+translated copy from ONE Gemini call with a JSON response schema, instead of the
+separate /process-text, /recommendations and /translate prompts that each re-send
+the source text.
+
+- generate / generate_async: the fused result for a source text, cached like any
+  other Gemini response (gemini_cache, keyed on model, source and target language)
+- Output is parsed with gemini_service.repair_json and normalized locally (bullet
+  markers stripped, strings split into lists, missing lists empty); only a missing
+  summary is an error
+- Every fused result is indexed by its summary (namespace "fused_index"), so the
+  follow-up calls a client makes with that summary (/recommendations, /translate)
+  are answered from it without another Gemini call
+
+Tunables (env vars):
+  FUSED_REPORTS   1 = summaries come from the fused call, 0 = one prompt per endpoint (default: 1)
+"""
+from __future__ import annotations
+import asyncio, os, re
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from services import gemini_service
+from services.cache_service import TwoTierCache, gemini_cache, make_key
+
+ENABLED = os.getenv("FUSED_REPORTS", "1").lower() not in ("0", "false", "no")
+
+_index = TwoTierCache("fused_index")
+
+_LIST = {"type": "ARRAY", "items": {"type": "STRING"}}
+REPORT_SCHEMA: Dict[str, Any] = {
+    "type": "OBJECT",
+    "properties": {
+        "summary": {"type": "STRING"},
+        "key_points": _LIST,
+        "recommendations": _LIST,
+        "translation": {
+            "type": "OBJECT",
+            "properties": {"summary": {"type": "STRING"}, "key_points": _LIST, "recommendations": _LIST},
+        },
+    },
+    "required": ["summary", "key_points", "recommendations"],
+}
+
+_MARKER = re.compile(r"^\s*(?:[-*•]|\d{1,2}[.)])\s*")
+
+
+def fused_prompt(text: str, target: Optional[str] = None) -> str:
+    translation = (
+        f"- translation: the summary, key_points and recommendations above translated to {target}, "
+        "same structure; keep numbers, units and lab values unchanged.\n"
+        if target else ""
+    )
+    return (
+        "You are a careful, friendly medical assistant.\n"
+        "Read the following medical information and explain it to the patient in plain language "
+        "suitable for a 6th–8th grade reader, written directly to them (no 'Here is a summary').\n"
+        "\n"
+        "Return ONLY a JSON object with these fields:\n"
+        "- summary: one paragraph of 4–6 sentences explaining the situation and main points.\n"
+        "- key_points: 5–8 short items covering the most important takeaways, practical steps at home, "
+        "when to contact a doctor or seek urgent care (clear red flags), and key terms or tests explained simply.\n"
+        "- recommendations: 5–8 short, positive, actionable items: follow-up care, preventive steps, "
+        "lifestyle guidance and questions to ask a doctor. Do not repeat the summary.\n"
+        f"{translation}"
+        "\n"
+        "Rules:\n"
+        "- Do not guess diagnoses. If something is uncertain, say it may require a clinician’s review.\n"
+        "- Avoid medical jargon. Prefer short, simple sentences and familiar words.\n"
+        "- List items are plain sentences without bullet markers or numbering.\n"
+        "- Write in a warm, helpful, and professional tone.\n"
+        "\n"
+        "TEXT TO SIMPLIFY:\n"
+        f"{text}"
+    )
+
+
+def _items(value: Any) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.splitlines()
+    elif not isinstance(value, list):
+        value = [value]
+    out = []
+    for item in value:
+        item = _MARKER.sub("", str(item)).strip()
+        if item:
+            out.append(item)
+    return out
+
+
+def _section(data: Dict[str, Any]) -> Dict[str, Any]:
+    summary = data.get("summary")
+    if isinstance(summary, list):
+        summary = " ".join(str(s) for s in summary)
+    return {
+        "summary": (summary or "").strip(),
+        "key_points": _items(data.get("key_points")),
+        "recommendations": _items(data.get("recommendations")),
+    }
+
+
+def normalize(data: Any, target: Optional[str] = None) -> Dict[str, Any]:
+    """Coerce model output into { summary, key_points, recommendations, translation? }."""
+    if isinstance(data, list) and len(data) == 1:
+        data = data[0]
+    if not isinstance(data, dict):
+        raise RuntimeError(f"Gemini returned {type(data).__name__} instead of a report object")
+    report = _section(data)
+    if not report["summary"]:
+        raise RuntimeError("Gemini returned a report without a summary")
+    if target:
+        translation = data.get("translation")
+        if isinstance(translation, str):
+            translation = {"summary": translation}
+        translation = _section(translation) if isinstance(translation, dict) else None
+        report["translation"] = translation if translation and translation["summary"] else None
+    return report
+
+
+def _key(model: str, text: str, target: Optional[str]) -> str:
+    return make_key("fused", model, text, (target or "").strip().lower())
+
+
+def _remember(report: Dict[str, Any], target: Optional[str]):
+    _index.set(make_key("recommendations", report["summary"]), report["recommendations"])
+    if target and report.get("translation"):
+        _index.set(make_key("translation", report["summary"], target.strip().lower()), report["translation"]["summary"])
+
+
+def _cached(key: str, use_cache: bool) -> Optional[Dict[str, Any]]:
+    return gemini_cache.get(key) if use_cache else None
+
+
+def _store(key: str, data: Any, target: Optional[str]) -> Dict[str, Any]:
+    report = normalize(data, target)
+    gemini_cache.set(key, report)
+    _remember(report, target)
+    return report
+
+
+def generate(
+    text: str,
+    model: str,
+    target: Optional[str] = None,
+    use_cache: bool = True,
+    generate_json: Optional[Callable[..., Any]] = None,
+) -> Dict[str, Any]:
+    """The fused report for a source text (one Gemini call to `model`, or none on a cache hit)."""
+    generate_json = generate_json or (lambda p, schema: gemini_service.generate_json(p, schema, model))
+    key = _key(model, text, target)
+    report = _cached(key, use_cache)
+    if report is None:
+        report = _store(key, generate_json(fused_prompt(text, target), REPORT_SCHEMA), target)
+    return report
+
+
+async def generate_async(
+    text: str,
+    model: str,
+    target: Optional[str] = None,
+    use_cache: bool = True,
+    generate_json: Optional[Callable[..., Awaitable[Any]]] = None,
+) -> Dict[str, Any]:
+    generate_json = generate_json or (lambda p, schema: gemini_service.generate_json_async(p, schema, model))
+    key = _key(model, text, target)
+    report = await asyncio.to_thread(_cached, key, use_cache)
+    if report is None:
+        data = await generate_json(fused_prompt(text, target), REPORT_SCHEMA)
+        report = await asyncio.to_thread(_store, key, data, target)
+    return report
+
+
+def recommendations_for(summary: str) -> Optional[List[str]]:
+    """Recommendations that came with this summary in a fused result, if any."""
+    return _index.get(make_key("recommendations", summary.strip()))
+
+
+def translation_for(summary: str, target: str) -> Optional[str]:
+    """The translated summary that came with this summary in a fused result, if any."""
+    return _index.get(make_key("translation", summary.strip(), target.strip().lower()))
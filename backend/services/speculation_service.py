@@ -0,0 +1,211 @@
+"""
+Speculative precompute of the calls that usually follow a summary.
+Once /process-text or /analyze-pdf has produced a summary, the client almost always
+asks for recommendations next, and often for a translation and audio. In speculative
+mode those are scheduled right away on a small background pool, keyed by a hash of
+their inputs; the later request attaches to the running task (or takes its result)
+instead of starting from zero.
+
+Speculation is strictly lower priority than real traffic and its spend is capped:
+- a small pool (SPECULATE_WORKERS) with a bounded backlog; new tasks beyond it are dropped
+- a task still queued after SPECULATE_START_S is cancelled, and a request that finds its
+  task still queued cancels it and does the work itself rather than waiting behind it
+- tasks start only within the SPECULATE_PER_MIN budget, and not while callers are
+  waiting in the provider's admission_service queue
+- unclaimed results are dropped after SPECULATE_TTL_S (counted as "wasted"); a task that
+  was skipped or failed is forgotten at once, so the next summary can schedule it again
+- the pool and the task table are per process: a forked worker starts with neither
+
+Opt-in: nothing is speculated unless SPECULATE lists it.
+
+Tunables (env vars):
+  SPECULATE               what to precompute: any of recommendations, translation, tts (default: off)
+  SPECULATE_WORKERS       background threads per process (default: 2)
+  SPECULATE_MAX_PENDING   queued + running speculative tasks per process (default: 16)
+  SPECULATE_PER_MIN       speculative tasks started per minute per process (default: 30)
+  SPECULATE_START_S       cancel a task that has not started after this long (default: 30)
+  SPECULATE_TTL_S         keep an unclaimed result this long (default: 600)
+"""
+from __future__ import annotations
+import asyncio, os, threading, time
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from services import admission_service, metrics_service
+from services.cache_service import make_key
+
+KINDS = frozenset(k.strip() for k in os.getenv("SPECULATE", "").lower().split(",") if k.strip())
+WORKERS = int(os.getenv("SPECULATE_WORKERS", "2"))
+MAX_PENDING = int(os.getenv("SPECULATE_MAX_PENDING", "16"))
+PER_MIN = float(os.getenv("SPECULATE_PER_MIN", "30"))
+START_S = float(os.getenv("SPECULATE_START_S", "30"))
+TTL_S = float(os.getenv("SPECULATE_TTL_S", "600"))
+
+_PROVIDERS = {
+    "recommendations": admission_service.gemini,
+    "translation": admission_service.gemini,
+    "tts": admission_service.elevenlabs,
+}
+
+
+class Skipped(RuntimeError):
+    """The task gave up its turn (budget, provider busy, too late)."""
+
+
+class _Task:
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.created = time.monotonic()
+        self.started = False
+        self.claimed = False
+        self.future: Optional[Future] = None
+
+
+_lock = threading.Lock()
+_tasks: Dict[str, _Task] = {}
+_budget = admission_service.TokenBucket(PER_MIN / 60.0, max(1.0, PER_MIN / 6.0)) if PER_MIN > 0 else None
+_pool: Optional[ThreadPoolExecutor] = None
+_pid: Optional[int] = None
+
+
+def enabled(kind: str) -> bool:
+    return kind in KINDS
+
+
+def _check_pid():
+    """Forget a parent process's pool and tasks: their threads do not exist here (call with _lock held)."""
+    global _pool, _pid
+    if _pid != os.getpid():
+        _tasks.clear()
+        _pool = None
+        _pid = os.getpid()
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    _check_pid()
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=max(1, WORKERS), thread_name_prefix="speculate")
+    return _pool
+
+
+def _count(kind: str, outcome: str):
+    metrics_service.SPECULATION.inc(kind=kind, outcome=outcome)
+
+
+def _expire(now: float):
+    """Drop stale tasks (call with _lock held)."""
+    for key, task in list(_tasks.items()):
+        if now - task.created < TTL_S:
+            continue
+        del _tasks[key]
+        if task.future is not None and task.future.cancel():
+            _count(task.kind, "cancelled")
+        elif not task.claimed:
+            _count(task.kind, "wasted")
+
+
+def _run(key: str, task: _Task, fn: Callable[[], Any]) -> Any:
+    try:
+        return _attempt(task, fn)
+    except Exception:
+        with _lock:
+            if _tasks.get(key) is task:
+                del _tasks[key]   # skipped or failed: free the key for the next schedule()
+        raise
+
+
+def _attempt(task: _Task, fn: Callable[[], Any]) -> Any:
+    now = time.monotonic()
+    if now - task.created > START_S:
+        _count(task.kind, "cancelled")
+        raise Skipped("queued too long")
+    governor = _PROVIDERS.get(task.kind)
+    if governor is not None and governor.stats()["waiting"]:
+        _count(task.kind, "yielded")
+        raise Skipped(f"{governor.provider} is busy with real requests")
+    with _lock:
+        if _budget is not None:
+            if _budget.delay(1, now) > 0:
+                _count(task.kind, "over_budget")
+                raise Skipped("speculation budget exhausted")
+            _budget.take(1)
+        task.started = True
+    try:
+        result = fn()
+    except Exception:
+        _count(task.kind, "failed")
+        raise
+    _count(task.kind, "done")
+    return result
+
+
+def schedule(kind: str, parts: Tuple[Any, ...], fn: Callable[[], Any]) -> bool:
+    """Precompute fn() for the request identified by (kind, *parts); False if not scheduled."""
+    if kind not in KINDS:
+        return False
+    key = make_key("speculate", kind, *parts)
+    with _lock:
+        _check_pid()
+        _expire(time.monotonic())
+        if key in _tasks:
+            return False
+        active = sum(1 for t in _tasks.values() if t.future is not None and not t.future.done())
+        if active >= MAX_PENDING:
+            _count(kind, "dropped")
+            return False
+        task = _tasks[key] = _Task(kind)
+        task.future = _executor().submit(_run, key, task, fn)  # not bound: its stages are not the request's
+    _count(kind, "scheduled")
+    return True
+
+
+def _attach(kind: str, parts: Tuple[Any, ...]) -> Optional[Future]:
+    if kind not in KINDS:
+        return None
+    key = make_key("speculate", kind, *parts)
+    with _lock:
+        _check_pid()
+        task = _tasks.get(key)
+        if task is None:
+            return None
+        if not task.started and task.future.cancel():
+            # Still queued: the caller is faster doing it now than waiting for a worker.
+            del _tasks[key]
+            _count(kind, "cancelled")
+            return None
+        task.claimed = True
+    return task.future
+
+
+def _claimed(kind: str, future: Future) -> Optional[Any]:
+    try:
+        result = future.result()
+    except (CancelledError, Exception):
+        return None   # skipped or failed: the caller does the work itself and reports its own error
+    _count(kind, "claimed")
+    return result
+
+
+def claim(kind: str, parts: Tuple[Any, ...]) -> Optional[Any]:
+    """The speculative result for (kind, *parts), waiting for it if it is running; else None."""
+    future = _attach(kind, parts)
+    return None if future is None else _claimed(kind, future)
+
+
+async def claim_async(kind: str, parts: Tuple[Any, ...]) -> Optional[Any]:
+    """claim() without blocking the event loop while the task finishes."""
+    if kind not in KINDS:
+        return None
+    future = await asyncio.to_thread(_attach, kind, parts)
+    if future is None:
+        return None
+    await asyncio.wait([asyncio.wrap_future(future)])
+    return _claimed(kind, future)
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        _check_pid()
+        running = sum(1 for t in _tasks.values() if t.started and not t.future.done())
+        return {"kinds": sorted(KINDS), "tasks": len(_tasks), "running": running}
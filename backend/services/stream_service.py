@@ -0,0 +1,116 @@
+"""
+Server-Sent-Events helpers for streaming Gemini output to the browser.
+
+Event sequence for summary endpoints:
+  event: summary    data: {"delta": "..."}            (repeated, paragraph tokens)
+  event: key_point  data: {"index": n, "text": "..."}  (one per completed bullet)
+  event: done       data: {"ok": true, "summary": ..., "key_points": [...]}
+  event: error      data: {"ok": false, "error": "..."}
+"""
+from __future__ import annotations
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+BULLET = "\n- "
+
+
+def wants_stream(req) -> bool:
+    """Opt-in via `?stream=1` or `Accept: text/event-stream`."""
+    if (req.args.get("stream") or "").lower() in ("1", "true", "yes"):
+        return True
+    return "text/event-stream" in (req.headers.get("Accept") or "")
+
+
+def sse_event(event: str, data: Any) -> str:
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+def split_summary(result: str) -> Tuple[str, List[str]]:
+    """Paragraph first, then '- ' bullets (same heuristic the JSON endpoints use)."""
+    parts = result.split(BULLET)
+    summary = parts[0].strip()
+    key_points = [p.strip("- ").strip() for p in parts[1:]] if len(parts) > 1 else []
+    return summary, key_points
+
+
+class SummaryStreamParser:
+    """
+    Incrementally splits model output into summary tokens and bullet lines.
+    feed() returns SSE strings ready to write; nothing is buffered longer than
+    needed to tell whether a trailing newline starts a bullet.
+    """
+
+    def __init__(self):
+        self.text = ""          # everything received so far
+        self._emitted = 0       # chars of the summary paragraph already sent
+        self._in_bullets = False
+        self._line = ""         # current (incomplete) bullet line
+        self._points = 0
+
+    def feed(self, chunk: str) -> List[str]:
+        if not chunk:
+            return []
+        self.text += chunk
+        out: List[str] = []
+
+        if not self._in_bullets:
+            idx = self.text.find(BULLET, self._emitted)
+            if idx == -1:
+                # Hold back a possible partial "\n-" at the end.
+                safe = len(self.text)
+                for tail in ("\n-", "\n"):
+                    if self.text.endswith(tail):
+                        safe -= len(tail)
+                        break
+                if safe > self._emitted:
+                    out.append(sse_event("summary", {"delta": self.text[self._emitted:safe]}))
+                    self._emitted = safe
+                return out
+            if idx > self._emitted:
+                out.append(sse_event("summary", {"delta": self.text[self._emitted:idx]}))
+            self._emitted = idx
+            self._in_bullets = True
+            chunk = self.text[idx:].lstrip("\n")
+
+        self._line += chunk
+        while "\n" in self._line:
+            line, self._line = self._line.split("\n", 1)
+            out.extend(self._emit_line(line))
+        return out
+
+    def finish(self) -> List[str]:
+        """Flush the last bullet; the caller sends the `done` event."""
+        out: List[str] = []
+        if not self._in_bullets and len(self.text) > self._emitted:
+            out.append(sse_event("summary", {"delta": self.text[self._emitted:]}))
+            self._emitted = len(self.text)
+        if self._line:
+            out.extend(self._emit_line(self._line))
+            self._line = ""
+        return out
+
+    def _emit_line(self, line: str) -> List[str]:
+        if not line.startswith("- "):
+            return []  # blank or continuation line; final result carries the full text
+        point = line.strip("- ").strip()
+        if not point:
+            return []
+        event = sse_event("key_point", {"index": self._points, "text": point})
+        self._points += 1
+        return [event]
+
+
+def stream_summary(chunks: Iterable[str], extra: Dict[str, Any] | None = None) -> Iterator[str]:
+    """Turn raw model chunks into the full SSE event sequence."""
+    parser = SummaryStreamParser()
+    try:
+        for chunk in chunks:
+            yield from parser.feed(chunk)
+        yield from parser.finish()
+        summary, key_points = split_summary(parser.text)
+        done = {"ok": True, "summary": summary, "key_points": key_points}
+        done.update(extra or {})
+        yield sse_event("done", done)
+    except Exception as e:
+        yield sse_event("error", {"ok": False, "error": f"Gemini error: {e}"})
@@ -0,0 +1,175 @@
+"""
+Map-reduce summarization for long documents.
+- Packs page texts into token-budgeted chunks (page boundaries first, then sections)
+- Summarizes chunks concurrently (map), then hands the notes to the final prompt (reduce)
+- reduce_input_async: the same plan on the event loop, for async generate functions
+
+Chunk prompts contain only the chunk text, so the response cache reuses every
+unchanged chunk when a document is uploaded again. Callers that know stable page
+boundaries (document_index_service) pass `breaks`, so a page inserted mid-document
+only changes the chunks up to the next break instead of every chunk after it.
+
+Tunables (env vars):
+  SUMMARY_CHUNK_TOKENS   token budget per chunk / reduce input (default: 6000)
+  SUMMARY_PARALLELISM    max concurrent chunk calls (default: 4)
+"""
+from __future__ import annotations
+import asyncio, os, re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Iterable, List, Optional, Sequence
+
+from services import metrics_service
+
+CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "6000"))
+PARALLELISM = int(os.getenv("SUMMARY_PARALLELISM", "4"))
+
+# Lines that look like section headings in clinical documents ("HISTORY:", "LABS", "2. Plan").
+_HEADING = re.compile(r"^\s*(?:\d+[.)]\s+)?[A-Z][A-Z0-9 /&()\-]{2,60}:?\s*$|^\s*[A-Za-z][\w /&()\-]{2,60}:\s*$")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 chars/token for English clinical text)."""
+    return len(text) // 4 + 1
+
+
+def _split_sections(text: str) -> List[str]:
+    """Split on blank lines and heading lines, keeping headings with their body."""
+    sections: List[str] = []
+    current: List[str] = []
+    for line in text.splitlines():
+        if (not line.strip() or _HEADING.match(line)) and current and any(l.strip() for l in current):
+            sections.append("\n".join(current).strip())
+            current = []
+        current.append(line)
+    if current and any(l.strip() for l in current):
+        sections.append("\n".join(current).strip())
+    return sections
+
+
+def _hard_split(text: str, budget: int) -> List[str]:
+    """Last resort for a single huge section: cut on line, then character boundaries."""
+    limit = budget * 4
+    out: List[str] = []
+    buf = ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if buf:
+                out.append(buf)
+                buf = ""
+            out.append(line[:limit])
+            line = line[limit:]
+        if len(buf) + len(line) > limit and buf:
+            out.append(buf)
+            buf = ""
+        buf += line
+    if buf.strip():
+        out.append(buf)
+    return [o.strip() for o in out if o.strip()]
+
+
+def _pieces(page: str, budget: int) -> List[str]:
+    if estimate_tokens(page) <= budget:
+        return [page]
+    out: List[str] = []
+    for section in _split_sections(page):
+        out.extend([section] if estimate_tokens(section) <= budget else _hard_split(section, budget))
+    return out
+
+
+def chunk_pages(
+    pages: Iterable[str], budget: int = CHUNK_TOKENS, breaks: Optional[Sequence[bool]] = None
+) -> List[str]:
+    """
+    Greedily pack pages (or their sections when a page is too big) into chunks under budget.
+    breaks[i] starts a new chunk at page i even if the current one has room.
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    used = 0
+    for i, page in enumerate(pages):
+        if breaks is not None and breaks[i] and current:
+            chunks.append("\n\n".join(current))
+            current, used = [], 0
+        for piece in _pieces(page.strip(), budget):
+            if not piece:
+                continue
+            cost = estimate_tokens(piece)
+            if current and used + cost > budget:
+                chunks.append("\n\n".join(current))
+                current, used = [], 0
+            current.append(piece)
+            used += cost
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def chunk_prompt(chunk: str) -> str:
+    return (
+        "You are a careful medical assistant. The text below is one part of a longer medical document.\n"
+        "Write 3–8 short '- ' bullet notes capturing the facts that matter for the patient: diagnoses, "
+        "test results with values, medications and doses, procedures, follow-up instructions and warning signs.\n"
+        "Do not guess or add information that is not in the text. Return only the bullets.\n\n"
+        f"TEXT:\n{chunk}"
+    )
+
+
+def map_chunks(chunks: List[str], generate: Callable[[str], str], parallelism: int = PARALLELISM) -> List[str]:
+    """Summarize chunks concurrently; results come back in chunk order."""
+    if len(chunks) == 1:
+        return [generate(chunk_prompt(chunks[0])).strip()]
+    with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(chunks)))) as pool:
+        return [n.strip() for n in pool.map(metrics_service.bind(lambda c: generate(chunk_prompt(c))), chunks)]
+
+
+def reduce_input(
+    pages: List[str],
+    generate: Callable[[str], str],
+    budget: int = CHUNK_TOKENS,
+    parallelism: int = PARALLELISM,
+    breaks: Optional[Sequence[bool]] = None,
+) -> str:
+    """
+    Return text for the final summary prompt: the document itself when it fits
+    in one chunk, otherwise the (recursively condensed) chunk notes.
+    """
+    chunks = chunk_pages(pages, budget, breaks)
+    if len(chunks) <= 1:
+        return chunks[0] if chunks else ""
+    notes = map_chunks(chunks, generate, parallelism)
+    for _ in range(3):  # bounded: each round shrinks the notes by roughly the chunk ratio
+        if estimate_tokens("\n\n".join(notes)) <= budget or len(notes) <= 1:
+            break
+        notes = map_chunks(chunk_pages(notes, budget), generate, parallelism)
+    return "\n\n".join(notes)
+
+
+async def map_chunks_async(
+    chunks: List[str], generate: Callable[[str], Awaitable[str]], parallelism: int = PARALLELISM
+) -> List[str]:
+    gate = asyncio.Semaphore(max(1, parallelism))
+
+    async def one(chunk: str) -> str:
+        async with gate:
+            return (await generate(chunk_prompt(chunk))).strip()
+
+    return list(await asyncio.gather(*(one(c) for c in chunks)))
+
+
+async def reduce_input_async(
+    pages: List[str],
+    generate: Callable[[str], Awaitable[str]],
+    budget: int = CHUNK_TOKENS,
+    parallelism: int = PARALLELISM,
+    breaks: Optional[Sequence[bool]] = None,
+) -> str:
+    """reduce_input() with an async generate; chunking (CPU) runs off the event loop."""
+    chunks = await asyncio.to_thread(chunk_pages, pages, budget, breaks)
+    if len(chunks) <= 1:
+        return chunks[0] if chunks else ""
+    notes = await map_chunks_async(chunks, generate, parallelism)
+    for _ in range(3):
+        if estimate_tokens("\n\n".join(notes)) <= budget or len(notes) <= 1:
+            break
+        notes = await map_chunks_async(await asyncio.to_thread(chunk_pages, notes, budget), generate, parallelism)
+    return "\n\n".join(notes)
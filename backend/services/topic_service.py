@@ -0,0 +1,92 @@
+"""
+Local "is this a medical question?" gate for /chat.
+A keyword / bigram / suffix scorer that runs in microseconds, replacing the
+extra Gemini round trip the chat popup used to make per message.
+
+is_medical(text, has_context) -> (decision, score)
+  - medical vocabulary (incl. common labs, drugs and symptoms), clinical bigrams and
+    medical word endings score positive
+  - clearly unrelated vocabulary (sports, coding, recipes, ...) scores negative
+  - when the session has a report summary or history, anything not clearly off-topic
+    (score >= 0) is allowed, including follow-ups that point back at the report
+    ("what does that mean?"); without context a message needs a positive score
+"""
+from __future__ import annotations
+import re
+from typing import FrozenSet, Tuple
+
+_WORD = re.compile(r"[a-z][a-z0-9']*")
+
+MEDICAL_WORDS: FrozenSet[str] = frozenset("""
+    abdomen ache allergy allergic anemia antibiotic antibiotics anxiety appointment artery asthma
+    bacteria benign biopsy bleeding blood bmi body bone bp breath breathing cancer cardiac
+    cholesterol chronic clinic clot cough covid creatinine ct cyst depression diabetes diabetic
+    diagnosis diagnosed diet disease dizzy dizziness doctor dosage dose ecg ekg enzyme exercise
+    eye fatigue fever flu fracture glucose gp hba1c headache health healthy heart hemoglobin
+    hormone hospital hypertension ill illness immune infection inflammation injury insulin
+    kidney lab labs lesion liver lung lymph malignant medical medication medicine medicines
+    mental migraine mri muscle nausea nerve nurse nutrition obesity oncology organ pain
+    palpitations pathology patient pharmacy physician platelet platelets pregnancy pregnant
+    prescription pressure prognosis pulse rash recovery referral report result results
+    scan scans screening sick skin sleep specialist sugar surgeon surgery swelling symptom
+    symptoms syndrome tablet tablets test tests therapy thyroid tissue treatment tumor tumour
+    ultrasound urine vaccine vein virus vitamin vomiting weight wound xray x-ray
+
+    a1c alt ast bilirubin bun calcium cbc crp egfr esr ferritin hdl hct inr iron ldl lipid
+    lipids magnesium potassium psa rbc sodium tsh triglycerides wbc
+    acetaminophen advil amlodipine amoxicillin antacid aspirin atorvastatin ibuprofen
+    levothyroxine lisinopril losartan metformin metoprolol naproxen omeprazole paracetamol
+    prednisone statin statins tylenol warfarin pill pills drug drugs
+    chest tightness shortness numbness tingling cramps cramp bruising bruise itching itchy
+    constipation diarrhea insomnia fainting faint sore throat stomach joint joints
+    swollen bloating heartburn wheezing sweating chills tired weakness
+""".split())
+
+MEDICAL_BIGRAMS: FrozenSet[Tuple[str, str]] = frozenset({
+    ("blood", "pressure"), ("blood", "test"), ("blood", "sugar"), ("heart", "rate"),
+    ("side", "effects"), ("side", "effect"), ("white", "cells"), ("red", "cells"),
+    ("follow", "up"), ("reference", "range"), ("test", "results"), ("my", "report"),
+    ("my", "results"), ("my", "doctor"), ("should", "worry"), ("is", "serious"),
+    ("high", "cholesterol"), ("low", "iron"), ("x", "ray"), ("feel", "sick"),
+    ("short", "of"), ("worried", "about"),
+})
+
+MEDICAL_SUFFIXES: Tuple[str, ...] = (
+    "itis", "emia", "aemia", "osis", "ectomy", "otomy", "oscopy", "ology", "algia", "oma",
+    "pathy", "plasia", "uria", "cyte", "cytes", "trophy",
+)
+
+OFF_TOPIC_WORDS: FrozenSet[str] = frozenset("""
+    bitcoin stock stocks crypto football soccer basketball cricket nba nfl movie movies film
+    netflix song songs lyrics recipe cook cooking bake python javascript code coding program
+    programming compile homework essay poem joke jokes weather election president politics
+    capital country countries math equation integral derivative translate hotel flight travel
+    game games minecraft fortnite car cars celebrity
+""".split())
+
+def _tokens(text: str):
+    return _WORD.findall(text.lower())
+
+
+def score(text: str) -> int:
+    words = _tokens(text)
+    s = 0
+    for w in words:
+        if w in MEDICAL_WORDS:
+            s += 2
+        elif w in OFF_TOPIC_WORDS:
+            s -= 2
+        elif len(w) > 5 and w.endswith(MEDICAL_SUFFIXES):
+            s += 1
+    for bigram in zip(words, words[1:]):
+        if bigram in MEDICAL_BIGRAMS:
+            s += 2
+    return s
+
+
+def is_medical(text: str, has_context: bool = False) -> Tuple[bool, int]:
+    """Decide locally whether a chat message is in scope; returns (decision, score)."""
+    s = score(text)
+    if s < 0:
+        return False, s
+    return s > 0 or has_context, s
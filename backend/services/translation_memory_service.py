@@ -0,0 +1,282 @@
+"""
+Segment-level translation memory.
+Texts are split into sentences (list markers, whitespace and line breaks are kept
+aside verbatim), and each sentence is looked up by (model, target language,
+normalized source). Only sentences never seen before go to Gemini, all of them in
+one batched prompt per TM_BATCH_CHARS; the translation is reassembled in order.
+Reports repeat the same sentences ("No acute findings.", red-flag advice, lab
+names), so after warm-up most requests make no Gemini call at all.
+
+Entries live in a TwoTierCache (namespace "translation_memory"): LRU in memory,
+SQLite on disk with TTL and size-capped eviction, shared by the workers on a host.
+
+A period after a title or Latin abbreviation ("Dr.", "approx.", "vs.", "e.g."), after
+an initial, or before a lowercase word does not end a sentence, so "Seen by Dr. Patel,
+approx. 2 cm lesion vs. cyst." stays one segment. Units and dosing shorthand ("mg.",
+"p.o.") routinely end a sentence and do: "Take 5 mg. Call your doctor" is two.
+
+If Gemini's batch answer cannot be matched up with the input (not a JSON array,
+wrong length), the missing sentences are translated one prompt each instead, up
+to TM_FALLBACK_PARALLELISM at a time.
+
+Tunables (env vars):
+  TM_BATCH_CHARS   source characters per batched Gemini prompt (default: 6000)
+  TM_MEM_ITEMS     sentences kept in the in-process LRU (default: 4096)
+  TM_FALLBACK_PARALLELISM  concurrent one-sentence prompts when a batch answer is unusable (default: 8)
+"""
+from __future__ import annotations
+import asyncio, json, os, re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from services import metrics_service
+from services.cache_service import TwoTierCache, make_key
+
+BATCH_CHARS = int(os.getenv("TM_BATCH_CHARS", "6000"))
+FALLBACK_PARALLELISM = int(os.getenv("TM_FALLBACK_PARALLELISM", "8"))
+
+_memory = TwoTierCache("translation_memory", mem_items=int(os.getenv("TM_MEM_ITEMS", "4096")))
+
+_LINE_PREFIX = re.compile(r"\s*(?:[-*•]\s+|\d{1,3}[.)]\s+|#{1,6}\s+)?")
+_SENTENCE_END = re.compile(r"(?<=[.!?。！？])(\s+)")
+_LETTER = re.compile(r"[^\W\d_]")
+_LAST_WORD = re.compile(r"(?<![^\s(\"'])([^\W\d_][\w.]*)\.$")   # a whole word: not the "L" of "mmol/L."
+
+# Lowercased, without the final period. Only words that are (almost) never the last of a
+# sentence: "etc.", units and dosing shorthand usually are, and are left out on purpose.
+ABBREVIATIONS = frozenset("""
+    dr drs mr mrs ms prof st sr jr vs approx e.g i.e cf fig figs no nos incl
+""".split())
+
+Piece = Tuple[bool, str]   # (translatable, text)
+
+
+def _continues(before: str, after: str) -> bool:
+    """Whether the period-space between `before` and `after` is not a sentence end."""
+    if not after or after[0].islower():
+        return True   # "vs. cyst", trailing whitespace
+    m = _LAST_WORD.search(before)
+    return bool(m) and (len(m.group(1)) == 1 or m.group(1).lower() in ABBREVIATIONS)
+
+
+def _split_sentences(text: str) -> List[str]:
+    """_SENTENCE_END.split(text) (sentences at even, whitespace at odd indices), minus abbreviation breaks."""
+    parts = _SENTENCE_END.split(text)
+    out = [parts[0]]
+    for i in range(1, len(parts), 2):
+        space, after = parts[i], parts[i + 1]
+        if out[-1].endswith(".") and _continues(out[-1], after):
+            out[-1] += space + after
+        else:
+            out += [space, after]
+    return out
+
+
+def segment(text: str) -> List[Piece]:
+    """Sentences and the literal text between them; joining every piece gives `text` back."""
+    pieces: List[Piece] = []
+    for line in (text or "").splitlines(keepends=True):
+        body = line.rstrip("\r\n")
+        prefix = _LINE_PREFIX.match(body).group(0)
+        if prefix:
+            pieces.append((False, prefix))
+        for i, part in enumerate(_split_sentences(body[len(prefix):])):
+            if i % 2:
+                pieces.append((False, part))
+                continue
+            sentence = part.rstrip()
+            if sentence:
+                # numbers, units and punctuation are left as they are
+                pieces.append((bool(_LETTER.search(sentence)), sentence))
+            if part[len(sentence):]:
+                pieces.append((False, part[len(sentence):]))
+        if line[len(body):]:
+            pieces.append((False, line[len(body):]))
+    return pieces
+
+
+def normalize(sentence: str) -> str:
+    return " ".join(sentence.split())
+
+
+def memory_key(model: str, target: str, sentence: str) -> str:
+    return make_key("tm", model, target.strip().lower(), normalize(sentence))
+
+
+def batch_prompt(sentences: List[str], target: str) -> str:
+    return (
+        f"Translate each string in the JSON array below to {target}. "
+        "Translate every item on its own and keep numbers, units and lab values unchanged. "
+        "Return ONLY a JSON array of strings with the same number of items, in the same order.\n\n"
+        + json.dumps(sentences, ensure_ascii=False)
+    )
+
+
+def segment_prompt(sentence: str, target: str) -> str:
+    return f"Translate the following text to {target}. Return only the translated text.\n\n{sentence}"
+
+
+def _parse_batch(text: str, expected: int) -> Optional[List[str]]:
+    t = text.strip()
+    if t.startswith("```"):
+        t = t.strip("`").lstrip()
+        if t.lower().startswith("json"):
+            t = t[4:].lstrip()
+    try:
+        items = json.loads(t)
+    except ValueError:
+        return None
+    if not isinstance(items, list) or len(items) != expected or not all(isinstance(s, str) for s in items):
+        return None
+    return [s.strip() for s in items]
+
+
+def _batches(sentences: List[str]) -> List[List[str]]:
+    batches: List[List[str]] = [[]]
+    size = 0
+    for s in sentences:
+        if batches[-1] and size + len(s) > BATCH_CHARS:
+            batches.append([])
+            size = 0
+        batches[-1].append(s)
+        size += len(s)
+    return batches
+
+
+class _Plan:
+    """The sentences of several texts, with what the memory already knows about them."""
+
+    def __init__(self, texts: List[str], target: str, model: str):
+        self.target, self.model = target, model
+        self.texts = [segment(t) for t in texts]
+        self.keys: Dict[str, str] = {}   # normalized sentence -> memory key
+        for pieces in self.texts:
+            for translatable, s in pieces:
+                if translatable:
+                    self.keys.setdefault(normalize(s), memory_key(model, target, s))
+        self.known: Dict[str, str] = {}
+
+    def lookup(self, use_cache: bool):
+        if use_cache:
+            for sentence, key in self.keys.items():
+                hit = _memory.get(key)
+                if hit is not None:
+                    self.known[sentence] = hit
+        metrics_service.TM_SEGMENTS.inc(len(self.known), outcome="hit")
+        metrics_service.TM_SEGMENTS.inc(len(self.keys) - len(self.known), outcome="miss")
+
+    def missing(self) -> List[str]:
+        return [s for s in self.keys if s not in self.known]
+
+    def learn(self, sentences: List[str], translations: List[str]):
+        for s, t in zip(sentences, translations):
+            if t:
+                self.known[s] = t
+                _memory.set(self.keys[s], t)
+
+    def assemble(self) -> List[str]:
+        return [
+            "".join(self.known.get(normalize(s), s) if translatable else s for translatable, s in pieces)
+            for pieces in self.texts
+        ]
+
+
+def translate_texts(
+    texts: List[str],
+    target: str,
+    model: str,
+    generate: Callable[[str], str],
+    use_cache: bool = True,
+) -> List[str]:
+    """Translate several texts with one batched Gemini prompt for all their unseen sentences."""
+    plan = _Plan(texts, target, model)
+    plan.lookup(use_cache)
+    missing = plan.missing()
+    batches = _batches(missing) if missing else []
+
+    def run(batch: List[str]):
+        translations = _parse_batch(generate(batch_prompt(batch, target)), len(batch))
+        if translations is None:
+            one = metrics_service.bind(lambda s: generate(segment_prompt(s, target)).strip())
+            with ThreadPoolExecutor(max_workers=max(1, min(FALLBACK_PARALLELISM, len(batch)))) as pool:
+                translations = list(pool.map(one, batch))
+        plan.learn(batch, translations)
+
+    if len(batches) == 1:
+        run(batches[0])
+    elif batches:
+        with ThreadPoolExecutor(max_workers=min(4, len(batches))) as pool:
+            list(pool.map(metrics_service.bind(run), batches))
+    return plan.assemble()
+
+
+def translate_text(text: str, target: str, model: str, generate: Callable[[str], str], use_cache: bool = True) -> str:
+    return translate_texts([text], target, model, generate, use_cache)[0]
+
+
+async def translate_texts_async(
+    texts: List[str],
+    target: str,
+    model: str,
+    generate: Callable[[str], Awaitable[str]],
+    use_cache: bool = True,
+) -> List[str]:
+    """translate_texts() on the event loop: memory lookups in a thread, batches concurrently."""
+    plan = _Plan(texts, target, model)
+    await asyncio.to_thread(plan.lookup, use_cache)
+    missing = plan.missing()
+    batches = _batches(missing) if missing else []
+
+    async def run(batch: List[str]):
+        translations = _parse_batch(await generate(batch_prompt(batch, target)), len(batch))
+        if translations is None:
+            gate = asyncio.Semaphore(max(1, FALLBACK_PARALLELISM))
+
+            async def one(s: str) -> str:
+                async with gate:
+                    return (await generate(segment_prompt(s, target))).strip()
+
+            translations = list(await asyncio.gather(*(one(s) for s in batch)))
+        await asyncio.to_thread(plan.learn, batch, translations)
+
+    await asyncio.gather(*(run(b) for b in batches))
+    return plan.assemble()
+
+
+def translate_values(
+    payload: Any,
+    target: str,
+    model: str,
+    generate: Callable[[str], str],
+    use_cache: bool = True,
+) -> Any:
+    """Translate every string leaf of a JSON value (keys and structure are kept)."""
+    leaves: List[str] = []
+
+    def collect(node: Any):
+        if isinstance(node, str):
+            leaves.append(node)
+        elif isinstance(node, dict):
+            for v in node.values():
+                collect(v)
+        elif isinstance(node, list):
+            for v in node:
+                collect(v)
+
+    collect(payload)
+    translated = iter(translate_texts(leaves, target, model, generate, use_cache))
+
+    def rebuild(node: Any) -> Any:
+        if isinstance(node, str):
+            return next(translated)
+        if isinstance(node, dict):
+            return {k: rebuild(v) for k, v in node.items()}
+        if isinstance(node, list):
+            return [rebuild(v) for v in node]
+        return node
+
+    return rebuild(payload)
+
+
+def stats() -> Dict[str, Any]:
+    return _memory.stats()
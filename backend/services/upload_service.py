@@ -0,0 +1,71 @@
+"""
+Bounded-memory uploads to Cloud Storage.
+- stream_to_blob() sends any readable stream (multipart file, raw request body) as a
+  resumable upload in fixed-size chunks, so at most one chunk is held in memory
+- Direct-to-bucket mode: the client PUTs to a signed URL (see /upload-url) and the
+  backend only verifies the object afterwards (describe())
+
+Tunables (env vars):
+  UPLOAD_CHUNK_MB            resumable upload chunk size, rounded to 256 KiB (default: 8)
+  UPLOAD_URL_EXPIRES_MIN     lifetime of signed PUT URLs (default: 15)
+  UPLOAD_MAX_MB              largest accepted upload, 0 = no limit (default: 200)
+"""
+from __future__ import annotations
+import os
+from typing import Any, Dict, Optional
+
+_CHUNK_ALIGN = 256 * 1024   # GCS requires resumable chunks in multiples of 256 KiB
+
+CHUNK_BYTES = max(1, int(float(os.getenv("UPLOAD_CHUNK_MB", "8")) * 1024 * 1024) // _CHUNK_ALIGN) * _CHUNK_ALIGN
+URL_EXPIRES_MIN = int(os.getenv("UPLOAD_URL_EXPIRES_MIN", "15"))
+MAX_BYTES = int(float(os.getenv("UPLOAD_MAX_MB", "200")) * 1024 * 1024)
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class _CountingReader:
+    """read()/tell() view of a forward-only stream that enforces MAX_BYTES."""
+
+    def __init__(self, stream, limit: int):
+        self._stream = stream
+        self._limit = limit
+        self._pos = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read(size if size and size > 0 else CHUNK_BYTES)
+        self._pos += len(data)
+        if self._limit and self._pos > self._limit:
+            raise UploadTooLarge(f"Upload exceeds {self._limit // (1024 * 1024)} MB")
+        return data
+
+    def tell(self) -> int:
+        return self._pos
+
+
+def check_size(size: Optional[int]):
+    if MAX_BYTES and size and size > MAX_BYTES:
+        raise UploadTooLarge(f"Upload exceeds {MAX_BYTES // (1024 * 1024)} MB")
+
+
+def stream_to_blob(blob, stream, content_type: str, size: Optional[int] = None) -> int:
+    """
+    Upload `stream` to `blob` in CHUNK_BYTES pieces (resumable); returns bytes sent.
+    `size` (e.g. Content-Length) is optional; without it the upload ends at EOF.
+    """
+    check_size(size)
+    reader = _CountingReader(stream, MAX_BYTES)
+    blob.chunk_size = CHUNK_BYTES
+    blob.upload_from_file(reader, size=size, content_type=content_type, rewind=False)
+    return reader.tell()
+
+
+def describe(blob) -> Optional[Dict[str, Any]]:
+    """Metadata for an object written by a client, or None if it is not there yet."""
+    from google.api_core.exceptions import NotFound
+    try:
+        blob.reload()
+    except NotFound:
+        return None
+    return {"size": blob.size, "content_type": blob.content_type}
@@ -0,0 +1,115 @@
+"""
+Signed-URL and object-existence caches for Storage reads.
+- Signed URLs are cached in-process per (bucket, path, method, content type) and
+  reused until SIGNED_URL_MARGIN_S before they expire, so repeated /file-url calls
+  and re-uploads of known objects do not sign again
+- Objects we upload ourselves are recorded in an existence index (TwoTierCache,
+  namespace "object_index", shared by all workers); only unknown paths cost a
+  blob.exists() round trip, and those run concurrently in sign_many()
+
+Tunables (env vars):
+  SIGNED_URL_TTL_S        lifetime of issued URLs (default: 3600)
+  SIGNED_URL_MARGIN_S     stop handing out a cached URL this long before it expires (default: 300)
+  SIGNED_URL_CACHE_ITEMS  max cached URLs per process (default: 4096)
+  OBJECT_INDEX_TTL_S      how long a confirmed object is trusted to still exist (default: 1 day)
+"""
+from __future__ import annotations
+import os, threading, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from services import metrics_service
+from services.cache_service import TwoTierCache
+
+URL_TTL_S = int(os.getenv("SIGNED_URL_TTL_S", "3600"))
+URL_MARGIN_S = int(os.getenv("SIGNED_URL_MARGIN_S", "300"))
+URL_CACHE_ITEMS = int(os.getenv("SIGNED_URL_CACHE_ITEMS", "4096"))
+INDEX_TTL_S = int(os.getenv("OBJECT_INDEX_TTL_S", str(24 * 3600)))
+
+_IO_PARALLELISM = 16
+
+_index = TwoTierCache("object_index", ttl=INDEX_TTL_S)
+
+_urls: "OrderedDict[Tuple[str, str, str, str], Tuple[float, str]]" = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "signed": 0, "exists_checks": 0}
+
+
+def _bucket_name(bucket) -> str:
+    return getattr(bucket, "name", "") or ""
+
+
+# ---------- existence ----------
+
+def mark_exists(bucket, path: str):
+    """Record an object we just wrote (uploads feed this)."""
+    _index.set(f"{_bucket_name(bucket)}/{path}", True)
+
+
+def forget(bucket, path: str):
+    _index.delete(f"{_bucket_name(bucket)}/{path}")
+    with _lock:
+        for key in [k for k in _urls if k[0] == _bucket_name(bucket) and k[1] == path]:
+            del _urls[key]
+
+
+def exists(bucket, path: str) -> bool:
+    key = f"{_bucket_name(bucket)}/{path}"
+    if _index.get(key):
+        return True
+    with _lock:
+        _stats["exists_checks"] += 1
+    with metrics_service.timed("storage_exists"):
+        found = bucket.blob(path).exists()
+    if found:
+        _index.set(key, True)
+        return True
+    return False  # misses are not cached: a direct upload may land any moment
+
+
+# ---------- signing ----------
+
+def signed_url(bucket, path: str, method: str = "GET", content_type: Optional[str] = None) -> str:
+    """Signed URL valid for at least SIGNED_URL_MARGIN_S more seconds."""
+    key = (_bucket_name(bucket), path, method, content_type or "")
+    now = time.time()
+    with _lock:
+        hit = _urls.get(key)
+        if hit is not None and hit[0] - URL_MARGIN_S > now:
+            _urls.move_to_end(key)
+            _stats["hits"] += 1
+            return hit[1]
+
+    kwargs = {"expiration": timedelta(seconds=URL_TTL_S), "version": "v4", "method": method}
+    if content_type:
+        kwargs["content_type"] = content_type
+    with metrics_service.timed("storage_sign"):
+        url = bucket.blob(path).generate_signed_url(**kwargs)
+
+    with _lock:
+        _urls[key] = (now + URL_TTL_S, url)
+        _urls.move_to_end(key)
+        while len(_urls) > URL_CACHE_ITEMS:
+            _urls.popitem(last=False)
+        _stats["signed"] += 1
+    return url
+
+
+def sign_many(bucket, paths: Iterable[str]) -> Dict[str, Optional[str]]:
+    """{path: signed GET url, or None if the object does not exist}; checks run concurrently."""
+    unique = list(dict.fromkeys(paths))
+    if not unique:
+        return {}
+
+    def one(path: str) -> Optional[str]:
+        return signed_url(bucket, path) if exists(bucket, path) else None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(_IO_PARALLELISM, len(unique)))) as pool:
+        return dict(zip(unique, pool.map(metrics_service.bind(one), unique)))
+
+
+def stats() -> Dict[str, int]:
+    with _lock:
+        return dict(_stats, cached_urls=len(_urls))
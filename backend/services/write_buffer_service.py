@@ -0,0 +1,399 @@
+"""
+Write-behind buffer for Firestore document writes (/save-note, /save-notes,
+session snapshots).
+- Writes are queued per document path; repeated writes to one path coalesce
+  (a plain set replaces, merge=True payloads are deep-merged)
+- A background thread commits them with batched writes (<= 500 ops) when the
+  buffer reaches FIRESTORE_BATCH_SIZE or every FIRESTORE_FLUSH_MS
+- Every queued write is appended to a per-process spill file first; the file is
+  rewritten after each commit and replayed by the next process if this one dies,
+  so accepted writes survive restarts. atexit drains the buffer.
+- Spill files are named after the owner's lease (lease_service), not its PID: a
+  restarted container process often gets the dead one's PID back. start() (called
+  on a worker's first request; enqueue() does the same) adopts every file whose
+  owner is gone, including "*.replay" files left by a process that died while replaying
+- enqueue() rejects paths Firestore would refuse (ValueError), and a write Firestore
+  still rejects as invalid is moved to a dead-letter file (SPILL_DIR/dead_letter/)
+  instead of being retried: it would otherwise fail every batch it lands in, forever
+- Document ids are pre-allocated client side (no RPC), so callers still get ids
+  synchronously
+
+Tunables (env vars):
+  FIRESTORE_WRITE_BEHIND   "0" to write synchronously instead (default: 1)
+  FIRESTORE_BATCH_SIZE     ops per batch / size trigger, max 500 (default: 200)
+  FIRESTORE_FLUSH_MS       time trigger for partial batches (default: 250)
+  FIRESTORE_SPILL_FSYNC    "1" to fsync the spill file on every write (default: 0)
+"""
+from __future__ import annotations
+import atexit, glob, json, os, threading, time, traceback
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from services import lease_service, metrics_service, registry
+from services.cache_service import CACHE_DIR
+
+ENABLED = os.getenv("FIRESTORE_WRITE_BEHIND", "1") not in ("0", "false", "no")
+BATCH_SIZE = max(1, min(500, int(os.getenv("FIRESTORE_BATCH_SIZE", "200"))))
+FLUSH_S = int(os.getenv("FIRESTORE_FLUSH_MS", "250")) / 1000.0
+SPILL_FSYNC = os.getenv("FIRESTORE_SPILL_FSYNC", "") in ("1", "true", "yes")
+
+SPILL_DIR = os.path.join(CACHE_DIR, "firestore_spill")
+DEAD_LETTER_DIR = os.path.join(SPILL_DIR, "dead_letter")
+
+_MAX_BACKOFF_S = 30.0
+_MAX_PATH_BYTES = 1500   # Firestore's limit for a document name
+
+Op = Tuple[Dict[str, Any], bool]   # (data, merge)
+
+_cond = threading.Condition()
+_pending: "OrderedDict[str, Op]" = OrderedDict()
+_inflight = 0
+_pid: Optional[int] = None
+_spill = None
+_stats = {
+    "queued": 0, "coalesced": 0, "committed": 0, "batches": 0, "failures": 0, "replayed": 0, "dead_lettered": 0,
+}
+
+
+# ---------- sentinels in the spill file ----------
+
+def _sentinels() -> Dict[str, Any]:
+    try:
+        from firebase_admin import firestore
+    except ImportError:
+        return {}
+    return {"SERVER_TIMESTAMP": firestore.SERVER_TIMESTAMP, "DELETE_FIELD": firestore.DELETE_FIELD}
+
+
+def _encode(obj):
+    for name, value in _sentinels().items():
+        if obj is value:
+            return {"$sentinel": name}
+    return str(obj)
+
+
+def _decode(obj):
+    if set(obj) == {"$sentinel"}:
+        return _sentinels()[obj["$sentinel"]]
+    return obj
+
+
+def _dumps(path: str, data: Dict[str, Any], merge: bool, **extra: Any) -> str:
+    return json.dumps({"path": path, "data": data, "merge": merge, **extra}, ensure_ascii=False, default=_encode)
+
+
+# ---------- coalescing ----------
+
+def _deep_merge(base: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(base)
+    for k, v in new.items():
+        if isinstance(v, dict) and isinstance(out.get(k), dict):
+            out[k] = _deep_merge(out[k], v)
+        else:
+            out[k] = v
+    return out
+
+
+def _combine(older: Optional[Op], newer: Op) -> Op:
+    """Net effect of writing `older` then `newer` to the same document."""
+    data, merge = newer
+    if older is None or not merge:
+        return data, merge
+    old_data, old_merge = older
+    return _deep_merge(old_data, data), old_merge
+
+
+# ---------- spill file ----------
+
+def _spill_path(owner: str) -> str:
+    return os.path.join(SPILL_DIR, f"{owner}.jsonl")
+
+
+def _owner(path: str) -> str:
+    """Lease token of the process a spill file belongs to.
+
+    "<owner>.jsonl" is a live spill file, "<first>.jsonl.<owner>.replay" one that <owner>
+    was replaying. Files from before leases carry a bare PID, which is never a live lease.
+    """
+    name = os.path.basename(path)
+    if name.endswith(".replay"):
+        return name[:-len(".replay")].rsplit(".", 1)[-1]
+    return name.split(".", 1)[0]
+
+
+def _recover() -> List[str]:
+    """Adopt spill and replay files whose owner is gone; returns the adopted files."""
+    me = lease_service.token()
+    adopted = []
+    paths = glob.glob(os.path.join(SPILL_DIR, "*.jsonl")) + glob.glob(os.path.join(SPILL_DIR, "*.replay"))
+    for path in sorted(paths, key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0):
+        owner = _owner(path)
+        if owner == me or lease_service.alive(owner):
+            continue
+        first = path[:-len(".replay")].rsplit(".", 1)[0] if path.endswith(".replay") else path
+        claimed = f"{first}.{me}.replay"
+        try:
+            os.replace(path, claimed)   # atomic: only one live process adopts each file
+        except OSError:
+            continue
+        with open(claimed, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line, object_hook=_decode)
+                except ValueError:
+                    continue  # torn last line from a crash
+                _pending[rec["path"]] = _combine(_pending.get(rec["path"]), (rec["data"], rec["merge"]))
+                _stats["replayed"] += 1
+        adopted.append(claimed)
+    return adopted
+
+
+def _rewrite_spill():
+    """Spill file := what is still pending (called under _cond)."""
+    global _spill
+    path = _spill_path(lease_service.token())
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for doc_path, (data, merge) in _pending.items():
+            f.write(_dumps(doc_path, data, merge) + "\n")
+    if _spill:
+        _spill.close()
+    os.replace(tmp, path)
+    _spill = open(path, "a", encoding="utf-8")
+
+
+def _ensure_started():
+    """Per-process setup: adopt orphaned spill files, open our own, start the flusher."""
+    global _pid, _spill, _inflight
+    if _pid == os.getpid():
+        return
+    _pending.clear()       # a forked child must not re-commit the parent's queue
+    _inflight = 0
+    _spill = None
+    os.makedirs(SPILL_DIR, exist_ok=True)
+    adopted = _recover()
+    _rewrite_spill()
+    for path in adopted:   # only now: their writes are in our own spill file
+        os.remove(path)
+    _pid = os.getpid()
+    threading.Thread(target=_flusher, name="firestore-write-behind", daemon=True).start()
+    if _pending:
+        _cond.notify_all()
+
+
+# ---------- validation ----------
+
+def _check(path: str, document: bool, what: str) -> str:
+    parts = path.split("/") if isinstance(path, str) else []
+    if (
+        not parts or len(parts) % 2 != (0 if document else 1)
+        or len(path.encode("utf-8")) > _MAX_PATH_BYTES
+        or any(p in ("", ".", "..") or (p.startswith("__") and p.endswith("__")) for p in parts)
+    ):
+        raise ValueError(f"Invalid {what} path: {path!r}")
+    return path
+
+
+def check_path(doc_path: str) -> str:
+    """
+    `doc_path` if it names a Firestore document ("collection/id", or deeper); else ValueError.
+
+    >>> check_path("notes/abc")
+    'notes/abc'
+    >>> check_path("notes/a/b")
+    Traceback (most recent call last):
+    ...
+    ValueError: Invalid document path: 'notes/a/b'
+    """
+    return _check(doc_path, True, "document")
+
+
+def check_collection(collection_path: str) -> str:
+    """`collection_path` if it names a Firestore collection ("notes", "users/u1/notes"); else ValueError."""
+    return _check(collection_path, False, "collection")
+
+
+def _rejected(e: Exception) -> bool:
+    """Whether Firestore refused the write itself, so retrying cannot help."""
+    if isinstance(e, (ValueError, TypeError)):
+        return True
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        return False
+    return isinstance(e, exceptions.InvalidArgument)
+
+
+def _dead_letter(rejected: List[Tuple[str, Op, Exception]]):
+    """Keep writes Firestore rejected where an operator can find them (called under _cond)."""
+    os.makedirs(DEAD_LETTER_DIR, exist_ok=True)
+    path = os.path.join(DEAD_LETTER_DIR, f"{lease_service.token()}.jsonl")
+    with open(path, "a", encoding="utf-8") as f:
+        for doc_path, (data, merge), e in rejected:
+            f.write(_dumps(doc_path, data, merge, error=str(e), at=time.time()) + "\n")
+            print(f"Firestore rejected the write to {doc_path!r} (kept in {path}):", e)
+    _stats["dead_lettered"] += len(rejected)
+
+
+# ---------- public API ----------
+
+def start():
+    """Adopt writes left by dead processes and start the flusher now, not on the first enqueue."""
+    if not ENABLED:
+        return
+    try:
+        with _cond:
+            _ensure_started()
+    except OSError as e:
+        print("Firestore write-behind: could not recover spill files:", e)
+
+
+def new_id(collection_path: str) -> str:
+    """Allocate a document id locally (no RPC)."""
+    check_collection(collection_path)
+    return registry.db().collection(collection_path).document().id
+
+
+def enqueue(doc_path: str, data: Dict[str, Any], merge: bool = False):
+    """Queue a document write; returns once it is in the buffer and the spill file."""
+    check_path(doc_path)
+    if not ENABLED:
+        with metrics_service.timed("firestore_write"):
+            registry.db().document(doc_path).set(data, merge=merge)
+        metrics_service.FIRESTORE_OPS.inc(outcome="ok")
+        return
+    line = _dumps(doc_path, data, merge)
+    with _cond:
+        _ensure_started()
+        _spill.write(line + "\n")
+        _spill.flush()
+        if SPILL_FSYNC:
+            os.fsync(_spill.fileno())
+        if doc_path in _pending:
+            _stats["coalesced"] += 1
+        _pending[doc_path] = _combine(_pending.pop(doc_path, None), (data, merge))
+        _stats["queued"] += 1
+        if len(_pending) >= BATCH_SIZE:
+            _cond.notify_all()
+
+
+def enqueue_many(writes: List[Tuple[str, Dict[str, Any], bool]]):
+    """Queue several writes; none is queued if any path is invalid."""
+    for doc_path, _, _ in writes:
+        check_path(doc_path)
+    for doc_path, data, merge in writes:
+        enqueue(doc_path, data, merge)
+
+
+def flush(timeout: float = 10.0) -> bool:
+    """Block until everything queued so far is committed; False on timeout."""
+    deadline = time.monotonic() + timeout
+    with _cond:
+        if _pid != os.getpid():
+            return True
+        _cond.notify_all()
+        while _pending or _inflight:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            _cond.wait(min(remaining, FLUSH_S or 0.05))
+            _cond.notify_all()
+    return True
+
+
+def stats() -> Dict[str, Any]:
+    with _cond:
+        return dict(_stats, pending=len(_pending) if _pid == os.getpid() else 0)
+
+
+# ---------- flusher ----------
+
+def _take_batch() -> List[Tuple[str, Op]]:
+    batch = []
+    while _pending and len(batch) < BATCH_SIZE:
+        batch.append(_pending.popitem(last=False))
+    return batch
+
+
+def _commit(batch: List[Tuple[str, Op]]) -> List[Tuple[str, Op, Exception]]:
+    """
+    Commit `batch`; returns the writes Firestore rejected outright, with the error.
+    Any other failure is raised and the caller retries the whole batch (sets are idempotent).
+    """
+    db = registry.db()
+    try:
+        wb = db.batch()
+        for doc_path, (data, merge) in batch:
+            wb.set(db.document(doc_path), data, merge=merge)
+        with metrics_service.timed("firestore_commit"):
+            wb.commit()
+    except Exception as e:
+        if not _rejected(e):
+            metrics_service.FIRESTORE_OPS.inc(len(batch), outcome="error")
+            raise
+        if len(batch) == 1:
+            metrics_service.FIRESTORE_OPS.inc(outcome="rejected")
+            doc_path, op = batch[0]
+            return [(doc_path, op, e)]
+        # One invalid write fails the whole batch: commit them one at a time to find it.
+        return [bad for item in batch for bad in _commit([item])]
+    metrics_service.FIRESTORE_OPS.inc(len(batch), outcome="ok")
+    return []
+
+
+def _flusher():
+    global _inflight
+    backoff = 0.0
+    while True:
+        with _cond:
+            if backoff:
+                _cond.wait(backoff)
+            elif len(_pending) < BATCH_SIZE:
+                _cond.wait(FLUSH_S)
+            if _pid != os.getpid():
+                return
+            batch = _take_batch()
+            _inflight += len(batch)
+        if not batch:
+            continue
+        try:
+            rejected = _commit(batch)
+            ok = True
+        except Exception:
+            traceback.print_exc()
+            ok = False
+        with _cond:
+            _inflight -= len(batch)
+            if ok:
+                if rejected:
+                    try:
+                        _dead_letter(rejected)
+                    except OSError as e:
+                        print("Firestore dead-letter write failed:", e)
+                _stats["committed"] += len(batch) - len(rejected)
+                _stats["batches"] += 1
+                backoff = 0.0
+            else:
+                # Put the batch back underneath anything written since.
+                _stats["failures"] += 1
+                for doc_path, op in reversed(batch):
+                    newer = _pending.pop(doc_path, None)
+                    _pending[doc_path] = _combine(op, newer) if newer else op
+                    _pending.move_to_end(doc_path, last=False)
+                backoff = min(_MAX_BACKOFF_S, (backoff or FLUSH_S or 0.1) * 2)
+            try:
+                _rewrite_spill()
+            except OSError as e:
+                print("Firestore spill rewrite failed:", e)
+            _cond.notify_all()
+
+
+@atexit.register
+def _drain():
+    if _pid != os.getpid() or not ENABLED:
+        return
+    if flush(timeout=10.0):
+        with _cond:
+            if not _pending and _spill:
+                _spill.close()
+                os.remove(_spill_path(lease_service.token()))
@@ -0,0 +1,5 @@
+import os, tempfile
+
+# Services read CLARIMED_CACHE_DIR at import time: point it at a scratch directory
+# before any test module imports them, so tests never touch backend/.cache.
+os.environ.setdefault("CLARIMED_CACHE_DIR", tempfile.mkdtemp(prefix="clarimed-tests-"))
@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+from services import cache_service
+from services.cache_service import TwoTierCache, make_key
+
+
+@pytest.fixture
+def path(tmp_path):
+    return os.path.join(tmp_path, "cache.sqlite3")
+
+
+def test_make_key_is_stable_and_order_sensitive():
+    assert make_key("m", "p", {"b": 1, "a": 2}) == make_key("m", "p", {"a": 2, "b": 1})
+    assert make_key("m", "p") != make_key("p", "m")
+
+
+def test_get_set_round_trip_through_both_tiers(path):
+    cache = TwoTierCache("t", path=path)
+    assert cache.get("k") is None
+    cache.set("k", {"summary": "ok", "points": [1, 2]})
+    assert cache.get("k") == {"summary": "ok", "points": [1, 2]}
+
+    other = TwoTierCache("t", path=path)   # another worker: empty LRU, same SQLite file
+    assert other.get("k") == {"summary": "ok", "points": [1, 2]}
+    assert other.stats()["disk_hits"] == 1
+
+
+def test_namespaces_are_separate(path):
+    TwoTierCache("a", path=path).set("k", "a")
+    assert TwoTierCache("b", path=path).get("k") is None
+
+
+def test_memory_tier_is_bounded(path):
+    cache = TwoTierCache("t", mem_items=2, path=path)
+    for k in "abc":
+        cache.set(k, k)
+    assert cache.stats()["mem_items"] == 2
+    assert cache.get("a") == "a"   # evicted from memory, still on disk
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_entries_expire_after_ttl(path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_service.time, "time", lambda: now[0])
+    cache = TwoTierCache("t", ttl=60, path=path)
+    cache.set("k", "v")
+    now[0] += 59
+    assert cache.get("k") == "v"
+    now[0] += 2
+    assert cache.get("k") is None
+    assert TwoTierCache("t", ttl=60, path=path).get("k") is None
+
+
+def test_update_is_read_modify_write(path):
+    cache = TwoTierCache("t", path=path)
+    assert cache.update("k", lambda cur: (cur or []) + [1]) == [1]
+    assert cache.update("k", lambda cur: (cur or []) + [2]) == [1, 2]
+    assert TwoTierCache("t", path=path).get("k") == [1, 2]
+
+
+def test_update_returning_none_keeps_the_entry(path):
+    cache = TwoTierCache("t", path=path)
+    cache.set("k", "v")
+    assert cache.update("k", lambda cur: None) == "v"
+    assert cache.get("k") == "v"
+    assert cache.update("missing", lambda cur: None) is None
+
+
+def test_get_or_compute_skips_the_cache_when_asked(path):
+    cache = TwoTierCache("t", path=path)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return "v%d" % len(calls)
+
+    assert cache.get_or_compute("k", compute) == "v1"
+    assert cache.get_or_compute("k", compute) == "v1"
+    assert cache.get_or_compute("k", compute, use_cache=False) == "v2"
+    assert len(calls) == 2
+
+
+def test_bypass_requested():
+    assert cache_service.bypass_requested({"X-ClariMed-No-Cache": "1"})
+    assert cache_service.bypass_requested({"Cache-Control": "no-cache"})
+    assert not cache_service.bypass_requested({})
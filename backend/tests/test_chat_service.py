@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+
+from services import chat_service, topic_service
+
+
+def stored(session):
+    return chat_service.load(session["id"])
+
+
+@pytest.fixture
+def session():
+    s = chat_service.new_session("Mild anemia.", [{"role": "user", "text": "hi"}, {"role": "assistant", "text": ""}])
+    chat_service.save(s)
+    return s
+
+
+def test_new_session_keeps_non_empty_history(session):
+    assert session["turns"] == [{"role": "user", "text": "hi"}]
+    assert stored(session) == session
+    assert chat_service.load("") is None and chat_service.load("missing") is None
+
+
+def test_prompt_carries_summary_memory_and_turns(session):
+    session["memory"] = "Asked about iron earlier."
+    prompt = chat_service.build_prompt(session, "Is it serious?")
+    assert "Mild anemia." in prompt and "Asked about iron earlier." in prompt
+    assert "User: hi" in prompt and prompt.endswith("Is it serious?")
+
+
+def test_turns_from_stale_copies_are_appended_not_overwritten(session):
+    stale = dict(session)
+    chat_service.record_turn(session, "q1", "a1", condense=lambda p: "")
+    chat_service.record_turn(stale, "q2", "a2", condense=lambda p: "")
+    assert [t["text"] for t in stored(session)["turns"]] == ["hi", "q1", "a1", "q2", "a2"]
+
+
+def test_concurrent_turns_are_all_kept(session):
+    def worker(w):
+        for i in range(10):
+            chat_service.record_turn(session, f"q{w}-{i}", "a", condense=lambda p: "")
+
+    threads = [threading.Thread(target=worker, args=(w,)) for w in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(stored(session)["turns"]) == 1 + 4 * 10 * 2
+
+
+def test_set_summary_keeps_turns_added_elsewhere(session):
+    chat_service.record_turn(dict(session), "q", "a", condense=lambda p: "")
+    updated = chat_service.set_summary(session, "New report.")
+    assert updated["summary"] == "New report."
+    assert len(stored(session)["turns"]) == 3
+
+
+def test_history_over_budget_is_folded_into_memory(session, monkeypatch):
+    monkeypatch.setattr(chat_service, "HISTORY_TOKENS", 10)
+    monkeypatch.setattr(chat_service, "KEEP_TURNS", 2)
+    prompts = []
+
+    def condense(prompt):
+        prompts.append(prompt)
+        return "Patient asked about iron levels."
+
+    chat_service.record_turn(session, "What is ferritin?", "A protein that stores iron " * 5, condense)
+    latest = stored(session)
+    assert latest["memory"] == "Patient asked about iron levels."
+    assert [t["text"] for t in latest["turns"]] == ["What is ferritin?", "A protein that stores iron " * 5]
+    assert "User: hi" in prompts[0]
+
+
+def test_failed_compaction_keeps_the_full_history(session, monkeypatch):
+    monkeypatch.setattr(chat_service, "HISTORY_TOKENS", 1)
+    monkeypatch.setattr(chat_service, "KEEP_TURNS", 2)
+
+    def condense(prompt):
+        raise RuntimeError("Gemini down")
+
+    chat_service.record_turn(session, "q", "a long answer", condense)
+    assert stored(session)["memory"] == ""
+    assert len(stored(session)["turns"]) == 3
+
+
+def test_compaction_is_dropped_if_another_worker_compacted_first(session, monkeypatch):
+    monkeypatch.setattr(chat_service, "HISTORY_TOKENS", 1)
+    monkeypatch.setattr(chat_service, "KEEP_TURNS", 2)
+
+    def condense(prompt):
+        # Meanwhile another worker folds the same turns.
+        chat_service._sessions.update(session["id"], lambda cur: dict(cur, memory="theirs", turns=cur["turns"][-2:]))
+        return "ours"
+
+    chat_service.record_turn(session, "q", "a", condense)
+    assert stored(session)["memory"] == "theirs"
+
+
+@pytest.mark.parametrize("text, has_context, expected", [
+    ("What does a high creatinine mean?", False, True),
+    ("Should I worry about my blood pressure?", False, True),
+    ("Is gastritis contagious?", False, True),
+    ("Who won the football game?", False, False),
+    ("Who won the football game?", True, False),
+    ("What does that mean?", True, True),
+    ("What does that mean?", False, False),
+])
+def test_topic_gate(text, has_context, expected):
+    assert topic_service.is_medical(text, has_context)[0] is expected
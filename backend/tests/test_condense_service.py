@@ -0,0 +1,96 @@
+import doctest
+
+import pytest
+
+from services import condense_service as condense
+
+
+def page(i, *body, potassium="4.1"):
+    return "\n".join([
+        "ST. MARY HOSPITAL - Patient: Jane Doe - MRN 0042",
+        f"Printed 2024-01-0{i} 10:3{i}",
+        f"Potassium {potassium} mmol/L",
+        *body,
+        f"Page {i} of 4",
+    ])
+
+
+def test_doctests():
+    assert doctest.testmod(condense).failed == 0
+
+
+def test_headers_and_footers_are_kept_once():
+    pages = [page(i, "", f"Visit note {i} body text.", f"Seen in clinic on day {i}.", f"End of note {i}.") for i in range(1, 5)]
+    out, stats = condense.condense(pages)
+    assert len(out) == 4
+    assert out[0].startswith("ST. MARY HOSPITAL - Patient: Jane Doe - MRN 0042\nPrinted 2024-01-01 10:31\nPotassium 4.1 mmol/L")
+    for text in out[1:]:
+        assert "HOSPITAL" not in text and "Printed" not in text and "Potassium" not in text
+    assert not any("Page" in text for text in out)
+    assert stats["boilerplate_lines"] == 4 * 1 + 3 * 3
+    assert stats["chars_saved"] == stats["chars_in"] - stats["chars_out"] > 0
+
+
+def test_lines_whose_values_differ_are_content():
+    pages = [page(i, "", f"Visit note {i}.", "Stable.", potassium=k) for i, k in enumerate(["3.1", "5.9", "6.8", "4.0"], 1)]
+    out, _ = condense.condense(pages)
+    assert [text.count("Potassium") for text in out] == [1, 1, 1, 1]
+    assert "Potassium 6.8 mmol/L" in out[2]
+
+
+def test_too_few_pages_to_tell_boilerplate_apart():
+    pages = [page(i, "", f"Note {i}.") for i in (1, 2)]
+    assert all("HOSPITAL" in text for text in condense.condense(pages)[0])
+
+
+@pytest.mark.parametrize("lines, expected", [
+    (["The patient has hyper-", "tension and was seen."], "The patient has hypertension and was seen."),
+    (["Blood pressure was", "elevated at the visit."], "Blood pressure was elevated at the visit."),
+    (["Stable.", "next visit in May."], "Stable.\nnext visit in May."),
+    (["MEDICATIONS:", "aspirin 81 mg"], "MEDICATIONS:\naspirin 81 mg"),
+    (["Plan includes", "- rest", "- fluids"], "Plan includes\n- rest\n- fluids"),
+    (["Sodium   140\tmmol/L"], "Sodium | 140 | mmol/L"),
+    (["Total charges ........ 12.50"], "Total charges | 12.50"),
+    (["Well\u00adbeing is \u00a0good."], "Wellbeing is good."),
+    (["Para one.", "", "", "", "Para two."], "Para one.\n\nPara two."),
+])
+def test_layout(lines, expected):
+    assert condense.condense(["\n".join(lines)])[0] == [expected]
+
+
+def test_a_repeated_table_header_is_kept_once():
+    pages = ["Test    Value    Unit\nSodium    140    mmol/L", "Test    Value    Unit\nPotassium    4.1    mmol/L"]
+    assert condense.condense(pages)[0] == [
+        "Test | Value | Unit\nSodium | 140 | mmol/L",
+        "Potassium | 4.1 | mmol/L",
+    ]
+
+
+def test_over_budget_drops_low_priority_sections_first():
+    pages = [
+        "FINDINGS:\nNormal heart size.",
+        "\n".join([
+            "DISCLAIMER:", "This report is confidential. " * 20, "",
+            "BILLING:", "Invoice code 99213. " * 20, "",
+            "IMPRESSION:", "No acute findings. " * 5,
+        ]),
+        "",
+    ]
+    out, stats = condense.condense(pages, budget=60)
+    assert len(out) == 3 and out[2] == ""
+    assert out[0] == "FINDINGS:\nNormal heart size."
+    assert "confidential" not in out[1] and "Invoice" not in out[1]
+    assert out[1].startswith("IMPRESSION:\nNo acute findings.")
+    assert out[1].endswith("[2 lower-priority section(s) omitted to fit the length limit]")
+    assert stats["sections_dropped"] == 2
+
+
+def test_within_budget_nothing_is_dropped():
+    pages = ["DISCLAIMER:\nConfidential.", "IMPRESSION:\nNormal."]
+    assert condense.condense(pages, budget=0) == condense.condense(pages, budget=10_000)
+    assert condense.condense(pages, budget=0)[0] == pages
+
+
+def test_something_is_always_left():
+    out, stats = condense.condense(["DISCLAIMER:\n" + "Confidential. " * 50], budget=1)
+    assert "Confidential." in out[0] and stats["sections_dropped"] == 0
@@ -0,0 +1,102 @@
+import random, uuid
+
+import pytest
+
+from bench import corpus
+from services import document_index_service as index, pdf_service
+
+
+@pytest.fixture
+def make_pdf(tmp_path):
+    """Writes a PDF of the given pages; page i has the same text in every PDF of one test."""
+    seed = uuid.uuid4().int   # pages no earlier test has stored
+
+    def make(pages, name="report.pdf"):
+        path = tmp_path / name
+        path.write_bytes(corpus.make_pdf([corpus.page_lines(random.Random(seed + i), i) for i in pages]))
+        return str(path)
+    return make
+
+
+@pytest.fixture
+def extractions(monkeypatch):
+    """The page indices each extract_page_map() call was asked for."""
+    calls = []
+    real = pdf_service.extract_page_map
+
+    def spy(path, ocr=None, indices=None, **limits):
+        calls.append(list(indices))
+        return real(path, ocr, indices=indices, **limits)
+    monkeypatch.setattr(pdf_service, "extract_page_map", spy)
+    return calls
+
+
+def test_only_unseen_pages_are_extracted(make_pdf, extractions):
+    first = index.Document(make_pdf(range(4)))
+    pages, errors = first.extract()
+    assert len(pages) == 4 and errors == [] and first.reused == 0
+    assert "CLINICAL REPORT - PAGE 2" in pages[2]
+
+    again = index.Document(make_pdf([0, 1, 9, 2, 3], "v2.pdf"))
+    assert again.extract()[0][:2] == pages[:2]
+    assert again.reused == 4
+    assert extractions == [[0, 1, 2, 3], [2]]
+
+    fresh = index.Document(make_pdf(range(4)))
+    fresh.extract(use_cache=False)
+    assert fresh.reused == 0 and extractions[-1] == [0, 1, 2, 3]
+
+
+def test_breaks_follow_the_pages_not_their_position(make_pdf, monkeypatch):
+    monkeypatch.setattr(index, "CHUNK_EVERY", 2)
+    doc = index.Document(make_pdf(range(8)))
+    doc.extract()
+    breaks = dict(zip(doc.fingerprints, doc.breaks()))
+    assert len(doc.breaks()) == 8
+
+    edited = index.Document(make_pdf([20, *range(8)], "v2.pdf"))
+    edited.extract()
+    assert dict(zip(edited.fingerprints, edited.breaks())).items() >= breaks.items()
+
+
+def test_a_new_upload_gets_a_server_issued_id(make_pdf):
+    a, b = index.Document(make_pdf(range(2))), index.Document(make_pdf(range(2)))
+    assert a.document_id != b.document_id and len(a.document_id) >= 32
+    assert a.changes() is None
+
+
+def test_changes_since_the_previous_version(make_pdf):
+    first = index.Document(make_pdf(range(3)))
+    first.extract()
+    first.save("Old summary.", ["old point"])
+
+    second = index.Document(make_pdf([0, 2, 3, 4], "v2.pdf"), first.document_id)
+    second.extract()
+    assert second.document_id == first.document_id
+    changes = second.changes()
+    assert changes["added_pages"] == [3, 4]
+    assert changes["unchanged_pages"] == 2 and changes["removed_pages"] == 1
+    assert changes["previous_summary"] == "Old summary." and changes["previous_key_points"] == ["old point"]
+    assert "PAGE 3" in second.added_text() and "PAGE 0" not in second.added_text()
+
+    prompts = []
+    bullets = index.explain_changes(second, changes, lambda p: prompts.append(p) or "- New labs\n\n• Page 1 removed")
+    assert bullets == ["New labs", "Page 1 removed"]
+    assert "1 page(s) of the earlier version" in prompts[0] and "Old summary." in prompts[0]
+
+
+def test_unchanged_reupload_needs_no_explanation(make_pdf):
+    first = index.Document(make_pdf(range(2)))
+    first.save("s", [])
+    second = index.Document(make_pdf(range(2)), first.document_id)
+    second.extract()
+    assert second.changes()["added_pages"] == []
+    assert index.explain_changes(second, second.changes(), pytest.fail) == []
+
+
+@pytest.mark.parametrize("document_id", ["made-up-by-the-client", " ", "x" * 32])
+def test_an_id_the_server_never_issued_is_a_first_upload(make_pdf, document_id):
+    doc = index.Document(make_pdf(range(2)), document_id)
+    assert doc.document_id != document_id.strip() and doc.changes() is None
+    doc.save("mine", [])
+    assert index.Document(make_pdf(range(2)), document_id).changes() is None   # nothing stored under the client's id
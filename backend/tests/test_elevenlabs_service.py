@@ -0,0 +1,61 @@
+from services.elevenlabs_service import _frame_len, join_mp3, mp3_frames, split_units
+
+HEADER = b"\xff\xfb\x90\x00"   # MPEG-1 Layer III, 128 kbps, 44.1 kHz, no padding
+FRAME_LEN = 144 * 128000 // 44100   # 417
+
+
+def frame(fill: int) -> bytes:
+    return HEADER + bytes([fill]) * (FRAME_LEN - 4)
+
+
+def xing_frame() -> bytes:
+    body = bytes(32) + b"Xing" + bytes(FRAME_LEN - 4 - 36)   # after the stereo MPEG-1 side info
+    return HEADER + body
+
+
+def id3v2(payload: bytes = b"TIT2 title") -> bytes:
+    n = len(payload)
+    size = bytes([(n >> 21) & 0x7F, (n >> 14) & 0x7F, (n >> 7) & 0x7F, n & 0x7F])
+    return b"ID3\x04\x00\x00" + size + payload
+
+
+def id3v1() -> bytes:
+    return b"TAG" + bytes(125)
+
+
+def mp3(*fills: int) -> bytes:
+    return id3v2() + xing_frame() + b"".join(frame(f) for f in fills) + id3v1()
+
+
+def test_frame_length_from_header():
+    assert _frame_len(HEADER) == FRAME_LEN
+    assert _frame_len(b"\xff\xfb\x92\x00") == FRAME_LEN + 1   # padding bit
+    assert _frame_len(b"\xff\xfb\xf0\x00") == 0               # bitrate index 15 is invalid
+    assert _frame_len(b"ID3\x04") == 0
+
+
+def test_frames_drop_tags_and_the_info_frame():
+    assert mp3_frames(mp3(1, 2, 3)) == frame(1) + frame(2) + frame(3)
+
+
+def test_frames_resync_past_junk():
+    assert mp3_frames(frame(1) + b"\x00junk" + frame(2)) == frame(1) + frame(2)
+
+
+def test_a_single_part_is_returned_untouched():
+    part = mp3(1)
+    assert join_mp3([part]) == part
+
+
+def test_parts_are_joined_frame_by_frame_in_order():
+    joined = join_mp3([mp3(1, 2), mp3(3), mp3(4, 5)])
+    assert joined == b"".join(frame(f) for f in (1, 2, 3, 4, 5))
+    assert len(joined) % FRAME_LEN == 0
+    assert b"Xing" not in joined and b"ID3" not in joined and b"TAG" not in joined
+
+
+def test_units_never_cross_a_paragraph_and_stay_under_the_limit():
+    text = "One. Two is longer. Three.\n\nFour.   Five\nwith a break."
+    assert split_units(text, max_chars=12) == ["One.", "Two is longer.", "Three.", "Four.", "Five with a break."]
+    assert split_units(text, max_chars=400) == ["One. Two is longer. Three.", "Four. Five with a break."]
+    assert split_units("  \n\n ") == []
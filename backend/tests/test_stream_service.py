@@ -0,0 +1,66 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from services.stream_service import sse_event, split_summary, stream_summary, wants_stream
+
+TEXT = "Your blood pressure is high.\nIt can be treated.\n- Take the tablets daily\n- See your doctor in 2 weeks\n- Call 911 for chest pain"
+
+
+def parse(events):
+    """[(event, data)] from SSE strings."""
+    out = []
+    for raw in events:
+        assert raw.endswith("\n\n")
+        name, data = raw[:-2].split("\n")
+        assert name.startswith("event: ") and data.startswith("data: ")
+        out.append((name[len("event: "):], json.loads(data[len("data: "):])))
+    return out
+
+
+def test_sse_event_framing():
+    assert sse_event("done", {"ok": True, "text": "ü"}) == 'event: done\ndata: {"ok": true, "text": "ü"}\n\n'
+
+
+def test_split_summary():
+    summary, points = split_summary(TEXT)
+    assert summary == "Your blood pressure is high.\nIt can be treated."
+    assert points == ["Take the tablets daily", "See your doctor in 2 weeks", "Call 911 for chest pain"]
+    assert split_summary("Just a paragraph.") == ("Just a paragraph.", [])
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 16, len(TEXT)])
+def test_stream_summary_matches_the_json_shape_for_any_chunking(size):
+    chunks = [TEXT[i:i + size] for i in range(0, len(TEXT), size)]
+    events = parse(stream_summary(iter(chunks), extra={"page_errors": []}))
+
+    names = [name for name, _ in events]
+    assert names[-1] == "done"
+    assert set(names[:-1]) <= {"summary", "key_point"}
+    assert names.index("key_point") > max(i for i, n in enumerate(names) if n == "summary")
+
+    summary, points = split_summary(TEXT)
+    assert "".join(d["delta"] for n, d in events if n == "summary").strip() == summary
+    assert [d for n, d in events if n == "key_point"] == [{"index": i, "text": p} for i, p in enumerate(points)]
+    assert events[-1][1] == {"ok": True, "summary": summary, "key_points": points, "page_errors": []}
+
+
+def test_stream_summary_reports_upstream_failure_as_an_error_event():
+    def chunks():
+        yield "Partial answer"
+        raise RuntimeError("quota")
+
+    events = parse(stream_summary(chunks()))
+    assert events[0] == ("summary", {"delta": "Partial answer"})
+    assert events[-1] == ("error", {"ok": False, "error": "Gemini error: quota"})
+
+
+def test_wants_stream():
+    def req(args=None, headers=None):
+        return SimpleNamespace(args=args or {}, headers=headers or {})
+
+    assert wants_stream(req(args={"stream": "1"}))
+    assert wants_stream(req(headers={"Accept": "text/event-stream"}))
+    assert not wants_stream(req(args={"stream": "0"}))
+    assert not wants_stream(req(headers={"Accept": "application/json"}))
@@ -0,0 +1,84 @@
+import asyncio, threading
+
+from services import summarize_service
+from services.summarize_service import chunk_pages, estimate_tokens, reduce_input, reduce_input_async
+
+
+def page(n: int, words: int = 200) -> str:
+    return f"PAGE {n}\n" + " ".join(f"word{n}x{i}" for i in range(words))
+
+
+def fake_generate(calls):
+    lock = threading.Lock()
+
+    def generate(prompt: str) -> str:
+        with lock:
+            calls.append(prompt)
+        return f"- note {len(prompt)}"
+
+    return generate
+
+
+def test_short_document_is_its_own_input():
+    calls = []
+    assert reduce_input(["Short page.", "Another."], fake_generate(calls)) == "Short page.\n\nAnother."
+    assert reduce_input([], fake_generate(calls)) == ""
+    assert calls == []
+
+
+def test_chunks_respect_the_budget_and_keep_page_order():
+    pages = [page(n) for n in range(10)]
+    chunks = chunk_pages(pages, budget=800)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(c) <= 800 for c in chunks)
+    assert "\n\n".join(chunks) == "\n\n".join(pages)
+
+
+def test_an_oversized_page_is_split_by_section_then_by_line():
+    big = "HISTORY:\n" + "a" * 3000 + "\n\nLABS:\n" + "\n".join("b" * 100 for _ in range(60))
+    chunks = chunk_pages([big], budget=500)
+    assert len(chunks) > 2
+    assert all(len(c) <= 500 * 4 for c in chunks)
+    assert chunks[0].startswith("HISTORY:")
+
+
+def test_breaks_start_a_new_chunk():
+    pages = ["one", "two", "three", "four"]
+    assert chunk_pages(pages, budget=1000) == ["one\n\ntwo\n\nthree\n\nfour"]
+    assert chunk_pages(pages, budget=1000, breaks=[False, False, True, False]) == ["one\n\ntwo", "three\n\nfour"]
+
+
+def test_an_inserted_page_only_changes_chunks_up_to_the_next_break():
+    pages = [page(n, 50) for n in range(12)]
+    breaks = [n % 3 == 0 for n in range(12)]
+    before = chunk_pages(pages, budget=10000, breaks=breaks)
+    after = chunk_pages(pages[:4] + ["inserted"] + pages[4:], budget=10000, breaks=breaks[:4] + [False] + breaks[4:])
+    assert sum(1 for c in after if c not in before) == 1
+
+
+def test_long_document_is_mapped_then_reduced_to_notes():
+    calls = []
+    pages = [page(n) for n in range(10)]
+    out = reduce_input(pages, fake_generate(calls), budget=800, parallelism=3)
+    chunks = chunk_pages(pages, budget=800)
+    assert len(calls) == len(chunks)
+    assert all(c in "".join(calls) for c in chunks)   # every chunk was prompted, verbatim
+    assert out.count("- note") == len(chunks)
+
+
+def test_async_variant_makes_the_same_calls():
+    pages = [page(n) for n in range(10)]
+    sync_calls, async_calls = [], []
+    expected = reduce_input(pages, fake_generate(sync_calls), budget=800)
+
+    generate = fake_generate(async_calls)
+
+    async def agenerate(prompt: str) -> str:
+        return generate(prompt)
+
+    assert asyncio.run(reduce_input_async(pages, agenerate, budget=800)) == expected
+    assert sorted(async_calls) == sorted(sync_calls)
+
+
+def test_chunk_prompt_contains_only_the_chunk():
+    assert summarize_service.chunk_prompt("X-RAY: clear").endswith("TEXT:\nX-RAY: clear")
@@ -0,0 +1,109 @@
+import asyncio, json, uuid
+
+import pytest
+
+from services import translation_memory_service as tm
+
+
+def sentences(text):
+    return [s for translatable, s in tm.segment(text) if translatable]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Take 5 mg. Call your doctor if it hurts.", ["Take 5 mg.", "Call your doctor if it hurts."]),
+    ("Potassium was 5.2 mmol/L. 3 days later it was normal.", ["Potassium was 5.2 mmol/L.", "3 days later it was normal."]),
+    ("Take 1 tab p.o. Do not drive.", ["Take 1 tab p.o.", "Do not drive."]),
+    ("Per J. R. Smith the scan is clear. See Fig. 2 for details.",
+     ["Per J. R. Smith the scan is clear.", "See Fig. 2 for details."]),
+    ("Pain, swelling, etc. Rest helps.", ["Pain, swelling, etc.", "Rest helps."]),
+    ("Seen by Dr. Patel, approx. 2 cm lesion vs. cyst.", ["Seen by Dr. Patel, approx. 2 cm lesion vs. cyst."]),
+    ("Examples (e.g. Aspirin) help.", ["Examples (e.g. Aspirin) help."]),
+    ("Is it urgent? No! Wait.", ["Is it urgent?", "No!", "Wait."]),
+])
+def test_sentence_splitting(text, expected):
+    assert sentences(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "No acute findings.  Follow up in 2 weeks.\n",
+    "- Take 5 mg.\r\n2) Rest.\n\n## Plan\n   Call Dr. Lee.  \n",
+    "120/80  \n\t5.2 mmol/L.",
+])
+def test_joining_the_pieces_gives_the_text_back(text):
+    assert "".join(s for _, s in tm.segment(text)) == text
+
+
+def test_markers_and_numbers_are_not_translated():
+    pieces = tm.segment("- Take 5 mg.\n3.5\n")
+    assert [s for translatable, s in pieces if not translatable] == ["- ", "\n", "3.5", "\n"]
+
+
+class FakeGemini:
+    """Upper-cases every sentence; a batch answer can be broken on purpose."""
+
+    def __init__(self, broken=False):
+        self.prompts, self.broken = [], broken
+
+    def __call__(self, prompt):
+        self.prompts.append(prompt)
+        if prompt.startswith("Translate each string"):
+            if self.broken:
+                return "Sure! Here you go:"
+            items = json.loads(prompt[prompt.index("\n\n["):])
+            return "```json\n" + json.dumps([s.upper() for s in items]) + "\n```"
+        return prompt.rsplit("\n\n", 1)[1].upper()
+
+
+@pytest.fixture
+def model():
+    return f"test-{uuid.uuid4().hex}"   # a memory of its own
+
+
+def test_only_unseen_sentences_go_to_gemini(model):
+    gemini = FakeGemini()
+    assert tm.translate_text("- No acute findings.\n- Rest.", "es", model, gemini) == "- NO ACUTE FINDINGS.\n- REST."
+    assert len(gemini.prompts) == 1
+
+    out = tm.translate_texts(["Rest.  No  acute findings.", "Drink water."], "es", model, gemini)
+    assert out == ["REST.  NO ACUTE FINDINGS.", "DRINK WATER."]
+    assert len(gemini.prompts) == 2 and json.loads(gemini.prompts[1][gemini.prompts[1].index("\n\n["):]) == ["Drink water."]
+
+    tm.translate_text("Rest.", "es", model, gemini, use_cache=False)
+    assert len(gemini.prompts) == 3
+
+
+def test_memory_is_per_model_and_target(model):
+    gemini = FakeGemini()
+    tm.translate_text("Rest.", "es", model, gemini)
+    tm.translate_text("Rest.", " ES ", model, gemini)
+    tm.translate_text("Rest.", "fr", model, gemini)
+    tm.translate_text("Rest.", "es", model + "-other", gemini)
+    assert len(gemini.prompts) == 3
+
+
+def test_broken_batch_answer_falls_back_to_one_prompt_per_sentence(model):
+    gemini = FakeGemini(broken=True)
+    assert tm.translate_text("Rest. Drink water.", "es", model, gemini) == "REST. DRINK WATER."
+    assert sum(p.startswith("Translate the following") for p in gemini.prompts) == 2
+
+
+def test_large_inputs_are_split_into_batches(model, monkeypatch):
+    monkeypatch.setattr(tm, "BATCH_CHARS", 40)
+    gemini = FakeGemini()
+    text = " ".join(f"Sentence number {i} is here." for i in range(6))
+    assert tm.translate_text(text, "es", model, gemini) == text.upper()
+    assert len(gemini.prompts) == 6
+
+
+def test_async_matches_sync(model):
+    gemini = FakeGemini(broken=True)
+
+    async def generate(prompt):
+        return gemini(prompt)
+
+    out = asyncio.run(tm.translate_texts_async(["Rest. Drink water.", "1) Rest."], "es", model, generate))
+    assert out == ["REST. DRINK WATER.", "1) REST."]
+    again = FakeGemini()
+    assert tm.translate_text("Drink water.", "es", model, again) == "DRINK WATER."
+    assert again.prompts == []   # learned by the async path
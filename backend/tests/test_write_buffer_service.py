@@ -0,0 +1,165 @@
+import fcntl, json, os
+
+import pytest
+
+from services import lease_service, registry, write_buffer_service as wb
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db, self.ops = db, []
+
+    def set(self, path, data, merge=False):
+        self.ops.append((path, data, merge))
+
+    def commit(self):
+        if self.db.fail:
+            raise self.db.fail.pop(0)
+        if any("bad" in data for _, data, _ in self.ops):
+            raise TypeError("Cannot convert to a Firestore Value")
+        for path, data, merge in self.ops:
+            self.db.docs[path] = wb._deep_merge(self.db.docs.get(path, {}), data) if merge else data
+
+
+class FakeDB:
+    def __init__(self):
+        self.docs, self.fail = {}, []
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def document(self, path):
+        if len(path.split("/")) % 2:
+            raise ValueError(f"A document must have an even number of path elements: {path}")
+        return path
+
+
+@pytest.fixture(scope="module")
+def db(tmp_path_factory):
+    """One flusher for the whole module, writing to a fake Firestore and a scratch spill dir."""
+    spill = str(tmp_path_factory.mktemp("spill"))
+    fake = FakeDB()
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(wb, "ENABLED", True)
+        mp.setattr(wb, "SPILL_DIR", spill)
+        mp.setattr(wb, "DEAD_LETTER_DIR", os.path.join(spill, "dead_letter"))
+        mp.setattr(registry, "db", lambda: fake)
+        with wb._cond:
+            wb._pid = None
+        wb.start()
+        yield fake
+        assert wb.flush(5)
+        with wb._cond:
+            wb._pid = None   # stops the flusher
+            wb._cond.notify_all()
+
+
+def spill_file(owner, records):
+    path = os.path.join(wb.SPILL_DIR, f"{owner}.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for doc_path, data, merge in records:
+            f.write(wb._dumps(doc_path, data, merge) + "\n")
+        f.write('{"path": "torn')   # a crash mid-write leaves half a line
+    return path
+
+
+def adopt():
+    """What start() does in a fresh process: adopt dead owners' files and queue their writes."""
+    with wb._cond:
+        adopted = wb._recover()
+        wb._rewrite_spill()
+        for path in adopted:
+            os.remove(path)
+        wb._cond.notify_all()
+
+
+def test_writes_are_committed_with_merge_semantics(db):
+    wb.enqueue("notes/a", {"title": "x", "meta": {"v": 1}})
+    wb.enqueue("notes/a", {"meta": {"seen": True}}, merge=True)
+    wb.enqueue_many([("notes/b", {"n": 1}, False), ("notes/b", {"n": 2}, False)])
+    assert wb.flush(5)
+    assert db.docs["notes/a"] == {"title": "x", "meta": {"v": 1, "seen": True}}
+    assert db.docs["notes/b"] == {"n": 2}
+
+
+def test_combine():
+    assert wb._combine(({"a": {"x": 1}}, False), ({"a": {"y": 2}}, True)) == ({"a": {"x": 1, "y": 2}}, False)
+    assert wb._combine(({"a": 1}, True), ({"b": 2}, False)) == ({"b": 2}, False)
+
+
+@pytest.mark.parametrize("path", ["notes", "notes/a/b", "notes//a", "notes/..", "__x__/a", 42])
+def test_invalid_paths_are_refused_before_queueing(db, path):
+    queued = wb.stats()["queued"]
+    with pytest.raises(ValueError):
+        wb.enqueue(path, {"a": 1})
+    with pytest.raises(ValueError):
+        wb.enqueue_many([("notes/ok", {"a": 1}, False), (path, {"a": 1}, False)])
+    assert wb.stats()["queued"] == queued
+
+
+def test_collections_are_checked_too():
+    assert wb.check_collection("users/u1/notes") == "users/u1/notes"
+    with pytest.raises(ValueError):
+        wb.check_collection("users/u1")
+
+
+def test_a_rejected_write_is_dead_lettered_and_does_not_block_the_rest(db):
+    wb.enqueue_many([("notes/ok1", {"a": 1}, False), ("notes/poison", {"bad": object()}, False)])
+    wb.enqueue("notes/ok2", {"a": 2})
+    assert wb.flush(5)
+    assert db.docs["notes/ok1"] == {"a": 1} and db.docs["notes/ok2"] == {"a": 2}
+    assert "notes/poison" not in db.docs
+
+    (name,) = os.listdir(wb.DEAD_LETTER_DIR)
+    with open(os.path.join(wb.DEAD_LETTER_DIR, name), encoding="utf-8") as f:
+        (rec,) = [json.loads(line) for line in f]
+    assert rec["path"] == "notes/poison" and "Firestore Value" in rec["error"]
+
+
+def test_transient_failures_are_retried(db):
+    failures = wb.stats()["failures"]
+    db.fail.append(RuntimeError("UNAVAILABLE"))
+    wb.enqueue("notes/retry", {"a": 1})
+    assert wb.flush(10)
+    assert db.docs["notes/retry"] == {"a": 1}
+    assert wb.stats()["failures"] == failures + 1
+
+
+def test_the_spill_file_holds_only_what_is_pending(db):
+    db.fail.extend([RuntimeError("UNAVAILABLE")] * 50)
+    try:
+        wb.enqueue("notes/pending", {"a": 1})
+        with open(wb._spill_path(lease_service.token()), encoding="utf-8") as f:
+            assert [json.loads(line)["path"] for line in f] == ["notes/pending"]
+    finally:
+        db.fail.clear()
+    assert wb.flush(10)
+    with open(wb._spill_path(lease_service.token()), encoding="utf-8") as f:
+        assert f.read() == ""
+
+
+def test_writes_left_by_a_dead_process_are_replayed(db):
+    spill_file("1-deadbeef0001", [("notes/r1", {"a": 1}, False), ("notes/r1", {"b": 2}, True)])
+    replay = spill_file("1-deadbeef0002", [("notes/r2", {"c": 3}, False)])
+    # that process died while replaying its own predecessor's file
+    os.replace(replay, os.path.join(wb.SPILL_DIR, "7-cafe.jsonl.1-deadbeef0002.replay"))
+    adopt()
+    assert wb.flush(5)
+    assert db.docs["notes/r1"] == {"a": 1, "b": 2}
+    assert db.docs["notes/r2"] == {"c": 3}
+    assert sorted(os.listdir(wb.SPILL_DIR)) == sorted(["dead_letter", f"{lease_service.token()}.jsonl"])
+
+
+def test_a_live_process_keeps_its_spill_file(db):
+    owner = "1-alive0000001"   # the same PID as ours would not matter: only the lease counts
+    os.makedirs(lease_service.LEASE_DIR, exist_ok=True)
+    fd = os.open(lease_service._path(owner), os.O_RDWR | os.O_CREAT)
+    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    try:
+        path = spill_file(owner, [("notes/theirs", {"a": 1}, False)])
+        adopt()
+        assert wb.flush(5)
+        assert os.path.exists(path) and "notes/theirs" not in db.docs
+    finally:
+        os.close(fd)
+        os.remove(path)
@@ -1,6 +1,5 @@
 import React, { useState, useRef, useEffect } from "react";
-import { makeTTS } from "../services/api";
-import { API_BASE } from "../services/api";
+import { streamChat } from "../services/api";
 
 export default function ChatPopup({ summary }) {
   const [open, setOpen] = useState(false);
@@ -12,6 +11,7 @@ export default function ChatPopup({ summary }) {
   ]);
   const [input, setInput] = useState("");
   const [loading, setLoading] = useState(false);
+  const [sessionId, setSessionId] = useState(null);
   const chatEndRef = useRef(null);
 
   useEffect(() => {
@@ -28,69 +28,34 @@ export default function ChatPopup({ summary }) {
     setLoading(true);
 
     try {
-      // 🧠 Determine if question is medical
-      const isMedicalPrompt = `
-        Determine if the user's message is about a medical topic such as reports, symptoms, conditions, treatments, or healthcare.
-        If yes, respond with "yes". If it's unrelated (like general, math, or random), respond with "no".
-        Message: "${userMsg.text}"
-      `;
-
-      const checkRes = await fetch(`${API_BASE}/process-text`, {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ text: isMedicalPrompt }),
-      });
-
-      const checkData = await checkRes.json();
-      const decision = checkData.summary?.toLowerCase() || "";
-
-      if (decision.includes("no")) {
-        setMessages((m) => [
-          ...m,
-          {
-            role: "assistant",
-            text: "🙏 I’m a medical assistant and can only answer health-related questions. Sorry for the inconvenience!",
-          },
-        ]);
-        setLoading(false);
-        return;
-      }
-
-      // 🧠 Context prompt for Gemini
-      const fullContext = `
-You are ClariMed AI — a friendly, factual medical assistant.
-Your task is to help the user understand their report summary and related medical concerns.
-Use clear, 6th–8th grade-level explanations. Do not give prescriptions.
-Be empathetic and brief (4–6 sentences max).
-
-Report Summary:
-${summary}
-
-Conversation so far:
-${messages
-  .map((m) => `${m.role === "user" ? "User" : "Assistant"}: ${m.text}`)
-  .join("\n")}
-
-User’s new question:
-${userMsg.text}
-`;
-
-      const res = await fetch(`${API_BASE}/process-text`, {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ text: fullContext }),
-      });
+      // One request per message: the server checks the topic locally, keeps the
+      // (compacted) history in the session and streams the answer back. The summary
+      // is only used to start a session or when it changed (e.g. an expired session).
+      setMessages((m) => [...m, { role: "assistant", text: "" }]);
+      const appendDelta = (delta) =>
+        setMessages((m) => {
+          const last = m[m.length - 1];
+          return [...m.slice(0, -1), { ...last, text: last.text + delta }];
+        });
+
+      const res = await streamChat(
+        {
+          sessionId,
+          summary,
+          question: userMsg.text,
+        },
+        appendDelta
+      );
+      setSessionId(res.session_id);
 
-      const data = await res.json();
       const aiText =
-        data.summary ||
+        res.answer ||
         "I'm sorry, I couldn’t understand that. Please rephrase your question.";
-
-      setMessages((m) => [...m, { role: "assistant", text: aiText }]);
+      setMessages((m) => [...m.slice(0, -1), { role: "assistant", text: aiText }]);
     } catch (err) {
       console.error(err);
       setMessages((m) => [
-        ...m,
+        ...m.filter((msg, i) => !(i === m.length - 1 && msg.role === "assistant" && !msg.text)),
         {
           role: "assistant",
           text: "⚠️ There was an issue connecting to the assistant. Please try again.",
@@ -1,13 +1,18 @@
-import React, { useState } from "react";
+import React, { useEffect, useState } from "react";
 import { getRecommendations, makeTTS, translateText } from "../services/api";
 import AudioPlayer from "./AudioPlayer";
 
-export default function RecommendationsPanel({ summary, lang }) {
+export default function RecommendationsPanel({ summary, lang, initialRecs }) {
   const [open, setOpen] = useState(false);
   const [loading, setLoading] = useState(false);
   const [recs, setRecs] = useState([]);
   const [audioUrl, setAudioUrl] = useState("");
 
+  // Recommendations computed by /report arrive with the rest of the report
+  useEffect(() => {
+    if (initialRecs) setRecs(initialRecs);
+  }, [initialRecs]);
+
   const handleClick = async () => {
     if (!summary) return;
     if (!open && recs.length === 0) {
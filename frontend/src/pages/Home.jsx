@@ -193,13 +193,7 @@ import ChatPopup from "../components/ChatPopup";
 // }
 
 import React, { useRef, useState, useEffect } from "react";
-import {
-  analyzePdf,
-  summarizeText,
-  translateText,
-  makeTTS,
-  uploadFile,
-} from "../services/api";
+import { runReport } from "../services/api";
 import { auth, logout } from "../firebase";
 import AudioPlayer from "../components/AudioPlayer";
 
@@ -227,6 +221,7 @@ export default function Home({ user, onLogout }) {
   const [summary, setSummary] = useState("");
   const [keyPoints, setKeyPoints] = useState([]);
   const [audioUrl, setAudioUrl] = useState("");
+  const [recs, setRecs] = useState(null);
 
   const onChooseFile = (e) => {
     const f = e.target.files?.[0];
@@ -241,6 +236,7 @@ export default function Home({ user, onLogout }) {
     setSummary("");
     setKeyPoints([]);
     setAudioUrl("");
+    setRecs(null);
     setErr("");
   };
 
@@ -263,51 +259,33 @@ export default function Home({ user, onLogout }) {
     setSummary("");
     setKeyPoints([]);
     setAudioUrl("");
+    setRecs(null);
 
     try {
-      const token = await auth.currentUser.getIdToken();
-
-      let baseText = text.trim();
-
-      // 1️⃣ Analyze PDF if provided
-      if (file) {
-        try {
-          await uploadFile(file);
-        } catch {
-          /* optional: skip upload errors */
-        }
-
-        const res = await analyzePdf(file, token);
-        if (!res.ok) throw new Error(res.error || "Analyze PDF failed");
-        setSummary(res.summary);
-        setKeyPoints(res.key_points || []);
-        baseText = res.summary;
-      } else {
-        if (!baseText) {
-          setErr("Please paste the report text for now. (OCR not enabled yet.)");
-          return;
-        }
-        const sres = await summarizeText(baseText, token);
-        if (!sres.ok) throw new Error(sres.error || "Summarization failed");
-        setSummary(sres.summary);
-        setKeyPoints(sres.key_points || []);
-        baseText = sres.summary;
-      }
-
-      // 2️⃣ Translate (if needed)
-      let speakText = baseText;
-      if (lang !== "English") {
-        const tres = await translateText(baseText, lang, token);
-        if (!tres.ok) throw new Error(tres.error || "Translation failed");
-        speakText = tres.translation;
+      const baseText = text.trim();
+      if (!file && !baseText) {
+        setErr("Please paste the report text for now. (OCR not enabled yet.)");
+        return;
       }
 
-      // 3️⃣ TTS
-      const tt = await makeTTS(speakText, token);
-      if (!tt.ok) throw new Error(tt.error || "TTS failed");
-      setAudioUrl(tt.audio_url);
-
-      
+      // One request: the server runs summary → recommendations / translation → TTS
+      // concurrently and streams each stage back as soon as it finishes.
+      const res = await runReport(
+        { file, text: baseText, targetLanguage: lang },
+        ({ stage, ok, result }) => {
+          if (!ok) return;
+          if (stage === "summary") {
+            setSummary(result.summary);
+            setKeyPoints(result.key_points || []);
+          } else if (stage === "recommendations") {
+            setRecs(result.recommendations || []);
+          } else if (stage === "tts") {
+            setAudioUrl(result.audio_url);
+          }
+        }
+      );
+      if (!res.ok) throw new Error(res.errors?.summary || "Analysis failed");
+      if (res.errors?.tts) throw new Error(res.errors.tts);
     } catch (e) {
       setErr(e?.message || String(e));
     } finally {
@@ -431,7 +409,7 @@ export default function Home({ user, onLogout }) {
     marginTop: "16px",
   }}
 >
-  <RecommendationsPanel summary={summary} lang={lang} />
+  <RecommendationsPanel summary={summary} lang={lang} initialRecs={recs} />
 
 </div>
 
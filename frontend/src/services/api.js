@@ -23,7 +23,33 @@ const cleanAxios = axios.create({
 });
 
 // ---------- uploads & files ----------
+// Uploads go straight to the bucket through a signed URL (the backend only hands
+// out the URL and verifies the object); if that is unavailable (e.g. bucket CORS
+// not configured) fall back to streaming the file through /upload.
 export async function uploadFile(file) {
+  const contentType = file.type || "application/octet-stream";
+  try {
+    const { data: slot } = await cleanAxios.post(`${API_BASE}/upload-url`, {
+      filename: file.name,
+      content_type: contentType,
+      size: file.size,
+    });
+    if (slot.ok) {
+      const put = await fetch(slot.upload_url, {
+        method: "PUT",
+        headers: { "Content-Type": slot.content_type },
+        body: file,
+      });
+      if (put.ok) {
+        const { data } = await cleanAxios.post(`${API_BASE}/upload-complete`, { path: slot.path });
+        return data; // { ok, path, url, size, content_type }
+      }
+    }
+  } catch (e) {
+    if (e.response?.status === 413) return e.response.data;
+    console.warn("Direct upload failed, falling back to /upload:", e);
+  }
+
   const fd = new FormData();
   fd.append("file", file);
   const { data } = await cleanAxios.post(`${API_BASE}/upload`, fd, {
@@ -46,6 +72,12 @@ export async function getFileUrl(path) {
   return data; // { ok, url }
 }
 
+// Batch variant for listing views: one request signs every path.
+export async function getFileUrls(paths) {
+  const { data } = await axios.post(`${API_BASE}/file-urls`, { paths });
+  return data; // { ok, urls: { path: url | null }, missing }
+}
+
 // ---------- nlp ----------
 export async function summarizeText(text) {
   const { data } = await axios.post(`${API_BASE}/process-text`, { text });
@@ -75,13 +107,87 @@ export async function getRecommendations(summary) {
 }
 
 
+// ---------- full report (one request, stages stream back as they finish) ----------
+// onEvent({ stage, ok, result | error }) is called per stage; resolves with { ok, results, errors }.
+export async function runReport({ file, text, targetLanguage, voiceId }, onEvent) {
+  let body;
+  let headers = { Accept: "text/event-stream" };
+  if (file) {
+    body = new FormData();
+    body.append("file", file);
+    if (targetLanguage) body.append("target_language", targetLanguage);
+    if (voiceId) body.append("voice_id", voiceId);
+  } else {
+    body = JSON.stringify({ text, target_language: targetLanguage, voice_id: voiceId });
+    headers["Content-Type"] = "application/json";
+  }
+
+  const res = await fetch(`${API_BASE}/report`, { method: "POST", headers, body });
+  if (!res.ok || !res.body) {
+    const data = await res.json().catch(() => ({}));
+    throw new Error(data.error || `Report failed (${res.status})`);
+  }
+
+  let done = null;
+  await readSse(res, (event, payload) => {
+    if (event === "done") done = payload;
+    else onEvent?.(payload);
+  });
+  return done || { ok: false, results: {}, errors: { report: "stream ended early" } };
+}
+
+// Calls onEvent(event, payload) for each SSE message in a fetch() response body.
+async function readSse(res, onEvent) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  for (;;) {
+    const { value, done: finished } = await reader.read();
+    if (finished) break;
+    buffer += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buffer.indexOf("\n\n")) !== -1) {
+      const raw = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      const event = /^event: (.*)$/m.exec(raw)?.[1];
+      const data = /^data: (.*)$/m.exec(raw)?.[1];
+      if (data) onEvent(event, JSON.parse(data));
+    }
+  }
+}
+
+
 // ---------- doctor chat ----------
-export async function chatWithDoctor(summary, history, question) {
-  const { data } = await axios.post(`${API_BASE}/chat`, {
+// One /chat call per message. The first call gets a session_id back; the server
+// keeps the summary and history, so later calls add only the new question.
+export async function chatWithDoctor(summary, history, question, sessionId) {
+  const { data } = await cleanAxios.post(`${API_BASE}/chat`, {
+    session_id: sessionId,
     summary,
     history,
     question,
   });
-  return data; // { ok, answer }
+  return data; // { ok, answer, session_id, on_topic }
 }
 
+// Streaming variant: onDelta(text) per chunk; resolves with the `done` body.
+export async function streamChat({ sessionId, summary, question }, onDelta) {
+  const res = await fetch(`${API_BASE}/chat`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json", Accept: "text/event-stream" },
+    body: JSON.stringify({ session_id: sessionId, summary, question }),
+  });
+  if (!res.ok || !res.body) {
+    const data = await res.json().catch(() => ({}));
+    throw new Error(data.error || `Chat failed (${res.status})`);
+  }
+
+  let done = null;
+  await readSse(res, (event, payload) => {
+    if (event === "answer") onDelta?.(payload.delta);
+    else if (event === "done") done = payload;
+    else if (event === "error") throw new Error(payload.error);
+  });
+  if (!done) throw new Error("Chat stream ended early");
+  return done;
+}